@@ -0,0 +1,110 @@
+# コマンドレイテンシのベンチマーク
+# 使用例: MONGODB_URI=mongodb://localhost:27017 python bench/bench_commands.py --concurrency 50 --commands 2000
+#
+# !respond と同じDBアクセス（イベント取得 + 回答のupsert）を並行実行し、
+# 旧実装（同期pymongoをコルーチン内で直接呼ぶ）と非同期リポジトリのp50/p99を比較する。
+# あわせてハートビート相当のタイマーの遅延（イベントループのブロック時間）も計測する。
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from pymongo import MongoClient  # noqa: E402
+
+from database import ScheduleRepository, client_options_from_env  # noqa: E402
+
+DB_NAME = 'schedule_bot_bench'
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure_loop_lag(stop, interval=0.01):
+    """イベントループが予定通りにタイマーを処理できているかを計測する"""
+    lags = []
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+    return lags
+
+
+async def run_load(respond, concurrency, total):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id):
+        async with semaphore:
+            start = time.perf_counter()
+            await respond(user_id)
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lags = await lag_task
+    return latencies, lags, elapsed
+
+
+def report(name, latencies, lags, elapsed):
+    print(
+        f"{name:>6}: {len(latencies) / elapsed:8.1f} cmd/s  "
+        f"p50={percentile(latencies, 50) * 1000:7.2f}ms  "
+        f"p99={percentile(latencies, 99) * 1000:7.2f}ms  "
+        f"loop lag max={max(lags, default=0) * 1000:7.2f}ms "
+        f"mean={statistics.fmean(lags) * 1000 if lags else 0:6.2f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="respondコマンド相当の負荷でp50/p99レイテンシを計測します")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--commands', type=int, default=2000)
+    args = parser.parse_args()
+
+    uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+    options = client_options_from_env()
+
+    # 旧実装: 同期クライアントをコルーチンから直接呼ぶ
+    sync_client = MongoClient(uri, **options)
+    sync_client.drop_database(DB_NAME)
+    sync_db = sync_client[DB_NAME]
+    event_id = sync_db['events'].insert_one({'title': 'bench', 'time_options': ['13:00', '15:00']}).inserted_id
+
+    async def sync_respond(user_id):
+        event = sync_db['events'].find_one({'_id': event_id})
+        sync_db['responses'].update_one(
+            {'event_id': event_id, 'user_id': user_id},
+            {'$set': {'username': f'user{user_id}', 'selected_times': event['time_options'][:1]}},
+            upsert=True
+        )
+
+    report('sync', *await run_load(sync_respond, args.concurrency, args.commands))
+
+    # 新実装: 非同期リポジトリ
+    repository = ScheduleRepository(uri, db_name=DB_NAME, **options)
+
+    async def async_respond(user_id):
+        event = await repository.get_event(event_id)
+        await repository.save_response(event, user_id, f'user{user_id}', 1)
+
+    report('async', *await run_load(async_respond, args.concurrency, args.commands))
+
+    await repository.close()
+    sync_client.drop_database(DB_NAME)
+    sync_client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,343 @@
+# エンドツーエンドの負荷テスト（Discordに接続せずに bot.py のBotへ合成したイベントを流し込む）
+# 使用例: MONGODB_URI=mongodb://localhost:27017 python bench/bench_e2e.py --profile burst --rate 50 --duration 30
+#
+# bench/fake_discord.py のスタブをDiscordのHTTP APIとして起動して bot.py の bot をログインさせ、
+# ゲートウェイの代わりにサーバー・メッセージ・インタラクションのイベントを直接ディスパッチする。
+# DBはローカルのmongodの --db（既定 schedule_bot_e2e）を使い、開始時と終了時にデータベースごと削除する。
+# トラフィックのプロファイル（到着のしかたとコマンドの比率）は --seed で再現でき、
+# --record で書き出したトレースを --replay で同じタイミング・同じ内容で再生できる。
+# Botの応答（インタラクションへの応答、!respond の受付メッセージ）がスタブに届くまでの時間から
+# コマンドごとのスループットとp50/p95/p99を求め、あわせてイベントループの遅延を計測する。
+
+import argparse
+import asyncio
+import collections
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from fake_discord import APPLICATION, FakeDiscord  # noqa: E402
+
+GUILD_ID = 500000000000000000
+CHANNEL_BASE = 510000000000000000
+USER_BASE = 520000000000000000
+CREATOR_ID = USER_BASE - 1
+TIME_OPTIONS = ['19:00', '20:00', '21:00-23:00', '22:00', '23:00']
+MENTION_PATTERN = re.compile(r'<@!?(\d+)>')
+
+# コマンドの比率と到着のしかた
+PROFILES = {
+    # 一定の間隔で回答が届く
+    'steady': {'shape': 'steady', 'mix': {'slash_respond': 0.6, 'toggle': 0.3, 'prefix_respond': 0.1}},
+    # 調整メッセージの投稿直後にボタンが集中する（最初の2割の時間に到着の半分が集まる）
+    'burst': {'shape': 'burst', 'mix': {'toggle': 0.85, 'slash_respond': 0.1, 'prefix_respond': 0.05}},
+    # 普段の利用（結果表示を含む）
+    'mixed': {
+        'shape': 'steady',
+        'mix': {'toggle': 0.55, 'slash_respond': 0.2, 'prefix_respond': 0.15, 'slash_results': 0.1},
+    },
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure_loop_lag(stop, interval=0.01):
+    """イベントループが予定通りにタイマーを処理できているかを計測する"""
+    lags = []
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+    return lags
+
+
+def arrival_times(rng, rate, duration, shape):
+    """平均rate件/秒のポアソン到着の時刻を返す（burstは前半2割の時間に半分が集まる）"""
+    times = []
+    t = 0.0
+    while True:
+        if shape == 'burst':
+            current = rate * 2.5 if t < duration * 0.2 else rate * 0.625
+        else:
+            current = rate
+        t += rng.expovariate(current)
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+def make_trace(profile, rate, duration, users, events, seed):
+    """(到着時刻, コマンド, ユーザー番号, イベント番号, 引数) のトレースを作る"""
+    rng = random.Random(seed)
+    kinds, weights = zip(*PROFILES[profile]['mix'].items())
+    trace = []
+    for at in arrival_times(rng, rate, duration, PROFILES[profile]['shape']):
+        kind = rng.choices(kinds, weights)[0]
+        item = {'at': at, 'kind': kind, 'user': rng.randrange(users), 'event': rng.randrange(events)}
+        if kind == 'toggle':
+            item['option'] = rng.randrange(len(TIME_OPTIONS))
+        elif kind in ('slash_respond', 'prefix_respond'):
+            picked = rng.sample(range(1, len(TIME_OPTIONS) + 1), rng.randint(1, len(TIME_OPTIONS)))
+            item['indices'] = sorted(picked)
+        trace.append(item)
+    return trace
+
+
+class Payloads:
+    """ゲートウェイのイベントと同じ形式のデータを作る"""
+
+    def __init__(self, stub):
+        self.stub = stub
+        self._sequence = itertools.count()
+
+    def snowflake(self):
+        # 作成時刻（created_at）が現在時刻になるIDを振る
+        return discord.utils.time_snowflake(discord.utils.utcnow()) + next(self._sequence) % 4096
+
+    @staticmethod
+    def user(index):
+        return {
+            'id': str(USER_BASE + index), 'username': f'user{index}', 'discriminator': '0',
+            'global_name': None, 'avatar': None,
+        }
+
+    def member(self, index):
+        return {
+            'user': self.user(index), 'roles': [], 'joined_at': datetime.now(timezone.utc).isoformat(),
+            'deaf': False, 'mute': False, 'flags': 0, 'permissions': '0',
+        }
+
+    @staticmethod
+    def guild(channels):
+        return {
+            'id': str(GUILD_ID), 'name': 'bench', 'owner_id': str(CREATOR_ID), 'features': [],
+            'emojis': [], 'stickers': [], 'member_count': 0, 'unavailable': False,
+            'roles': [{
+                'id': str(GUILD_ID), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                'hoist': False, 'managed': False, 'mentionable': False,
+            }],
+            'channels': [
+                {
+                    'id': str(CHANNEL_BASE + i), 'name': f'bench-{i}', 'type': 0, 'position': i,
+                    'permission_overwrites': [], 'nsfw': False, 'parent_id': None, 'rate_limit_per_user': 0,
+                }
+                for i in range(channels)
+            ],
+        }
+
+    def message(self, channel_id, user_index, content):
+        member = self.member(user_index)
+        author = member.pop('user')
+        return {
+            'id': str(self.snowflake()), 'channel_id': str(channel_id), 'guild_id': str(GUILD_ID),
+            'author': author, 'member': member, 'content': content, 'type': 0,
+            'timestamp': datetime.now(timezone.utc).isoformat(), 'edited_timestamp': None,
+            'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+            'attachments': [], 'embeds': [], 'pinned': False,
+        }
+
+    def _interaction(self, interaction_type, channel_id, user_index, data, message=None):
+        payload = {
+            'id': str(self.snowflake()), 'application_id': APPLICATION['id'], 'type': interaction_type,
+            'token': f'token-{next(self._sequence)}', 'version': 1, 'guild_id': str(GUILD_ID),
+            'channel_id': str(channel_id), 'channel': {'id': str(channel_id), 'type': 0, 'guild_id': str(GUILD_ID)},
+            'member': self.member(user_index), 'data': data, 'locale': 'ja', 'guild_locale': 'ja',
+            'app_permissions': '0', 'entitlements': [], 'authorizing_integration_owners': {}, 'context': 0,
+        }
+        if message is not None:
+            payload['message'] = message
+        return payload
+
+    def slash(self, channel_id, user_index, name, options):
+        data = {
+            'id': str(self.snowflake()), 'name': name, 'type': 1,
+            'options': [{'name': key, 'type': 3, 'value': value} for key, value in options.items()],
+        }
+        return self._interaction(2, channel_id, user_index, data)
+
+    def button(self, channel_id, user_index, message_id, custom_id):
+        # 押されたボタンを含む調整メッセージ（DynamicItemの復元に使われる）
+        message = self.stub.message_payload(channel_id, {
+            'components': [{'type': 1, 'components': [{'type': 2, 'style': 2, 'label': 'option', 'custom_id': custom_id}]}],
+        }, message_id)
+        data = {'custom_id': custom_id, 'component_type': 2}
+        return self._interaction(3, channel_id, user_index, data, message)
+
+
+class LoadRun:
+    """トレースを再生し、Botの応答が返るまでの時間を集計する"""
+
+    def __init__(self, app, payloads, events):
+        self.app = app
+        self.payloads = payloads
+        self.events = events
+        self.pending_interactions = {}
+        self.pending_acks = collections.defaultdict(collections.deque)
+        self.latencies = collections.defaultdict(list)
+        self.sent = collections.Counter()
+        self.idle = asyncio.Event()
+
+    def observe(self, kind, key, payload):
+        """スタブがBotの応答を受け付けたときに呼ばれる"""
+        now = time.perf_counter()
+        if kind == 'interaction':
+            pending = self.pending_interactions.pop(key, None)
+            if pending:
+                self.latencies[pending[0]].append(now - pending[1])
+        elif kind == 'message':
+            for user_id in MENTION_PATTERN.findall(payload.get('content') or ''):
+                queue = self.pending_acks.get(user_id)
+                if queue:
+                    self.latencies['prefix_respond'].append(now - queue.popleft())
+        if not self.pending_interactions and not any(self.pending_acks.values()):
+            self.idle.set()
+
+    def dispatch(self, item):
+        state = self.app.bot._connection
+        event = self.events[item['event']]
+        channel_id = event['channel_id']
+        kind = item['kind']
+        self.sent[kind] += 1
+        self.idle.clear()
+        if kind == 'prefix_respond':
+            content = f"!respond {event['_id']} {' '.join(map(str, item['indices']))}"
+            self.pending_acks[str(USER_BASE + item['user'])].append(time.perf_counter())
+            state.parse_message_create(self.payloads.message(channel_id, item['user'], content))
+            return
+        if kind == 'toggle':
+            custom_id = f"schedule:toggle:{event['_id']}:{item['option']}"
+            payload = self.payloads.button(channel_id, item['user'], event['message_id'], custom_id)
+        elif kind == 'slash_respond':
+            payload = self.payloads.slash(channel_id, item['user'], 'schedule_respond', {
+                'event_id': str(event['_id']), 'time_indices': ' '.join(map(str, item['indices'])),
+            })
+        else:
+            payload = self.payloads.slash(channel_id, item['user'], 'schedule_results', {'event_id': str(event['_id'])})
+        self.pending_interactions[payload['id']] = (kind, time.perf_counter())
+        state.parse_interaction_create(payload)
+
+    async def replay(self, trace, drain_timeout):
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        started = time.perf_counter()
+        for item in trace:
+            await asyncio.sleep(max(0.0, started + item['at'] - time.perf_counter()))
+            self.dispatch(item)
+        try:
+            await asyncio.wait_for(self.idle.wait(), drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        stop.set()
+        return elapsed, await lag_task
+
+
+def report(run, elapsed, lags, stub_stats):
+    completed = sum(len(values) for values in run.latencies.values())
+    sent = sum(run.sent.values())
+    print(f"sent={sent} completed={completed} unanswered={sent - completed} "
+          f"elapsed={elapsed:.1f}s throughput={completed / elapsed:.1f}/s")
+    for kind in sorted(run.sent):
+        values = run.latencies.get(kind) or [float('nan')]
+        print(
+            f"{kind:>15}: n={len(run.latencies.get(kind, [])):6d}  p50={percentile(values, 50) * 1000:8.1f}ms  "
+            f"p95={percentile(values, 95) * 1000:8.1f}ms  p99={percentile(values, 99) * 1000:8.1f}ms  "
+            f"max={max(values) * 1000:8.1f}ms"
+        )
+    if lags:
+        print(f"{'loop lag':>15}: p50={percentile(lags, 50) * 1000:8.1f}ms  p99={percentile(lags, 99) * 1000:8.1f}ms  "
+              f"max={max(lags) * 1000:8.1f}ms")
+    print(f"{'discord stub':>15}: messages={stub_stats['messages']} edits={stub_stats['edits']} "
+          f"429s={stub_stats['rate_limited']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="bot.py のBotに合成したトラフィックを流し、応答のレイテンシを計測します")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed')
+    parser.add_argument('--rate', type=float, default=30.0, help="平均の到着数（件/秒）")
+    parser.add_argument('--duration', type=float, default=30.0, help="トラフィックを流す時間（秒）")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--events', type=int, default=5)
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help="生成したトレースをJSON Linesで書き出す")
+    parser.add_argument('--replay', help="--record で書き出したトレースを再生する")
+    parser.add_argument('--drain-timeout', type=float, default=30.0, help="最後の送信後に応答を待つ最大秒数")
+    parser.add_argument('--latency', type=float, default=0.05, help="スタブの応答遅延（秒）")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--health-port', type=int, default=10100)
+    parser.add_argument('--db', default='schedule_bot_e2e')
+    args = parser.parse_args()
+    if args.db == 'schedule_bot':
+        parser.error("本番と同じデータベース名は使えません（終了時に削除するため）")
+
+    # bot.py はimport時に環境変数を読むため、先に設定する
+    os.environ.setdefault('DISCORD_TOKEN', 'bench-token')
+    os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+    os.environ['MONGODB_DB'] = args.db
+    os.environ['PORT'] = str(args.health_port)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.replay:
+        with open(args.replay, encoding='utf-8') as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+    else:
+        trace = make_trace(args.profile, args.rate, args.duration, args.users, args.events, args.seed)
+    if args.record:
+        with open(args.record, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(item) + '\n' for item in trace)
+    events_needed = max(item['event'] for item in trace) + 1 if trace else args.events
+
+    stub = FakeDiscord(port=args.port, latency=args.latency)
+    await stub.start()
+    discord.http.Route.BASE = stub.base_url
+    # インタラクションへの応答はWebhook用のクライアントから送られる
+    discord.webhook.async_.Route.BASE = stub.base_url
+
+    app = importlib.import_module('bot')
+    await app.repository.client.drop_database(args.db)
+    try:
+        async with app.bot:
+            await app.bot.login(os.environ['DISCORD_TOKEN'])
+            # インデックスの作成とコマンドの同期が終わってから始める
+            await app.bot.warmup_task
+            payloads = Payloads(stub)
+            app.bot._connection._add_guild_from_data(payloads.guild(args.channels))
+
+            events = []
+            for i in range(events_needed):
+                event = await app.service.create_event(
+                    GUILD_ID, CHANNEL_BASE + i % args.channels, CREATOR_ID, f'bench {i}', '2099-01-01', TIME_OPTIONS
+                )
+                message_id = payloads.snowflake()
+                await app.service.attach_message(event['_id'], message_id)
+                events.append({'_id': event['_id'], 'channel_id': event['channel_id'], 'message_id': message_id})
+
+            run = LoadRun(app, payloads, events)
+            stub.observer = run.observe
+            elapsed, lags = await run.replay(trace, args.drain_timeout)
+            report(run, elapsed, lags, stub.stats())
+
+            await app.service.flush()
+            await app.repository.client.drop_database(args.db)
+    finally:
+        await stub.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+# 回答の受付メッセージの送信キューの負荷テスト
+# 使用例: python bench/bench_outbound.py --responses 300 --channels 3 --duration 10
+#
+# bench/fake_discord.py のスタブにdiscord.pyを向け、複数のチャンネルで数秒間に多数の回答が届く状況を再現する。
+# 1件ずつ channel.send する場合と OutboundDispatcher でまとめて送る場合について、
+# コマンドが送信で待たされた時間・送信したメッセージ数・429の回数を比較する。
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from fake_discord import FakeDiscord  # noqa: E402
+from outbound import OutboundDispatcher  # noqa: E402
+
+
+def make_workload(responses, channels, duration):
+    """(到着時刻, チャンネル番号, ユーザーID) のリストを返す"""
+    rng = random.Random(0)
+    return sorted(
+        (rng.uniform(0, duration), rng.randrange(channels), 300000000000000000 + i)
+        for i in range(responses)
+    )
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def replay(workload, acknowledge):
+    """到着時刻どおりにコマンドを実行し、各コマンドが受付の送信で待たされた時間を返す"""
+    blocked = []
+    start = time.perf_counter()
+
+    async def command(at, channel_index, user_id):
+        await asyncio.sleep(max(0.0, start + at - time.perf_counter()))
+        began = time.perf_counter()
+        await acknowledge(channel_index, f'<@{user_id}>')
+        blocked.append(time.perf_counter() - began)
+
+    await asyncio.gather(*(command(*item) for item in workload))
+    return blocked
+
+
+async def run(name, stub, workload, channels, make_acknowledge):
+    async with discord.Client(intents=discord.Intents.none()) as client:
+        await client.http.static_login('bench-token')
+        targets = [client.get_partial_messageable(400000000000000000 + i) for i in range(channels)]
+        before = stub.stats()
+        started = time.perf_counter()
+        acknowledge, drain = make_acknowledge(targets)
+        blocked = await replay(workload, acknowledge)
+        await drain()
+        elapsed = time.perf_counter() - started
+        after = stub.stats()
+        await client.close()
+
+    print(
+        f"{name:>8}: blocked p50 {percentile(blocked, 0.5) * 1000:8.1f}ms  "
+        f"p95 {percentile(blocked, 0.95) * 1000:8.1f}ms  max {max(blocked) * 1000:8.1f}ms  "
+        f"mean {statistics.mean(blocked) * 1000:8.1f}ms"
+    )
+    print(
+        f"          messages={after['messages'] - before['messages']} "
+        f"429s={after['rate_limited'] - before['rate_limited']} total {elapsed:.2f}s"
+    )
+
+
+def direct(targets):
+    async def acknowledge(channel_index, mention):
+        await targets[channel_index].send(f"{mention} さんの回答を登録しました。")
+
+    async def drain():
+        pass
+    return acknowledge, drain
+
+
+def queued(coalesce_window):
+    def make(targets):
+        dispatcher = OutboundDispatcher(coalesce_window=coalesce_window)
+
+        async def acknowledge(channel_index, mention):
+            dispatcher.acknowledge(targets[channel_index], mention)
+            # 実際のコマンドと同じく、ほかのコルーチンに制御を渡す
+            await asyncio.sleep(0)
+
+        async def drain():
+            await dispatcher.close(timeout=None)
+        return acknowledge, drain
+    return make
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="回答の受付メッセージの直接送信と送信キューを比較します")
+    parser.add_argument('--responses', type=int, default=300)
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=10.0, help="回答が届く期間（秒）")
+    parser.add_argument('--window', type=float, default=0.5, help="受付メッセージをまとめる待ち時間（秒）")
+    parser.add_argument('--latency', type=float, default=0.05, help="スタブの応答遅延（秒）")
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    stub = FakeDiscord(port=args.port, latency=args.latency)
+    await stub.start()
+    discord.http.Route.BASE = stub.base_url
+    workload = make_workload(args.responses, args.channels, args.duration)
+
+    try:
+        await run('direct', stub, workload, args.channels, direct)
+        await run('queued', stub, workload, args.channels, queued(args.window))
+    finally:
+        await stub.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+# おすすめ算出のベンチマーク（MongoDB不要）
+# 使用例: python bench/bench_recommend.py --members 5000 --events 4 --options 100
+#
+# 数千人のメンバーと数百件の候補（イベント数 × 時間オプション数）でビットセットを作り、
+# 単一イベントのランキングと複数イベントの組み合わせランキングにかかる時間を計測する。
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from recommend import AvailabilityMatrix, UserIndex, rank_combinations, rank_options  # noqa: E402
+
+
+class FakeRepository:
+    """メモリ上の回答をカーソルのように返すスタブ"""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    async def iter_availability(self, event_id):
+        for response in self.responses[event_id]:
+            yield response
+
+
+def make_events(members, events, options, density, rng):
+    time_options = [f"{i // 4:02d}:{i % 4 * 15:02d}" for i in range(options)]
+    event_docs = [{'_id': e, 'title': f'event{e}', 'time_options': time_options} for e in range(events)]
+    responses = {
+        e: [
+            {'user_id': user_id, 'selected_mask': sum(1 << i for i in range(options) if rng.random() < density)}
+            for user_id in range(members)
+        ]
+        for e in range(events)
+    }
+    return event_docs, FakeRepository(responses)
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:>28}: {(time.perf_counter() - start) * 1000:9.2f}ms")
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="ビットセットによるおすすめ算出の速度を計測します")
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=4)
+    parser.add_argument('--options', type=int, default=100)
+    parser.add_argument('--density', type=float, default=0.3)
+    parser.add_argument('--required', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    events, repository = make_events(args.members, args.events, args.options, args.density, rng)
+    print(f"members={args.members} candidates={args.events * args.options}")
+
+    user_index = UserIndex()
+    start = time.perf_counter()
+    matrices = [await AvailabilityMatrix.load(repository, event, user_index) for event in events]
+    print(f"{'build bitsets':>28}: {(time.perf_counter() - start) * 1000:9.2f}ms")
+
+    required_mask = user_index.mask(rng.sample(range(args.members), args.required)) or 0
+    quorum = int(args.members * args.density ** args.events * 0.8)
+
+    timed('rank options (1 event)', lambda: rank_options(matrices[0], quorum=quorum))
+    timed('rank options + required', lambda: rank_options(matrices[0], required_mask=required_mask))
+    best = timed('rank combinations', lambda: rank_combinations(matrices, quorum=quorum))
+    timed('rank combinations + required', lambda: rank_combinations(matrices, required_mask=required_mask))
+    if best:
+        print(f"best combination: {best[0][0]} -> {best[0][1]} members")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+# 結果集計のベンチマーク
+# 使用例: MONGODB_URI=mongodb://localhost:27017 python bench/bench_results.py --responses 10000
+#
+# 旧実装（全回答をリストに読み込みPythonで集計）と、現在のBotの結果表示
+# （イベントに保存した集計カウンター + 参加者一覧の最初のページと次のページのキーセットページネーション）を比較する。
+# 回答は旧形式（selected_times）と現在の形式（selected_mask）の両方を持たせて、それぞれの実装で読む。
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import ScheduleRepository, client_options_from_env  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from service import PAGE_SIZE  # noqa: E402
+from timeslots import mask_from_times, selected_labels  # noqa: E402
+
+DB_NAME = 'schedule_bot_bench'
+
+
+async def old_path(repository, event):
+    responses = await repository.responses.find({'event_id': event['_id']}).to_list()
+    time_counts = {label: 0 for label in event['time_options']}
+    user_responses = {}
+    for response in responses:
+        user_responses[response['username']] = response['selected_times']
+        for label in response['selected_times']:
+            if label in time_counts:
+                time_counts[label] += 1
+    users_results = [f"{username}: {', '.join(times)}" for username, times in user_responses.items()]
+    return time_counts, "\n".join(users_results)
+
+
+async def new_path(repository, event):
+    # /schedule_results と同じく、カウンター付きのイベントと1ページ目を読み、「次へ」で2ページ目を読む
+    event = await repository.get_event_with_counts(event['_id'])
+    users_results = []
+    page, has_next = await repository.participants_page(event['_id'], limit=PAGE_SIZE)
+    if has_next:
+        page += (await repository.participants_page(event['_id'], after=page[-1]['_id'], limit=PAGE_SIZE))[0]
+    for response in page:
+        users_results.append(f"{response['username']}: {', '.join(selected_labels(event, response['selected_mask']))}")
+    return event['counts'], "\n".join(users_results)
+
+
+async def timed(name, func, repository, event, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        counts, _ = await func(repository, event)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{name:>4}: median={timings[len(timings) // 2] * 1000:8.2f}ms  max={timings[-1] * 1000:8.2f}ms")
+    return counts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="結果表示の旧実装と現在の実装を比較します")
+    parser.add_argument('--responses', type=int, default=10000)
+    parser.add_argument('--options', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    repository = ScheduleRepository(
+        os.getenv('MONGODB_URI', 'mongodb://localhost:27017'), db_name=DB_NAME, **client_options_from_env()
+    )
+    await repository.client.drop_database(DB_NAME)
+
+    time_options = [f"{13 + i}:00" for i in range(args.options)]
+    event_id = (await repository.events.insert_one({'title': 'bench', 'time_options': time_options})).inserted_id
+    event = await repository.get_event(event_id)
+    responses = []
+    for i in range(args.responses):
+        selected_times = random.sample(time_options, random.randint(1, len(time_options)))
+        responses.append({
+            'event_id': event_id,
+            'user_id': i,
+            'username': f'user{i}',
+            'selected_times': selected_times,
+            'selected_mask': mask_from_times(event, selected_times)
+        })
+    await repository.responses.insert_many(responses)
+    await ensure_indexes(repository.db)
+    await repository.rebuild_counts(event)
+
+    old_counts = await timed('old', old_path, repository, event, args.rounds)
+    new_counts = await timed('new', new_path, repository, event, args.rounds)
+    assert [old_counts[t] for t in time_options] == new_counts, 'tally mismatch'
+
+    await repository.client.drop_database(DB_NAME)
+    await repository.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,175 @@
+# サービス層のベンチマーク（回帰検出用）
+# 使用例: MONGODB_URI=mongodb://localhost:27017 python bench/bench_service.py --events 200 --responses 2000
+#
+# Discordを介さずに ScheduleService の create / respond / results / delete を並行実行し、
+# 操作ごとのスループットとp50/p99を計測する。結果は --history のJSON Lines（既定 bench/history/service.jsonl）
+# に追記し、直近 --baseline 回の中央値より --max-regression 以上遅くなった操作があれば終了コード1で終わる。
+# デプロイ前にCIなどで実行すると、性能の劣化を早めに検出できる。
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import ScheduleRepository, client_options_from_env  # noqa: E402
+from guild_config import GuildConfigStore  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from scheduler import TimerScheduler  # noqa: E402
+from service import ScheduleService  # noqa: E402
+
+DB_NAME = 'schedule_bot_bench'
+GUILD_ID = 1
+CHANNEL_ID = 2
+CREATOR_ID = 3
+TIME_OPTIONS = ['13:00', '15:00', '17:00', '19:00', '21:00']
+OPERATIONS = ['create', 'respond', 'results', 'delete']
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure(calls, concurrency):
+    """callsを並行実行し、スループットとp50/p99を返す"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(call):
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(call) for call in calls))
+    elapsed = time.perf_counter() - started
+    return {
+        'ops_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(service, events, responses, concurrency):
+    rng = random.Random(0)
+    created = []
+    results = {}
+
+    async def create(i):
+        event = await service.create_event(GUILD_ID, CHANNEL_ID, CREATOR_ID, f'bench {i}', '2030-01-01', TIME_OPTIONS)
+        created.append(event['_id'])
+
+    results['create'] = await measure([lambda i=i: create(i) for i in range(events)], concurrency)
+
+    def respond(user_id):
+        indices = [str(i + 1) for i in rng.sample(range(len(TIME_OPTIONS)), rng.randint(1, len(TIME_OPTIONS)))]
+        event_id = rng.choice(created)
+        return lambda: service.respond(GUILD_ID, event_id, user_id, f'user{user_id}', indices)
+
+    results['respond'] = await measure([respond(user_id) for user_id in range(responses)], concurrency)
+    results['results'] = await measure(
+        [lambda event_id=event_id: service.results(GUILD_ID, event_id) for event_id in created], concurrency
+    )
+    results['delete'] = await measure(
+        [lambda event_id=event_id: service.delete_event(GUILD_ID, event_id, CREATOR_ID) for event_id in created],
+        concurrency
+    )
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_regressions(results, parameters, history, baseline, max_regression):
+    """同じパラメーターでの直近baseline回の中央値と比べて、スループットが落ちた操作を返す"""
+    history = [run for run in history if run['parameters'] == parameters][-baseline:]
+    regressions = []
+    for operation in OPERATIONS:
+        previous = [run['results'][operation]['ops_per_sec'] for run in history if operation in run['results']]
+        if not previous:
+            continue
+        expected = statistics.median(previous)
+        actual = results[operation]['ops_per_sec']
+        if actual < expected * (1 - max_regression):
+            regressions.append((operation, expected, actual))
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="サービス層の各操作のスループットを計測し、過去の結果と比較します")
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--responses', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--history', default=os.path.join(os.path.dirname(__file__), 'history', 'service.jsonl'))
+    parser.add_argument('--baseline', type=int, default=5, help="比較に使う直近の実行回数")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="許容するスループットの低下率")
+    parser.add_argument('--no-record', action='store_true', help="結果を履歴に追記しない")
+    args = parser.parse_args()
+
+    repository = ScheduleRepository(
+        os.getenv('MONGODB_URI', 'mongodb://localhost:27017'), db_name=DB_NAME, **client_options_from_env()
+    )
+    await repository.client.drop_database(DB_NAME)
+    await ensure_indexes(repository.db)
+    # タイマーは登録するだけで実行はしない（作成時のコストを本番と揃える）
+    service = ScheduleService(
+        repository, GuildConfigStore(repository.db['guild_configs']), scheduler=TimerScheduler(repository.db['timers'])
+    )
+
+    try:
+        results = await run(service, args.events, args.responses, args.concurrency)
+    finally:
+        await repository.client.drop_database(DB_NAME)
+        await repository.close()
+
+    for operation in OPERATIONS:
+        result = results[operation]
+        print(
+            f"{operation:>8}: {result['ops_per_sec']:8.1f} ops/s  "
+            f"p50={result['p50_ms']:7.2f}ms  p99={result['p99_ms']:7.2f}ms"
+        )
+
+    parameters = {'events': args.events, 'responses': args.responses, 'concurrency': args.concurrency}
+    history = load_history(args.history)
+    regressions = find_regressions(results, parameters, history, args.baseline, args.max_regression)
+    for operation, expected, actual in regressions:
+        print(f"REGRESSION {operation}: {actual:.1f} ops/s (baseline {expected:.1f} ops/s)")
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'time': datetime.now(timezone.utc).isoformat(),
+                'revision': git_revision(),
+                'parameters': parameters,
+                'results': results,
+            }) + '\n')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,111 @@
+# 回答の書き込みバッファの負荷テスト
+# 使用例: MONGODB_URI=mongodb://localhost:27017 python bench/bench_write_buffer.py --users 200 --responses 5000
+#
+# イベント告知直後のように多数のユーザーが数秒以内に回答（一部は回答し直し）する状況を再現し、
+# 1件ずつupsertする場合とwrite-behindバッファでまとめて書き込む場合のスループットを比較する。
+# 最後に両方の集計カウンターが回答コレクションから再計算した値と一致することを確認する。
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import ScheduleRepository, client_options_from_env  # noqa: E402
+from write_buffer import ResponseWriteBuffer  # noqa: E402
+
+DB_NAME = 'schedule_bot_bench'
+TIME_OPTIONS = ['13:00', '15:00', '17:00', '19:00', '21:00']
+
+
+def make_workload(users, responses):
+    rng = random.Random(0)
+    return [
+        (rng.randrange(users), rng.sample(TIME_OPTIONS, rng.randint(1, len(TIME_OPTIONS))))
+        for _ in range(responses)
+    ]
+
+
+async def setup_event(repository):
+    await repository.client.drop_database(DB_NAME)
+    await repository.responses.create_index([('event_id', 1), ('user_id', 1)], unique=True)
+    event_id = await repository.create_event(0, 0, 0, 'bench', None, TIME_OPTIONS)
+    return await repository.get_event(event_id)
+
+
+async def verify(repository, event):
+    stored = (await repository.get_event_with_counts(event['_id']))['counts']
+    rebuilt = await repository.rebuild_counts(event)
+    assert stored == rebuilt, f'counter drift: {stored} != {rebuilt}'
+
+
+async def run_direct(repository, workload, concurrency):
+    event = await setup_event(repository)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id, selected):
+        async with semaphore:
+            await repository.save_response(event, user_id, f'user{user_id}', selected)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(user_id, selected) for user_id, selected in workload))
+    elapsed = time.perf_counter() - start
+    await verify(repository, event)
+    return elapsed, elapsed
+
+
+async def run_buffered(repository, workload, concurrency, max_batch, flush_interval):
+    event = await setup_event(repository)
+    buffer = ResponseWriteBuffer(repository, max_batch=max_batch, flush_interval=flush_interval)
+    buffer.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id, selected):
+        async with semaphore:
+            buffer.add(event, user_id, f'user{user_id}', selected)
+            # 実際のコマンドと同じく、ほかのコルーチンに制御を渡す
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(user_id, selected) for user_id, selected in workload))
+    acknowledged = time.perf_counter() - start
+    await buffer.close()
+    durable = time.perf_counter() - start
+    await verify(repository, event)
+    print(f"          flushed={buffer.flushed} coalesced={buffer.coalesced}")
+    return acknowledged, durable
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="回答の1件ずつの書き込みとwrite-behindバッファを比較します")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--responses', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.2)
+    args = parser.parse_args()
+
+    repository = ScheduleRepository(
+        os.getenv('MONGODB_URI', 'mongodb://localhost:27017'), db_name=DB_NAME, **client_options_from_env()
+    )
+    workload = make_workload(args.users, args.responses)
+
+    for name, run in [
+        ('direct', lambda: run_direct(repository, workload, args.concurrency)),
+        ('buffered', lambda: run_buffered(repository, workload, args.concurrency, args.batch, args.interval)),
+    ]:
+        acknowledged, durable = await run()
+        print(
+            f"{name:>8}: acknowledged {len(workload) / acknowledged:10.1f} resp/s  "
+            f"durable {len(workload) / durable:8.1f} resp/s  ({durable:.2f}s)"
+        )
+
+    await repository.client.drop_database(DB_NAME)
+    await repository.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
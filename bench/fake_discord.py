@@ -0,0 +1,266 @@
+# Discord HTTP APIの簡易スタブ（負荷テスト用）
+# 使用例: python bench/fake_discord.py --port 8081
+#
+# discord.http.Route.BASE を http://127.0.0.1:8081/api/v10 に向けると、Botのメッセージ送信・編集と
+# インタラクションへの応答をローカルで受け付ける。メッセージの送信・編集はチャンネルごとに
+# 本物と同じ 5回/5秒 のレート制限を再現し、超えた場合は429とレート制限のヘッダーを返す。
+# ほかのベンチマークからは FakeDiscord を直接起動して、受け付けた件数や429の回数を確認できる。
+# observerを渡すと、Botの応答（メッセージの送信・編集とインタラクションへの応答）を受け付けるたびに呼ばれる。
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+BOT_USER = {
+    'id': '100000000000000001',
+    'username': 'schedule-bot',
+    'discriminator': '0',
+    'global_name': None,
+    'avatar': None,
+    'bot': True,
+}
+
+APPLICATION = {
+    'id': BOT_USER['id'],
+    'name': BOT_USER['username'],
+    'icon': None,
+    'description': '',
+    'rpc_origins': [],
+    'bot_public': True,
+    'bot_require_code_grant': False,
+    'owner': BOT_USER,
+    'summary': '',
+    'verify_key': '0' * 64,
+    'team': None,
+    'flags': 0,
+}
+
+
+def json_response(data, status=200, headers=None):
+    """
+    JSONの応答を返す
+    web.json_response は 'application/json; charset=utf-8' を返すが、discord.py は Content-Type が
+    'application/json' と完全に一致する場合しかJSONとして解釈しないため、charsetを付けない
+    """
+    return web.Response(
+        body=json.dumps(data).encode('utf-8'), status=status, headers=headers, content_type='application/json'
+    )
+
+
+class RateLimitWindow:
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.reset_at = 0.0
+        self.used = 0
+
+    def hit(self):
+        """リクエストを1回数え、制限を超えていればTrueを返す"""
+        now = time.time()
+        if now >= self.reset_at:
+            self.reset_at = now + self.per
+            self.used = 0
+        self.used += 1
+        return self.used > self.limit
+
+    def headers(self, bucket):
+        return {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(max(0, self.limit - self.used)),
+            'X-RateLimit-Reset': f'{self.reset_at:.3f}',
+            'X-RateLimit-Reset-After': f'{max(0.0, self.reset_at - time.time()):.3f}',
+            'X-RateLimit-Bucket': bucket,
+        }
+
+
+class FakeDiscord:
+    def __init__(self, host='127.0.0.1', port=8081, limit=5, per=5.0, latency=0.05, observer=None):
+        self.host = host
+        self.port = port
+        self.limit = limit
+        self.per = per
+        self.latency = latency
+        # observer(kind, key, payload): kind は 'message' / 'edit' / 'interaction'
+        self.observer = observer or (lambda kind, key, payload: None)
+        self._windows = {}
+        self._ids = itertools.count(200000000000000000)
+        self._runner = None
+        self.requests = 0
+        self.messages = 0
+        self.edits = 0
+        self.rate_limited = 0
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/api/v10'
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([
+            web.get('/api/v10/users/@me', self.get_user),
+            web.get('/api/v10/oauth2/applications/@me', self.get_application),
+            web.put('/api/v10/applications/{application_id}/commands', self.sync_commands),
+            web.put('/api/v10/applications/{application_id}/guilds/{guild_id}/commands', self.sync_commands),
+            web.post('/api/v10/channels/{channel_id}/messages', self.create_message),
+            web.patch('/api/v10/channels/{channel_id}/messages/{message_id}', self.edit_message),
+            web.post('/api/v10/interactions/{interaction_id}/{token}/callback', self.interaction_callback),
+            web.get('/api/v10/webhooks/{application_id}/{token}/messages/@original', self.original_response),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'messages': self.messages,
+            'edits': self.edits,
+            'rate_limited': self.rate_limited,
+        }
+
+    def message_payload(self, channel_id, payload, message_id=None):
+        return {
+            'id': str(message_id or next(self._ids)),
+            'channel_id': str(channel_id),
+            'type': 0,
+            'author': BOT_USER,
+            'content': payload.get('content') or '',
+            'embeds': payload.get('embeds') or [],
+            'components': payload.get('components') or [],
+            'attachments': [],
+            'mentions': [],
+            'mention_roles': [],
+            'mention_everyone': False,
+            'pinned': False,
+            'tts': False,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'edited_timestamp': None,
+        }
+
+    async def _rate_limited(self, route, channel_id, handler):
+        """チャンネルごとのレート制限を適用してhandlerの応答を返す"""
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        # 制限はチャンネルごとに数えるが、バケットのハッシュは本物と同じくルートごとに1つ
+        # （discord.py はハッシュとチャンネルIDの組み合わせで制限を管理する）
+        window = self._windows.setdefault(f'{route}:{channel_id}', RateLimitWindow(self.limit, self.per))
+        limited = window.hit()
+        headers = window.headers(route)
+        if limited:
+            self.rate_limited += 1
+            retry_after = max(0.0, window.reset_at - time.time())
+            # discord.py は Via ヘッダーのない429をCloudflareによるブロックとみなして再試行しない
+            headers.update({'Retry-After': f'{retry_after:.3f}', 'X-RateLimit-Scope': 'user', 'Via': '1.1 google'})
+            return json_response(
+                {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                status=429, headers=headers
+            )
+        return json_response(await handler(), headers=headers)
+
+    async def _payload(self, request):
+        # 添付ファイル付きの送信は multipart の payload_json に本体が入る
+        if request.content_type == 'multipart/form-data':
+            form = await request.post()
+            return json.loads(form['payload_json'])
+        if request.can_read_body:
+            return await request.json()
+        return {}
+
+    async def get_user(self, request):
+        self.requests += 1
+        return json_response(BOT_USER)
+
+    async def get_application(self, request):
+        self.requests += 1
+        return json_response(APPLICATION)
+
+    async def sync_commands(self, request):
+        """コマンドの同期（送られた定義にIDを付けて返す）"""
+        self.requests += 1
+        commands = await request.json()
+        return json_response([
+            {**command, 'id': str(next(self._ids)), 'application_id': APPLICATION['id'], 'version': '1'}
+            for command in commands
+        ])
+
+    async def create_message(self, request):
+        channel_id = request.match_info['channel_id']
+
+        async def handler():
+            payload = await self._payload(request)
+            self.messages += 1
+            self.observer('message', channel_id, payload)
+            return self.message_payload(channel_id, payload)
+        return await self._rate_limited('create_message', channel_id, handler)
+
+    async def edit_message(self, request):
+        channel_id = request.match_info['channel_id']
+
+        async def handler():
+            payload = await self._payload(request)
+            self.edits += 1
+            self.observer('edit', channel_id, payload)
+            return self.message_payload(channel_id, payload, request.match_info['message_id'])
+        return await self._rate_limited('edit_message', channel_id, handler)
+
+    async def interaction_callback(self, request):
+        # インタラクションへの応答はチャンネルのレート制限を受けない
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        interaction_id = request.match_info['interaction_id']
+        body = await self._payload(request)
+        self.observer('interaction', interaction_id, body)
+        # discord.py 2.5 は with_response=1 を付けて応答の結果を受け取る
+        if request.query.get('with_response', '').lower() not in ('1', 'true'):
+            return web.Response(status=204)
+        data = body.get('data') or {}
+        message = self.message_payload(0, data)
+        return json_response({
+            'interaction': {
+                'id': interaction_id,
+                'type': 2,
+                'response_message_id': message['id'],
+                'response_message_loading': body.get('type') == 5,
+                'response_message_ephemeral': bool(data.get('flags', 0) & 64),
+            },
+            'resource': {'type': body.get('type', 4), 'message': message},
+        })
+
+    async def original_response(self, request):
+        self.requests += 1
+        return json_response(self.message_payload(0, {}))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Discord HTTP APIの簡易スタブを起動します")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help="1リクエストあたりの応答遅延（秒）")
+    args = parser.parse_args()
+
+    stub = FakeDiscord(args.host, args.port, latency=args.latency)
+    await stub.start()
+    print(f"Fake Discord API listening on {stub.base_url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(stub.stats())
+    finally:
+        await stub.stop()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,123 @@
+# 毎週の参加可能時間（プロフィール）
+# メンバーごとの「毎週この曜日のこの時刻なら参加できる」を availability_profiles コレクションに保存し、
+# (サーバー, 曜日と時刻) → ユーザーIDの一覧を availability_index コレクションに持つ。
+# インデックスはプロフィールが変わったときに差分だけ更新するため、イベント作成時はプロフィールを走査せずに
+# 時間オプションごとの参加予定者を求められる。
+
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+
+from database import JST
+from timeslots import TIME_OPTION_PATTERN, WEEKDAYS, option_start
+
+# 1人が登録できる曜日と時刻の組み合わせの数
+MAX_PROFILE_SLOTS = 100
+
+
+def slot_key(weekday, hour, minute):
+    """インデックスのキー（例: 水曜21時なら '2-21:00'）"""
+    return f'{weekday}-{hour:02d}:{minute:02d}'
+
+
+def option_slot_key(event, index):
+    """時間オプションの開始日時に対応するキーを返す（日時を持たないオプションはNone）"""
+    start = option_start(event, index)
+    if start is None:
+        return None
+    start = start.astimezone(JST)
+    return slot_key(start.weekday(), start.hour, start.minute)
+
+
+def parse_profile(tokens):
+    """
+    '水土 21:00 日 13:00 15:00' のような指定をキーの集合に変換する
+    時刻は直前に書いた曜日すべてに適用する。形式が正しくなければValueError
+    """
+    slots = set()
+    weekdays = None
+    for token in tokens:
+        if all(char in WEEKDAYS for char in token):
+            weekdays = [WEEKDAYS.index(char) for char in token]
+            continue
+        match = TIME_OPTION_PATTERN.match(token)
+        if not match or match['date'] or match['end']:
+            raise ValueError(f"時刻は HH:MM の形式で指定してください: {token}")
+        if weekdays is None:
+            raise ValueError(f"時刻の前に曜日（{WEEKDAYS} のいずれか）を指定してください: {token}")
+        hour, minute = (int(part) for part in match['start'].split(':'))
+        if hour > 23 or minute > 59:
+            raise ValueError(f"時刻は HH:MM の形式で指定してください: {token}")
+        for weekday in weekdays:
+            slots.add(slot_key(weekday, hour, minute))
+    if len(slots) > MAX_PROFILE_SLOTS:
+        raise ValueError(f"登録できる曜日と時刻の組み合わせは{MAX_PROFILE_SLOTS}個までです。")
+    return slots
+
+
+def format_profile(slots):
+    """キーの一覧を '水 21:00, 22:00 / 土 21:00' の形式にする"""
+    times = {}
+    for key in sorted(slots):
+        weekday, time = key.split('-')
+        times.setdefault(int(weekday), []).append(time)
+    return ' / '.join(f"{WEEKDAYS[weekday]} {', '.join(times[weekday])}" for weekday in sorted(times))
+
+
+class AvailabilityStore:
+    """プロフィールと、(曜日と時刻) → ユーザーIDのインデックスの読み書き"""
+
+    def __init__(self, profiles, index):
+        self.profiles = profiles
+        self.index = index
+
+    async def get(self, guild_id, user_id):
+        """登録済みのキーの一覧を返す（未登録なら空のリスト）"""
+        profile = await self.profiles.find_one(
+            {'guild_id': guild_id, 'user_id': user_id}, projection={'_id': 0, 'slots': 1}
+        )
+        return profile['slots'] if profile else []
+
+    async def set(self, guild_id, user_id, username, slots):
+        """プロフィールを置き換え、インデックスは変わったキーの分だけ更新する"""
+        previous = await self.profiles.find_one_and_update(
+            {'guild_id': guild_id, 'user_id': user_id},
+            {'$set': {'username': username, 'slots': sorted(slots), 'updated_at': datetime.now(JST)}},
+            projection={'_id': 0, 'slots': 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        await self._update_index(guild_id, user_id, set(previous['slots']) if previous else set(), set(slots))
+
+    async def clear(self, guild_id, user_id):
+        previous = await self.profiles.find_one_and_delete(
+            {'guild_id': guild_id, 'user_id': user_id}, projection={'_id': 0, 'slots': 1}
+        )
+        if previous:
+            await self._update_index(guild_id, user_id, set(previous['slots']), set())
+        return previous is not None
+
+    async def _update_index(self, guild_id, user_id, old_slots, new_slots):
+        updates = [
+            UpdateOne({'guild_id': guild_id, 'slot': key}, {'$addToSet': {'user_ids': user_id}}, upsert=True)
+            for key in new_slots - old_slots
+        ] + [
+            UpdateOne({'guild_id': guild_id, 'slot': key}, {'$pull': {'user_ids': user_id}})
+            for key in old_slots - new_slots
+        ]
+        if updates:
+            await self.index.bulk_write(updates, ordered=False)
+
+    async def users_for_slots(self, guild_id, keys):
+        """キーごとの参加可能なユーザーIDの一覧を返す"""
+        cursor = self.index.find(
+            {'guild_id': guild_id, 'slot': {'$in': list(keys)}}, projection={'_id': 0, 'slot': 1, 'user_ids': 1}
+        )
+        return {doc['slot']: doc['user_ids'] async for doc in cursor}
+
+    async def usernames(self, guild_id, user_ids):
+        """プロフィールに保存した表示名を返す（自動入力した回答の名前に使う）"""
+        cursor = self.profiles.find(
+            {'guild_id': guild_id, 'user_id': {'$in': list(user_ids)}}, projection={'_id': 0, 'user_id': 1, 'username': 1}
+        )
+        return {doc['user_id']: doc['username'] async for doc in cursor}
@@ -1,35 +1,73 @@
 # Discord スケジュール調整Bot
 # main.py
 
+import time
+STARTED = time.perf_counter()  # 起動時間の計測の基準（importより前に記録する）
+
 import os
+import re
+import signal
+import socket
+import logging
 import discord
 import asyncio
+from typing import Literal
 from discord.ext import commands
-from pymongo import MongoClient
-from datetime import datetime
-import pytz
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask
-from threading import Thread
+
+from availability import AvailabilityStore
+from database import JST, ScheduleRepository, client_options_from_env, event_cache_from_env
+from guild_config import CONFIG_RANGES, DEFAULT_PREFIX, MAX_PREFIX_LENGTH, GuildConfigStore
+from http_server import HealthServer
+from live_results import LiveResultsUpdater
+from indexes import ensure_indexes
+from metrics import COMMAND_LATENCY, MongoCommandMetrics
+from outbound import OutboundDispatcher
+from tracing import configure_logging, current_trace, phase, start_trace, traced_phase
+from scheduler import TimerScheduler
+from service import MAX_IMPORT_BYTES, PAGE_SIZE, InvalidDateError, ScheduleService, ServiceError
+from startup import StartupTimer, sync_command_tree
+from sync import ChangeSync
+from timeslots import indices_from_mask, option_start, selected_labels
+from write_buffer import ResponseWriteBuffer
+# おすすめ（recommend）・エクスポート（export, tempfile）・explain診断（indexes）は
+# 使うときに読み込み、起動時のimportを減らす
+
+startup = StartupTimer(STARTED)
+startup.mark('imports')
 
 # .env ファイルから環境変数を読み込む
 load_dotenv()
 
+logger = logging.getLogger('schedule_bot')
+
 # 環境変数から設定を取得
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 MONGODB_URI = os.getenv('MONGODB_URI')
-GUILD_ID = os.getenv('GUILD_ID')  # 特定のサーバーIDを環境変数から取得
+GUILD_ID = os.getenv('GUILD_ID')  # 開発用サーバーID（任意。指定するとそのサーバーへ即時にコマンドを反映）
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC') == '1'  # コマンド定義が変わっていなくても同期する
+SHARD_COUNT = os.getenv('SHARD_COUNT')  # シャード数（任意。未指定ならDiscordの推奨値）
+SHARD_IDS = os.getenv('SHARD_IDS')  # このプロセスが担当するシャード（任意。例: 0,1）
+CHANGE_SYNC = os.getenv('CHANGE_SYNC') == '1'  # 複数プロセスで動かす場合に、ほかのプロセスの書き込みをキャッシュに反映する
+INSTANCE_ID = os.getenv('INSTANCE_ID') or socket.gethostname()  # 同期の再開トークンを保存するキー（プロセスごとに一意にする）
 
 # Validate environment variables
 if not DISCORD_TOKEN:
     raise ValueError("DISCORD_TOKEN is not set in the environment variables.")
 if not MONGODB_URI:
     raise ValueError("MONGODB_URI is not set in the environment variables.")
-if not GUILD_ID:
-    raise ValueError("GUILD_ID is not set in the environment variables.")
-else:
+if GUILD_ID:
     GUILD_ID = int(GUILD_ID)
 
+# シャーディングの設定（複数プロセスに分ける場合は SHARD_COUNT と SHARD_IDS を指定）
+shard_options = {}
+if SHARD_COUNT:
+    shard_options['shard_count'] = int(SHARD_COUNT)
+if SHARD_IDS:
+    shard_options['shard_ids'] = [int(shard_id) for shard_id in SHARD_IDS.split(',')]
+
 # Botの設定
 intents = discord.Intents.default()
 intents.messages = True
@@ -37,83 +75,707 @@ intents.message_content = True
 intents.guilds = True
 intents.reactions = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+# MongoDBクライアントの設定（接続プール・タイムアウト・イベントキャッシュは環境変数で調整可能）
+repository = ScheduleRepository(
+    MONGODB_URI,
+    db_name=os.getenv('MONGODB_DB', 'schedule_bot'),  # 負荷テストなどで別のデータベースを使う場合に指定
+    event_cache=event_cache_from_env(),
+    event_listeners=[MongoCommandMetrics()],  # MongoDBの往復時間を /metrics に出力
+    **client_options_from_env()
+)
+guild_configs = GuildConfigStore(repository.db['guild_configs'])
+# 毎週の参加可能時間（イベント作成時の回答の自動入力に使う）
+availability = AvailabilityStore(repository.db['availability_profiles'], repository.db['availability_index'])
 
-# MongoDBクライアントの設定
-client = MongoClient(MONGODB_URI)
-db = client['schedule_bot']
-events_collection = db['events']
-responses_collection = db['responses']
+# RESPONSE_WRITE_BEHIND=1 の場合は回答をバッファに溜めてまとめて書き込む
+write_buffer = None
+if os.getenv('RESPONSE_WRITE_BEHIND') == '1':
+    write_buffer = ResponseWriteBuffer(
+        repository,
+        max_batch=int(os.getenv('RESPONSE_FLUSH_SIZE', '100')),
+        flush_interval=float(os.getenv('RESPONSE_FLUSH_INTERVAL', '1.0'))
+    )
 
-# タイムゾーンの設定 (日本時間)
-JST = pytz.timezone('Asia/Tokyo')
 
-@bot.event
-async def on_ready():
-    print(f'Bot is ready! Logged in as {bot.user}')
-    
-    # 指定されたGuild IDのサーバーにBotが存在するか確認
-    guild = bot.get_guild(GUILD_ID)
-    if guild:
-        print(f'Bot is active in the specified guild: {guild.name}')
+class TracedContext(commands.Context):
+    async def send(self, *args, **kwargs):
+        with phase('send'):
+            return await super().send(*args, **kwargs)
+
+
+class ScheduleTree(discord.app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # スラッシュコマンドのトレースを開始（完了時は on_app_command_completion で終了）
+        if interaction.command is not None:
+            start_trace(
+                interaction.command.qualified_name, 'slash',
+                guild_id=interaction.guild_id, user_id=interaction.user.id
+            )
+        return True
+
+    async def on_error(self, interaction, error):
+        finish_trace('error', interaction.created_at)
+        await super().on_error(interaction, error)
+
+
+class ScheduleBot(commands.AutoShardedBot):
+    health_server = None
+    warmup_task = None
+    shutdown_task = None
+
+    async def get_context(self, origin, *, cls=TracedContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        # 引数の解析からコマンドの完了までをトレースする
+        start_trace(ctx.command.qualified_name, 'prefix', guild_id=ctx.guild and ctx.guild.id, user_id=ctx.author.id)
+        try:
+            await super().invoke(ctx)
+        finally:
+            finish_trace('error' if ctx.command_failed else 'ok', ctx.message.created_at)
+
+    async def setup_hook(self):
+        startup.mark('login')
+        # ヘルスチェック・メトリクス用のHTTPサーバーをBotと同じイベントループで起動
+        # （Renderのポートスキャン対策も兼ねる）
+        self.health_server = HealthServer(self, repository, port=int(os.environ.get("PORT", 10000)))
+        await self.health_server.start()
+        if write_buffer:
+            write_buffer.start()
+        # 調整メッセージ・結果表示のボタン（Botの再起動前に投稿したものも押せるように登録する）
+        self.add_dynamic_items(ToggleTimeButton, ResultsPageButton)
+        if change_sync:
+            change_sync.start()
+        # MongoDBの準備とコマンドの同期はゲートウェイへの接続を待たせないよう裏で行う
+        self.warmup_task = asyncio.create_task(self.warm_up())
+
+    async def warm_up(self):
+        """MongoDBへの接続・インデックスの作成とコマンドの同期（プロセスごとに1回だけ実行する）"""
+        try:
+            with startup.measure('mongo_connect'):
+                await repository.db.command('ping')
+            with startup.measure('indexes'):
+                created = await ensure_indexes(repository.db)
+            logger.info('Indexes ensured: %s', ', '.join(created))
+            # MONGODB_EXPLAIN=1 の場合はクエリの実行計画を診断
+            if os.getenv('MONGODB_EXPLAIN') == '1':
+                from indexes import explain_queries, log_explain_report
+                log_explain_report(await explain_queries(repository.db))
+        except Exception:
+            logger.exception('Error preparing MongoDB')
+
+        # 複数プロセスで動かす場合は、シャード0を担当するプロセスだけが同期する
+        if self.shard_ids is not None and 0 not in self.shard_ids:
+            return
+        try:
+            with startup.measure('command_sync'):
+                meta = repository.db['bot_meta']
+                # グローバルコマンドはサーバー数に関係なく1回の同期で全サーバーに反映される
+                synced = await sync_command_tree(self.tree, meta, force=FORCE_COMMAND_SYNC)
+                # 開発用サーバーが指定されていれば、そのサーバーにも即時反映する
+                if GUILD_ID:
+                    guild = discord.Object(id=GUILD_ID)
+                    self.tree.copy_global_to(guild=guild)
+                    synced |= await sync_command_tree(self.tree, meta, guild=guild, force=FORCE_COMMAND_SYNC)
+            logger.info('Command sync %s', 'complete' if synced else 'skipped (unchanged)')
+        except Exception:
+            logger.exception('Error syncing commands')
+
+    async def close(self):
+        # シグナルとasync withの終了の両方から呼ばれても終了処理は1回だけ行い、どちらも完了を待つ
+        if self.shutdown_task is None:
+            self.shutdown_task = asyncio.create_task(self._shutdown())
+        await asyncio.shield(self.shutdown_task)
+
+    async def _shutdown(self):
+        if self.warmup_task and not self.warmup_task.done():
+            self.warmup_task.cancel()
+        # キューに残っているメッセージは接続を閉じる前に送る
+        await outbound.close()
+        await super().close()
+        if self.health_server:
+            await self.health_server.stop()
+        await scheduler.close()
+        if change_sync:
+            await change_sync.close()
+        await live_results.close()
+        # バッファに残っている回答を書き込んでから終了する
+        if write_buffer:
+            await write_buffer.close()
+        # MongoDBの接続プールを解放
+        await repository.close()
+
+
+async def get_prefix(bot, message):
+    """サーバーごとに設定されたコマンドプレフィックスを返す"""
+    if message.guild is None:
+        return DEFAULT_PREFIX
+    return await guild_configs.get_prefix(message.guild.id)
+
+
+bot = ScheduleBot(command_prefix=get_prefix, intents=intents, tree_cls=ScheduleTree, **shard_options)
+
+# 回答の受付メッセージなど、チャンネルへの送信をレート制限に合わせて送るキュー
+outbound = OutboundDispatcher(coalesce_window=float(os.getenv('ACK_COALESCE_WINDOW', '0.5')))
+
+# 締切・リマインダー・アーカイブのタイマー（このプロセスが担当するサーバーのものだけ実行する）
+scheduler = TimerScheduler(repository.db['timers'], owns=lambda timer: bot.get_guild(timer['guild_id']) is not None)
+
+
+async def update_event_message(event_id):
+    """調整メッセージを最新の集計で編集する（LiveResultsUpdaterから呼ばれる）"""
+    await service.flush()
+    event = await repository.get_event_with_counts(event_id)
+    if not event or not event.get('message_id'):
+        return
+    channel = await get_channel(event['channel_id'])
+    await channel.get_partial_message(event['message_id']).edit(
+        embed=build_event_embed(event), view=build_event_view(event)
+    )
+
+
+# ボタンでの回答による調整メッセージの編集は、チャンネルごとに LIVE_RESULTS_INTERVAL 秒に1回にまとめる
+live_results = LiveResultsUpdater(update_event_message, interval=float(os.getenv('LIVE_RESULTS_INTERVAL', '2.0')))
+
+
+def request_live_update(event):
+    """調整メッセージの集計を更新する（編集はチャンネルごとにまとめて行う）"""
+    if event.get('message_id'):
+        live_results.request(event['channel_id'], event['_id'])
+
+
+# 従来のコマンドとスラッシュコマンドで共通の操作（検証・DBアクセス・タイマー登録）
+service = ScheduleService(
+    repository, guild_configs, scheduler=scheduler, write_buffer=write_buffer, on_change=request_live_update,
+    availability=availability
+)
+
+
+def request_synced_update(event):
+    """ほかのプロセスの回答で集計が変わった調整メッセージを更新する（このプロセスが担当するサーバーのものだけ）"""
+    if bot.get_guild(event['guild_id']) is not None:
+        request_live_update(event)
+
+
+# ほかのプロセスの書き込みをキャッシュと調整メッセージに反映する（CHANGE_SYNC=1 の場合）
+change_sync = None
+if CHANGE_SYNC:
+    change_sync = ChangeSync(
+        repository.db, repository.db['bot_meta'], repository.event_cache, guild_configs,
+        on_counts=request_synced_update,
+        guild_ids=lambda: [guild.id for guild in bot.guilds],
+        instance_id=INSTANCE_ID,
+        poll_interval=float(os.getenv('SYNC_POLL_INTERVAL', '10.0'))
+    )
+
+
+# Embedのフィールド値の上限文字数
+EMBED_FIELD_LIMIT = 1024
+# 時間別参加者数に使う文字数の上限（Embed全体の上限6000文字に収めるため）
+SUMMARY_LIMIT = 2048
+# 参加者一覧の1行の上限文字数（1ページ分が必ず1フィールドに収まる長さ）
+PARTICIPANT_LINE_LIMIT = EMBED_FIELD_LIMIT // PAGE_SIZE - 1
+
+
+def truncate(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def add_line_fields(embed, name, lines, total_limit):
+    """
+    行をフィールドの上限文字数ごとに分けて追加する
+    total_limitを超える分は省略し、省略した件数を最後に表示する
+    """
+    chunk = []
+    length = 0
+    total = 0
+    for shown, line in enumerate(lines):
+        if total + len(line) + 1 > total_limit - 32:
+            chunk.append(f"...他 {len(lines) - shown} 件")
+            break
+        if chunk and length + len(line) + 1 > EMBED_FIELD_LIMIT:
+            embed.add_field(name=name, value="\n".join(chunk), inline=False)
+            name = "\u200b"  # 続きのフィールドは見出しを空にする
+            chunk = []
+            length = 0
+        chunk.append(line)
+        length += len(line) + 1
+        total += len(line) + 1
+    embed.add_field(name=name, value="\n".join(chunk) or "なし", inline=False)
+
+
+@traced_phase('render')
+async def build_results_embed(event, page):
+    """
+    イベントの調整結果のEmbedを作成する
+    集計はイベントの集計カウンター（時間オプションの数に比例）を使い、参加者一覧は1ページ分だけを表示する
+    """
+    counts = event.get('counts')
+    if counts is None:
+        # カウンターを持たない旧形式のイベントはここで作成する
+        counts = await repository.rebuild_counts(event)
+
+    embed = discord.Embed(
+        title=f"📊 調整結果: {event['title']}",
+        description=f"日付: {event['date'].strftime('%Y-%m-%d')}" + ("（投票締切済み）" if event.get('closed') else ""),
+        color=discord.Color.green()
+    )
+
+    # 時間ごとの参加者数
+    time_results = [
+        truncate(f"{i+1}. {label}: {counts[i]}人", EMBED_FIELD_LIMIT - 1) for i, label in enumerate(event['time_options'])
+    ]
+    add_line_fields(embed, "時間別参加者数", time_results, SUMMARY_LIMIT)
+
+    # 最も参加者の多い時間（条件付きのおすすめは !recommend で算出する）
+    best = max(counts, default=0)
+    if best > 0:
+        best_times = [f"{i+1}. {label}" for i, label in enumerate(event['time_options']) if counts[i] == best]
+        embed.add_field(name="おすすめ", value=truncate(f"{', '.join(best_times)}（{best}人）", EMBED_FIELD_LIMIT), inline=False)
+
+    # 参加者ごとの選択時間（1ページ分）
+    users_results = [
+        truncate(
+            f"{response['username']}: {', '.join(selected_labels(event, response.get('selected_mask', 0)))}",
+            PARTICIPANT_LINE_LIMIT
+        )
+        for response in page.responses
+    ]
+    if users_results:
+        embed.add_field(name=f"参加者一覧（{page.number}ページ目）", value="\n".join(users_results), inline=False)
     else:
-        print(f'Warning: Bot is not in the specified guild ID: {GUILD_ID}')
-        
-    # コマンドのSync処理（即時適用のため）
+        embed.add_field(name="参加者一覧", value="まだ回答がありません。", inline=False)
+
+    embed.set_footer(text=f"イベントID: {event['_id']}")
+    return embed
+
+
+def build_results_view(event, page):
+    """参加者一覧のページ送りボタンを作成する（1ページに収まる場合はNone）"""
+    if not page.has_prev and not page.has_next:
+        return None
+    view = discord.ui.View(timeout=None)
+    first, last = page.responses[0]['_id'], page.responses[-1]['_id']
+    view.add_item(ResultsPageButton(event['_id'], 'prev', first, page.number - 1, disabled=not page.has_prev))
+    view.add_item(ResultsPageButton(event['_id'], 'next', last, page.number + 1, disabled=not page.has_next))
+    return view
+
+
+class ResultsPageButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r'schedule:results:(?P<event_id>[0-9a-f]{24}):(?P<direction>prev|next):(?P<anchor>[0-9a-f]{24}):(?P<number>\d+)'
+):
+    """
+    結果表示の参加者一覧のページ送りボタン
+    custom_idに基準の回答の_idを持ち、MongoDBからはそのページの分だけを読む
+    """
+
+    def __init__(self, event_id, direction, anchor, number, disabled=False):
+        super().__init__(discord.ui.Button(
+            label="◀ 前へ" if direction == 'prev' else "次へ ▶",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f'schedule:results:{event_id}:{direction}:{anchor}:{number}',
+            disabled=disabled
+        ))
+        self.event_id = event_id
+        self.direction = direction
+        self.anchor = anchor
+        self.number = number
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(ObjectId(match['event_id']), match['direction'], ObjectId(match['anchor']), int(match['number']))
+
+    async def callback(self, interaction):
+        start_trace('schedule_results_page', 'component', guild_id=interaction.guild_id, user_id=interaction.user.id)
+        try:
+            await show_results_page(interaction, self.event_id, self.direction, self.anchor, self.number)
+        finally:
+            finish_trace('ok', interaction.created_at)
+
+
+async def show_results_page(interaction, event_id, direction, anchor, number):
+    """結果表示のメッセージを指定したページに切り替える"""
     try:
-        print('Syncing application commands...')
-        # グローバルコマンドの同期（または特定のギルドのみに同期）
-        guild = discord.Object(id=GUILD_ID)
-        await asyncio.sleep(1)  # 確実にBotが起動してから同期を行うための待機
-        await bot.tree.sync(guild=guild)  # ギルド固有のコマンド同期
-        print('Command sync complete!')
+        event, page = await service.results_page(interaction.guild_id, event_id, direction, anchor, number)
+        embed = await build_results_embed(event, page)
+        with phase('send'):
+            await interaction.response.edit_message(embed=embed, view=build_results_view(event, page))
+
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
     except Exception as e:
-        print(f'Error syncing commands: {e}')
-    
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+
+# 一度におすすめを算出できるイベント数の上限
+MAX_RECOMMEND_EVENTS = 10
+
+USER_MENTION_PATTERN = re.compile(r'<@!?(\d+)>')
+
+
+@traced_phase('render')
+async def build_recommend_embed(events, required_ids, quorum):
+    """
+    おすすめの時間のEmbedを作成する
+    イベントが1件なら時間オプションを、複数ならイベントごとに1つずつ選んだ組み合わせをランキングする
+    """
+    from recommend import AvailabilityMatrix, UserIndex, rank_combinations, rank_options
+
+    user_index = UserIndex()
+    with phase('db_read'):
+        matrices = [await AvailabilityMatrix.load(repository, event, user_index) for event in events]
+
+    embed = discord.Embed(
+        title="🏆 おすすめの時間",
+        description=" / ".join(f"{event['title']}（{event['date'].strftime('%Y-%m-%d')}）" for event in events),
+        color=discord.Color.gold()
+    )
+
+    conditions = []
+    if required_ids:
+        conditions.append(f"必須参加者: {' '.join(f'<@{user_id}>' for user_id in required_ids)}")
+    if quorum:
+        conditions.append(f"最低人数: {quorum}人")
+    if conditions:
+        embed.add_field(name="条件", value="\n".join(conditions), inline=False)
+
+    required_mask = user_index.mask(required_ids)
+    if required_mask is None:
+        embed.add_field(name="ランキング", value="必須参加者のうち、まだ回答していない人がいます。", inline=False)
+        return embed
+
+    if len(matrices) == 1:
+        event = events[0]
+        results = [
+            f"{i+1}. {event['time_options'][i]}: {count}人"
+            for i, count in rank_options(matrices[0], required_mask, quorum)
+        ]
+    else:
+        results = [
+            " / ".join(f"{event['title']} {i+1}. {event['time_options'][i]}" for event, i in zip(events, choice))
+            + f": {count}人"
+            for choice, count in rank_combinations(matrices, required_mask, quorum)
+        ]
+
+    if results:
+        embed.add_field(name="ランキング", value="\n".join(results), inline=False)
+    else:
+        embed.add_field(name="ランキング", value="条件を満たす時間がありません。", inline=False)
+    return embed
+
+
+# 調整メッセージに付けられるボタンの上限（5個×5行）
+MAX_TOGGLE_BUTTONS = 25
+
+
+def build_event_embed(event):
+    """調整メッセージのEmbedを作成する（時間オプションごとの現在の参加者数も表示する）"""
+    counts = event.get('counts') or [0] * len(event['time_options'])
+    embed = discord.Embed(
+        title=f"📅 スケジュール調整: {event['title']}",
+        description=f"日付: {event['date'].strftime('%Y-%m-%d')}" + ("（投票締切済み）" if event.get('closed') else ""),
+        color=discord.Color.blue()
+    )
+    if event.get('prefilled'):
+        embed.description += f"\n毎週の参加可能時間から{event['prefilled']}人の回答を自動入力しました（変更はボタンやコマンドで）"
+
+    embed.add_field(
+        name="時間オプション",
+        value="\n".join([f"{i+1}. {label}（{counts[i]}人）" for i, label in enumerate(event['time_options'])])
+    )
+    how_to = "下記のコマンドで参加可能な時間を登録してください：\n"
+    if len(event['time_options']) <= MAX_TOGGLE_BUTTONS:
+        how_to = "下のボタンで参加可能な時間を選んでください（もう一度押すと取り消し）。\nコマンドの場合：\n"
+    embed.add_field(name="参加方法", value=how_to +
+                                        f"/schedule_respond event_id:{event['_id']} time_indices:\"1 3\" \n"
+                                        f"または !respond {event['_id']} 1 3")
+
+    embed.set_footer(text=f"イベントID: {event['_id']}")
+    return embed
+
+
+def build_event_view(event):
+    """時間オプションごとの切り替えボタンを作成する（締切後は押せないようにする）"""
+    if len(event['time_options']) > MAX_TOGGLE_BUTTONS:
+        return None
+    view = discord.ui.View(timeout=None)
+    for i, label in enumerate(event['time_options']):
+        view.add_item(ToggleTimeButton(event['_id'], i, f"{i+1}. {label}", disabled=bool(event.get('closed'))))
+    return view
+
+
+class ToggleTimeButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r'schedule:toggle:(?P<event_id>[0-9a-f]{24}):(?P<index>\d+)'
+):
+    """
+    時間オプションの参加可否を切り替えるボタン
+    custom_idにイベントIDと時間番号を持つため、Botを再起動しても押せる
+    """
+
+    def __init__(self, event_id, index, label=None, disabled=False):
+        super().__init__(
+            discord.ui.Button(
+                label=(label or str(index + 1))[:80],
+                style=discord.ButtonStyle.secondary,
+                custom_id=f'schedule:toggle:{event_id}:{index}',
+                disabled=disabled
+            ),
+            row=index // 5
+        )
+        self.event_id = event_id
+        self.index = index
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(ObjectId(match['event_id']), int(match['index']), item.label)
+
+    async def callback(self, interaction):
+        start_trace('schedule_toggle', 'component', guild_id=interaction.guild_id, user_id=interaction.user.id)
+        try:
+            await toggle_time(interaction, self.event_id, self.index)
+        finally:
+            finish_trace('ok', interaction.created_at)
+
+
+async def toggle_time(interaction, event_id, index):
+    """ボタンを押したユーザーの回答に時間を追加し、選択済みなら取り消す"""
+    try:
+        event, selected_mask = await service.toggle(
+            interaction.guild_id, event_id, interaction.user.id, interaction.user.display_name, index
+        )
+        summary = ", ".join(
+            f"{i+1}. {event['time_options'][i]}" for i in indices_from_mask(selected_mask)
+        ) or "なし"
+        await send_interaction_message(interaction, f"回答を更新しました。参加可能な時間: {summary}", ephemeral=True)
+
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+
+def build_event_list_embed(events):
+    """サーバーの最近のイベント一覧のEmbedを作成する"""
+    embed = discord.Embed(
+        title="📋 最近のイベント",
+        color=discord.Color.blue()
+    )
+    if not events:
+        embed.description = "まだイベントがありません。"
+    for event in events:
+        embed.add_field(
+            name=f"{event['title']}（{event['date'].strftime('%Y-%m-%d')}）",
+            value=f"イベントID: {event['_id']}\n時間: {', '.join(event['time_options'])}",
+            inline=False
+        )
+    return embed
+
+
+async def post_event_messages(channel, events):
+    """一括作成したイベントの調整メッセージを送信キュー経由で投稿し、メッセージIDを保存する"""
+    async def post(event):
+        message = await outbound.send(channel, embed=build_event_embed(event), view=build_event_view(event))
+        await service.attach_message(event['_id'], message.id)
+    await asyncio.gather(*(post(event) for event in events))
+
+
+def bulk_created_message(events):
+    first, last = events[0]['date'].strftime('%Y-%m-%d'), events[-1]['date'].strftime('%Y-%m-%d')
+    return f"{len(events)}件のイベントを作成しました（{first} 〜 {last}）。調整メッセージを順に投稿します。"
+
+
+async def export_file(guild, fmt, service_call):
+    """
+    エクスポートを一時ファイルに書き出し、Discordの添付ファイルとして返す
+    サーバーのアップロード上限を超える場合はServiceError
+    """
+    import tempfile
+
+    fp = tempfile.TemporaryFile()
+    try:
+        event = await service_call(fp)
+        if fp.tell() > guild.filesize_limit:
+            raise ServiceError("エクスポートしたファイルがアップロードできるサイズを超えています。")
+        fp.seek(0)
+        # discord.Fileは送信後にファイルを閉じる
+        return discord.File(fp, filename=f"{event['_id']}.{fmt}")
+    except BaseException:
+        fp.close()
+        raise
+
+
+async def get_channel(channel_id):
+    return bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+
+
+@scheduler.handler('close')
+async def close_voting(timer):
+    """投票を締め切って結果を投稿し、最多の時間のリマインダーを登録する"""
+    await service.flush()
+    event = await repository.close_event(timer['event_id'])
+    if event is None:
+        return
+
+    page = await service.participant_page(event)
+    embed = await build_results_embed(event, page)
+    channel = await get_channel(timer['channel_id'])
+    await outbound.send(
+        channel, content=f"🔒 「{event['title']}」の投票を締め切りました。",
+        embed=embed, view=build_results_view(event, page)
+    )
+    # 調整メッセージのボタンを押せないようにする
+    request_live_update(event)
+
+    counts = event.get('counts') or []
+    best = max(counts, default=0)
+    if best == 0:
+        return
+    index = counts.index(best)
+    start = option_start(event, index)
+    if start is None:
+        return
+    config = await guild_configs.get(timer['guild_id'])
+    remind_at = start - timedelta(minutes=config['remind_minutes_before'])
+    if remind_at > datetime.now(JST):
+        await scheduler.schedule(
+            'remind', event['_id'], remind_at,
+            guild_id=timer['guild_id'], channel_id=timer['channel_id'], option_index=index
+        )
+
+
+@scheduler.handler('remind')
+async def send_reminder(timer):
+    """決まった時間の前に、その時間を選んだ参加者へリマインダーを送る"""
+    event = await repository.get_event(timer['event_id'])
+    if event is None:
+        return
+    index = timer['option_index']
+    user_ids = await repository.find_participant_ids(event['_id'], index)
+    mentions = ' '.join(f'<@{user_id}>' for user_id in user_ids)
+    start = option_start(event, index)
+    if start is not None:
+        when = start.strftime('%Y-%m-%d %H:%M')
+    else:
+        when = f"{event['date'].strftime('%Y-%m-%d')} {event['time_options'][index]}"
+    channel = await get_channel(timer['channel_id'])
+    await outbound.send(channel, content=f"⏰ リマインダー: 「{event['title']}」は {when} からです。\n{mentions}")
+
+
+@scheduler.handler('archive')
+async def archive_event(timer):
+    """終わったイベントをアーカイブコレクションに移す"""
+    await service.flush()
+    await scheduler.cancel_event(timer['event_id'])
+    await repository.archive_event(timer['event_id'])
+
+
+@bot.event
+async def on_ready():
+    logger.info('Bot is ready! Logged in as %s', bot.user)
+    logger.info('Active in %d guilds on shards %s (shard count: %s)', len(bot.guilds), sorted(bot.shards), bot.shard_count)
+
+    # サーバー一覧が揃ってからタイマーの実行を始める（再接続時は何もしない）
+    scheduler.start()
+    # コマンドの同期は setup_hook で起動した warm_up がプロセスごとに1回だけ行う
+    # （on_readyは再接続のたびに呼ばれるため、ここでは同期しない）
+    if startup.mark('ready'):
+        logger.info('Startup: %s', startup.report())
+
+
+@bot.event
+async def on_guild_remove(guild):
+    guild_configs.forget(guild.id)
+
+
+async def send_interaction_message(interaction, *args, **kwargs):
+    """スラッシュコマンドの応答を送信する（送信時間を send フェーズとして記録）"""
+    with phase('send'):
+        await interaction.response.send_message(*args, **kwargs)
+
+
+def finish_trace(status, created_at):
+    """
+    現在のコマンドのトレースを終了してログに出力し、
+    コマンドの送信時刻から完了までの時間をメトリクスに記録する
+    """
+    trace = current_trace()
+    if trace is None or trace.finished:
+        return
+    trace.finish(status)
+    elapsed = (discord.utils.utcnow() - created_at).total_seconds()
+    COMMAND_LATENCY.observe(trace.command, status, value=elapsed)
+    if startup.mark('first_command'):
+        logger.info('Startup: %s', startup.report())
+
+
+@bot.before_invoke
+async def before_command(ctx):
+    # ここまでの時間（チェックと引数の変換）を parse として記録する
+    trace = current_trace()
+    if trace is not None:
+        trace.add('parse', trace.elapsed())
+
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    finish_trace('ok', interaction.created_at)
+
 @bot.command(name='create_event')
 async def create_event(ctx, title: str, date: str, *time_options):
     """
     イベントを作成するコマンド
     使用例: !create_event "会議" 2025-05-20 13:00 15:00 17:00
     """
-    # 指定されたGuildからのリクエストか確認
-    if ctx.guild.id != GUILD_ID:
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
         return
         
     try:
-        # 日付の検証
-        event_date = datetime.strptime(date, '%Y-%m-%d')
-        event_date = JST.localize(event_date)
-        
         # イベント情報をMongoDBに保存
-        event_id = events_collection.insert_one({
-            'guild_id': ctx.guild.id,
-            'channel_id': ctx.channel.id,
-            'creator_id': ctx.author.id,
-            'title': title,
-            'date': event_date,
-            'time_options': list(time_options),
-            'created_at': datetime.now(JST)
-        }).inserted_id
-        
-        # レスポンスメッセージの作成
-        embed = discord.Embed(
-            title=f"📅 スケジュール調整: {title}",
-            description=f"日付: {date}",
-            color=discord.Color.blue()
-        )
-        
-        embed.add_field(name="時間オプション", value="\n".join([f"{i+1}. {time}" for i, time in enumerate(time_options)]))
-        embed.add_field(name="参加方法", value="下記のコマンドで参加可能な時間を登録してください：\n"
-                                        f"!respond {event_id} [時間番号(複数可)] \n"
-                                        f"例: !respond {event_id} 1 3")
+        event = await service.create_event(ctx.guild.id, ctx.channel.id, ctx.author.id, title, date, time_options)
         
-        embed.set_footer(text=f"イベントID: {event_id}")
+        # レスポンスメッセージの作成（ボタンで回答でき、集計はこのメッセージに反映される）
+        message = await ctx.send(embed=build_event_embed(event), view=build_event_view(event))
+        await service.attach_message(event['_id'], message.id)
         
-        await ctx.send(embed=embed)
-        
-    except ValueError as e:
-        await ctx.send(f"形式エラー: 日付は'YYYY-MM-DD'形式で入力してください。\n例: !create_event \"ミーティング\" 2025-05-20 13:00 15:00 17:00")
+    except InvalidDateError as e:
+        await ctx.send(f"{e}\n例: !create_event \"ミーティング\" 2025-05-20 13:00 15:00 17:00")
+    except ServiceError as e:
+        await ctx.send(str(e))
+
+@bot.command(name='bulk_create_event')
+async def bulk_create_event(ctx, title: str, start_date: str, end_date: str, *time_options):
+    """
+    期間内の日付ごとに同じ時間オプションのイベントをまとめて作成するコマンド
+    使用例: !bulk_create_event "レイド" 2025-06-01 2025-08-31 days=水土 21:00-23:00
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    weekdays = None
+    options = []
+    for option in time_options:
+        if option.startswith('days='):
+            weekdays = option[len('days='):]
+        else:
+            options.append(option)
+    try:
+        events = await service.create_events(
+            ctx.guild.id, ctx.channel.id, ctx.author.id, title, start_date, end_date, options, weekdays
+        )
+        await ctx.send(bulk_created_message(events))
+        await post_event_messages(ctx.channel, events)
+
+    except InvalidDateError as e:
+        await ctx.send(f"{e}\n例: !bulk_create_event \"レイド\" 2025-06-01 2025-08-31 days=水土 21:00-23:00")
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
 
 @bot.command(name='respond')
 async def respond_to_event(ctx, event_id: str, *time_indices):
@@ -121,52 +783,18 @@ async def respond_to_event(ctx, event_id: str, *time_indices):
     イベントの時間オプションに対して応答するコマンド
     使用例: !respond 507f1f77bcf86cd799439011 1 3
     """
-    # 指定されたGuildからのリクエストか確認
-    if ctx.guild.id != GUILD_ID:
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
         return
     try:
-        # ObjectIdの検証
-        from bson.objectid import ObjectId
-        obj_id = ObjectId(event_id)
-        
-        # イベントの検索
-        event = events_collection.find_one({'_id': obj_id})
-        if not event:
-            await ctx.send("指定されたイベントが見つかりません。")
-            return
-            
-        # 時間インデックスの検証
-        selected_times = []
-        for idx in time_indices:
-            try:
-                index = int(idx) - 1
-                if 0 <= index < len(event['time_options']):
-                    selected_times.append(event['time_options'][index])
-                else:
-                    await ctx.send(f"無効な時間オプション番号です: {idx}")
-                    return
-            except ValueError:
-                await ctx.send(f"無効な入力です: {idx}。数字を入力してください。")
-                return
-                
         # 既存の応答を更新または新規作成
-        responses_collection.update_one(
-            {
-                'event_id': obj_id,
-                'user_id': ctx.author.id
-            },
-            {
-                '$set': {
-                    'username': ctx.author.display_name,
-                    'selected_times': selected_times,
-                    'updated_at': datetime.now(JST)
-                }
-            },
-            upsert=True
-        )
+        await service.respond(ctx.guild.id, event_id, ctx.author.id, ctx.author.display_name, time_indices)
         
-        await ctx.send(f"{ctx.author.mention} さんの回答を登録しました。")
+        # 受付メッセージはキューに積み、近い時間の回答とまとめて送る
+        outbound.acknowledge(ctx.channel, ctx.author.mention)
         
+    except ServiceError as e:
+        await ctx.send(str(e))
     except Exception as e:
         await ctx.send(f"エラーが発生しました: {str(e)}")
 
@@ -176,60 +804,63 @@ async def show_results(ctx, event_id: str):
     イベントの調整結果を表示するコマンド
     使用例: !show_results 507f1f77bcf86cd799439011
     """
-    # 指定されたGuildからのリクエストか確認
-    if ctx.guild.id != GUILD_ID:
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
         return
     try:
-        # ObjectIdの検証
-        from bson.objectid import ObjectId
-        obj_id = ObjectId(event_id)
+        # サーバー側で集計した結果と参加者一覧の最初のページを表示
+        event, page = await service.results_page(ctx.guild.id, event_id)
+        embed = await build_results_embed(event, page)
         
-        # イベントの検索
-        event = events_collection.find_one({'_id': obj_id})
-        if not event:
-            await ctx.send("指定されたイベントが見つかりません。")
-            return
-            
-        # イベントの応答を検索
-        responses = list(responses_collection.find({'event_id': obj_id}))
-        
-        # 結果の集計
-        time_counts = {time: 0 for time in event['time_options']}
-        user_responses = {}
-        
-        for response in responses:
-            user_responses[response['username']] = response['selected_times']
-            for time in response['selected_times']:
-                if time in time_counts:
-                    time_counts[time] += 1
-        
-        # 結果の表示
-        embed = discord.Embed(
-            title=f"📊 調整結果: {event['title']}",
-            description=f"日付: {event['date'].strftime('%Y-%m-%d')}",
-            color=discord.Color.green()
-        )
-        
-        # 時間ごとの参加者数
-        time_results = []
-        for i, time in enumerate(event['time_options']):
-            count = time_counts[time]
-            time_results.append(f"{i+1}. {time}: {count}人")
+        await ctx.send(embed=embed, view=build_results_view(event, page))
         
-        embed.add_field(name="時間別参加者数", value="\n".join(time_results), inline=False)
-        
-        # 参加者ごとの選択時間
-        users_results = []
-        for username, times in user_responses.items():
-            users_results.append(f"{username}: {', '.join(times)}")
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='recommend')
+async def recommend(ctx, *args):
+    """
+    参加者の多い時間をおすすめするコマンド（複数イベントの組み合わせも可）
+    使用例: !recommend 507f1f77bcf86cd799439011 507f191e810c19729de860ea quorum=4 @必須参加者
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    try:
+        event_ids = []
+        quorum = 0
+        for arg in args:
+            if arg.startswith('quorum='):
+                quorum = int(arg[len('quorum='):])
+            elif not USER_MENTION_PATTERN.fullmatch(arg):
+                event_ids.append(arg)
         
-        if users_results:
-            embed.add_field(name="参加者一覧", value="\n".join(users_results), inline=False)
-        else:
-            embed.add_field(name="参加者一覧", value="まだ回答がありません。", inline=False)
+        events = await service.recommend_events(ctx.guild.id, event_ids, MAX_RECOMMEND_EVENTS)
+        required_ids = [user.id for user in ctx.message.mentions]
+        embed = await build_recommend_embed(events, required_ids, quorum)
         
         await ctx.send(embed=embed)
         
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='list_events')
+async def list_events(ctx):
+    """
+    このサーバーの最近のイベントを表示するコマンド
+    使用例: !list_events
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    try:
+        events = await service.list_events(ctx.guild.id)
+        await ctx.send(embed=build_event_list_embed(events))
+        
     except Exception as e:
         await ctx.send(f"エラーが発生しました: {str(e)}")
 
@@ -239,31 +870,127 @@ async def delete_event(ctx, event_id: str):
     イベントを削除するコマンド（作成者のみ可能）
     使用例: !delete_event 507f1f77bcf86cd799439011
     """
-    # 指定されたGuildからのリクエストか確認
-    if ctx.guild.id != GUILD_ID:
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
         return
     try:
-        # ObjectIdの検証
-        from bson.objectid import ObjectId
-        obj_id = ObjectId(event_id)
-        
-        # イベントの検索
-        event = events_collection.find_one({'_id': obj_id})
-        if not event:
-            await ctx.send("指定されたイベントが見つかりません。")
-            return
-            
-        # 作成者の確認
-        if event['creator_id'] != ctx.author.id:
-            await ctx.send("イベントの削除は作成者のみが実行できます。")
-            return
-            
-        # イベントと関連する応答の削除
-        events_collection.delete_one({'_id': obj_id})
-        responses_collection.delete_many({'event_id': obj_id})
+        # イベントと関連する応答・タイマーの削除
+        event = await service.delete_event(ctx.guild.id, event_id, ctx.author.id)
         
         await ctx.send(f"イベント '{event['title']}' を削除しました。")
         
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='rebuild_tally')
+async def rebuild_tally(ctx, event_id: str):
+    """
+    イベントの集計カウンターを回答から再計算するコマンド
+    使用例: !rebuild_tally 507f1f77bcf86cd799439011
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    try:
+        # 回答コレクションから集計し直す
+        event = await service.rebuild_tally(ctx.guild.id, event_id)
+        
+        await ctx.send(f"イベント '{event['title']}' の集計を再計算しました。")
+        
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='export_event')
+async def export_event(ctx, event_id: str, fmt: str = 'csv'):
+    """
+    イベントの回答をCSVまたはiCalendar（.ics）ファイルで書き出すコマンド
+    使用例: !export_event 507f1f77bcf86cd799439011 ics
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    try:
+        file = await export_file(ctx.guild, fmt, lambda fp: service.export_event(ctx.guild.id, event_id, fmt, fp))
+        await ctx.send(file=file)
+
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='import_responses')
+async def import_responses(ctx, event_id: str):
+    """
+    添付したCSVの回答をイベントに取り込むコマンド（作成者のみ可能）
+    使用例: !import_responses 507f1f77bcf86cd799439011 （CSVファイルを添付）
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    if not ctx.message.attachments:
+        await ctx.send("CSVファイルを添付してください。")
+        return
+    attachment = ctx.message.attachments[0]
+    if attachment.size > MAX_IMPORT_BYTES:
+        await ctx.send(f"CSVは{MAX_IMPORT_BYTES // 1024}KBまでです。")
+        return
+    try:
+        event, imported = await service.import_responses(ctx.guild.id, event_id, ctx.author.id, await attachment.read())
+
+        await ctx.send(f"イベント '{event['title']}' に{imported}件の回答を取り込みました。")
+
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='availability')
+async def availability_command(ctx, *args):
+    """
+    毎週の参加可能時間を登録・表示・削除するコマンド（新しいイベントの回答に自動入力される）
+    使用例: !availability 水土 21:00 日 13:00 15:00 / !availability / !availability clear
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    try:
+        if not args:
+            profile = await service.get_availability(ctx.guild.id, ctx.author.id)
+            await ctx.send(f"毎週の参加可能時間: {profile}" if profile else "毎週の参加可能時間は登録されていません。")
+        elif args == ('clear',):
+            await service.clear_availability(ctx.guild.id, ctx.author.id)
+            await ctx.send("毎週の参加可能時間を削除しました。")
+        else:
+            profile = await service.set_availability(ctx.guild.id, ctx.author.id, ctx.author.display_name, args)
+            await ctx.send(f"毎週の参加可能時間を登録しました: {profile}")
+
+    except ServiceError as e:
+        await ctx.send(str(e))
+    except Exception as e:
+        await ctx.send(f"エラーが発生しました: {str(e)}")
+
+@bot.command(name='schedule_config')
+async def schedule_config(ctx, key: str, value: str):
+    """
+    サーバーごとの設定を変更するコマンド（サーバー管理権限が必要）
+    使用例: !schedule_config prefix ?
+    """
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
+        return
+    if not ctx.author.guild_permissions.manage_guild:
+        await ctx.send("設定の変更にはサーバー管理権限が必要です。")
+        return
+    try:
+        await guild_configs.update(ctx.guild.id, **{key: value})
+        await ctx.send(f"設定 '{key}' を '{value}' に変更しました。")
+        
+    except ValueError as e:
+        await ctx.send(str(e))
     except Exception as e:
         await ctx.send(f"エラーが発生しました: {str(e)}")
 
@@ -272,8 +999,8 @@ async def help_command(ctx):
     """
     ヘルプコマンド
     """
-    # 指定されたGuildからのリクエストか確認
-    if ctx.guild.id != GUILD_ID:
+    # サーバー内からのリクエストか確認（DMでは使用不可）
+    if ctx.guild is None:
         return
     embed = discord.Embed(
         title="📅 スケジュール調整Bot ヘルプ",
@@ -283,9 +1010,18 @@ async def help_command(ctx):
     
     commands_info = [
         ("!create_event [タイトル] [日付] [時間...]", "新しいイベントを作成します\n例: !create_event \"会議\" 2025-05-20 13:00 15:00 17:00"),
+        ("!bulk_create_event [タイトル] [開始日] [終了日] [days=曜日] [時間...]", "期間内の日付ごとにイベントをまとめて作成します\n例: !bulk_create_event \"レイド\" 2025-06-01 2025-08-31 days=水土 21:00-23:00"),
         ("!respond [イベントID] [時間番号...]", "イベントに応答します\n例: !respond 507f1f77bcf86cd799439011 1 3"),
         ("!show_results [イベントID]", "イベントの応答結果を表示します"),
+        ("!recommend [イベントID...] [quorum=人数] [@必須参加者...]", "参加者の多い時間をおすすめします（複数イベントの組み合わせも可）"),
+        ("!list_events", "このサーバーの最近のイベントを表示します"),
         ("!delete_event [イベントID]", "イベントを削除します（作成者のみ）"),
+        ("!rebuild_tally [イベントID]", "集計結果がずれた場合に回答から再計算します"),
+        ("!export_event [イベントID] [csv|ics]", "回答をCSVまたはiCalendarファイルで書き出します"),
+        ("!import_responses [イベントID]", "添付したCSVの回答を取り込みます（作成者のみ）"),
+        ("!availability [曜日 時刻...|clear]", "毎週の参加可能時間を登録します（新しいイベントに自動で回答されます）\n例: !availability 水土 21:00 日 13:00"),
+        ("!schedule_config prefix [プレフィックス]", "このサーバーでのプレフィックスを変更します（サーバー管理権限が必要）"),
+        ("!schedule_config [close_hours_before|remind_minutes_before|archive_days_after] [値]", "投票の締切・リマインダー・アーカイブの時期を変更します（サーバー管理権限が必要）"),
         ("!help_schedule", "このヘルプメッセージを表示します")
     ]
     
@@ -296,219 +1032,275 @@ async def help_command(ctx):
 
 # スラッシュコマンドの定義（discord.py 2.0以降の方式での即時適用）
 @bot.tree.command(name="schedule_create", description="スケジュール調整イベントを作成します")
-@discord.app_commands.guilds(discord.Object(id=GUILD_ID))  # 特定のギルドにのみコマンドを登録
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
 @discord.app_commands.describe(
     title="イベントのタイトル",
     date="日付（YYYY-MM-DD形式）",
     time_options="時間オプション（スペース区切りで複数指定可）"
 )
 async def slash_create_event(interaction: discord.Interaction, title: str, date: str, time_options: str):
-    # 指定されたGuildからのリクエストか確認
-    if interaction.guild_id != GUILD_ID:
-        return
-        
     try:
-        # 日付の検証
-        event_date = datetime.strptime(date, '%Y-%m-%d')
-        event_date = JST.localize(event_date)
-        
-        # 時間オプションの分割
-        time_options_list = time_options.split()
-        
-        # イベント情報をMongoDBに保存
-        event_id = events_collection.insert_one({
-            'guild_id': interaction.guild_id,
-            'channel_id': interaction.channel_id,
-            'creator_id': interaction.user.id,
-            'title': title,
-            'date': event_date,
-            'time_options': time_options_list,
-            'created_at': datetime.now(JST)
-        }).inserted_id
-        
-        # レスポンスメッセージの作成
-        embed = discord.Embed(
-            title=f"📅 スケジュール調整: {title}",
-            description=f"日付: {date}",
-            color=discord.Color.blue()
+        # イベント情報をMongoDBに保存（時間オプションはスペース区切り）
+        event = await service.create_event(
+            interaction.guild_id, interaction.channel_id, interaction.user.id, title, date, time_options.split()
         )
         
-        embed.add_field(name="時間オプション", value="\n".join([f"{i+1}. {time}" for i, time in enumerate(time_options_list)]))
-        embed.add_field(name="参加方法", value="下記のコマンドで参加可能な時間を登録してください：\n"
-                                        f"/schedule_respond event_id:{event_id} time_indices:\"1 3\" \n"
-                                        f"または、従来の方法: !respond {event_id} 1 3")
-        
-        embed.set_footer(text=f"イベントID: {event_id}")
+        # レスポンスメッセージの作成（ボタンで回答でき、集計はこのメッセージに反映される）
+        await send_interaction_message(interaction, embed=build_event_embed(event), view=build_event_view(event))
+        message = await interaction.original_response()
+        await service.attach_message(event['_id'], message.id)
         
-        await interaction.response.send_message(embed=embed)
-        
-    except ValueError as e:
-        await interaction.response.send_message(
-            f"形式エラー: 日付は'YYYY-MM-DD'形式で入力してください。\n"
+    except InvalidDateError as e:
+        await send_interaction_message(
+            interaction,
+            f"{e}\n"
             f"例: /schedule_create title:\"ミーティング\" date:2025-05-20 time_options:\"13:00 15:00 17:00\"",
             ephemeral=True
         )
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+
+@bot.tree.command(name="schedule_bulk_create", description="期間内の日付ごとにイベントをまとめて作成します")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.describe(
+    title="イベントのタイトル",
+    start_date="開始日（YYYY-MM-DD形式）",
+    end_date="終了日（YYYY-MM-DD形式）",
+    time_options="時間オプション（スペース区切りで複数指定可）",
+    weekdays="作成する曜日（例: 水土。省略すると毎日）"
+)
+async def slash_bulk_create_event(
+    interaction: discord.Interaction, title: str, start_date: str, end_date: str, time_options: str, weekdays: str = None
+):
+    try:
+        events = await service.create_events(
+            interaction.guild_id, interaction.channel_id, interaction.user.id,
+            title, start_date, end_date, time_options.split(), weekdays
+        )
+        await send_interaction_message(interaction, bulk_created_message(events))
+        await post_event_messages(interaction.channel, events)
+
+    except InvalidDateError as e:
+        await send_interaction_message(
+            interaction,
+            f"{e}\n"
+            f"例: /schedule_bulk_create title:\"レイド\" start_date:2025-06-01 end_date:2025-08-31 "
+            f"time_options:\"21:00-23:00\" weekdays:水土",
+            ephemeral=True
+        )
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="schedule_respond", description="スケジュール調整イベントに回答します")
-@discord.app_commands.guilds(discord.Object(id=GUILD_ID))  # 特定のギルドにのみコマンドを登録
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
 @discord.app_commands.describe(
     event_id="イベントID",
     time_indices="参加可能な時間の番号（スペース区切りで複数指定可）"
 )
 async def slash_respond(interaction: discord.Interaction, event_id: str, time_indices: str):
-    # 指定されたGuildからのリクエストか確認
-    if interaction.guild_id != GUILD_ID:
-        return
-        
     try:
-        # ObjectIdの検証
-        from bson.objectid import ObjectId
-        obj_id = ObjectId(event_id)
-        
-        # イベントの検索
-        event = events_collection.find_one({'_id': obj_id})
-        if not event:
-            await interaction.response.send_message("指定されたイベントが見つかりません。", ephemeral=True)
-            return
-            
-        # 時間インデックスの検証
-        indices = time_indices.split()
-        selected_times = []
-        for idx in indices:
-            try:
-                index = int(idx) - 1
-                if 0 <= index < len(event['time_options']):
-                    selected_times.append(event['time_options'][index])
-                else:
-                    await interaction.response.send_message(f"無効な時間オプション番号です: {idx}", ephemeral=True)
-                    return
-            except ValueError:
-                await interaction.response.send_message(f"無効な入力です: {idx}。数字を入力してください。", ephemeral=True)
-                return
-                
         # 既存の応答を更新または新規作成
-        responses_collection.update_one(
-            {
-                'event_id': obj_id,
-                'user_id': interaction.user.id
-            },
-            {
-                '$set': {
-                    'username': interaction.user.display_name,
-                    'selected_times': selected_times,
-                    'updated_at': datetime.now(JST)
-                }
-            },
-            upsert=True
+        await service.respond(
+            interaction.guild_id, event_id, interaction.user.id, interaction.user.display_name, time_indices.split()
         )
         
-        await interaction.response.send_message(f"{interaction.user.mention} さんの回答を登録しました。")
+        # チャンネルに流さず本人にだけ表示する（集計は調整メッセージに反映される）
+        await send_interaction_message(interaction, "回答を登録しました。", ephemeral=True)
         
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"エラーが発生しました: {str(e)}", ephemeral=True)
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="schedule_results", description="スケジュール調整の結果を表示します")
-@discord.app_commands.guilds(discord.Object(id=GUILD_ID))  # 特定のギルドにのみコマンドを登録
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
 @discord.app_commands.describe(event_id="イベントID")
 async def slash_show_results(interaction: discord.Interaction, event_id: str):
-    # 指定されたGuildからのリクエストか確認
-    if interaction.guild_id != GUILD_ID:
-        return
-        
     try:
-        # ObjectIdの検証
-        from bson.objectid import ObjectId
-        obj_id = ObjectId(event_id)
-        
-        # イベントの検索
-        event = events_collection.find_one({'_id': obj_id})
-        if not event:
-            await interaction.response.send_message("指定されたイベントが見つかりません。", ephemeral=True)
-            return
-            
-        # イベントの応答を検索
-        responses = list(responses_collection.find({'event_id': obj_id}))
-        
-        # 結果の集計
-        time_counts = {time: 0 for time in event['time_options']}
-        user_responses = {}
-        
-        for response in responses:
-            user_responses[response['username']] = response['selected_times']
-            for time in response['selected_times']:
-                if time in time_counts:
-                    time_counts[time] += 1
+        # サーバー側で集計した結果と参加者一覧の最初のページを表示
+        event, page = await service.results_page(interaction.guild_id, event_id)
+        embed = await build_results_embed(event, page)
         
-        # 結果の表示
-        embed = discord.Embed(
-            title=f"📊 調整結果: {event['title']}",
-            description=f"日付: {event['date'].strftime('%Y-%m-%d')}",
-            color=discord.Color.green()
-        )
-        
-        # 時間ごとの参加者数
-        time_results = []
-        for i, time in enumerate(event['time_options']):
-            count = time_counts[time]
-            time_results.append(f"{i+1}. {time}: {count}人")
+        await send_interaction_message(interaction, embed=embed, view=build_results_view(event, page))
         
-        embed.add_field(name="時間別参加者数", value="\n".join(time_results), inline=False)
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="schedule_recommend", description="参加者の多い時間をおすすめします")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.describe(
+    event_ids="イベントID（スペース区切りで複数指定すると組み合わせをおすすめします）",
+    quorum="最低参加人数",
+    required="必ず参加してほしいメンバー（メンションをスペース区切りで指定）"
+)
+async def slash_recommend(interaction: discord.Interaction, event_ids: str, quorum: int = 0, required: str = ""):
+    try:
+        events = await service.recommend_events(interaction.guild_id, event_ids.split(), MAX_RECOMMEND_EVENTS)
+        required_ids = [int(user_id) for user_id in USER_MENTION_PATTERN.findall(required)]
+        embed = await build_recommend_embed(events, required_ids, quorum)
         
-        # 参加者ごとの選択時間
-        users_results = []
-        for username, times in user_responses.items():
-            users_results.append(f"{username}: {', '.join(times)}")
+        await send_interaction_message(interaction, embed=embed)
         
-        if users_results:
-            embed.add_field(name="参加者一覧", value="\n".join(users_results), inline=False)
-        else:
-            embed.add_field(name="参加者一覧", value="まだ回答がありません。", inline=False)
-        
-        await interaction.response.send_message(embed=embed)
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="schedule_list", description="このサーバーの最近のイベントを表示します")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+async def slash_list_events(interaction: discord.Interaction):
+    try:
+        events = await service.list_events(interaction.guild_id)
+        await send_interaction_message(interaction, embed=build_event_list_embed(events), ephemeral=True)
         
     except Exception as e:
-        await interaction.response.send_message(f"エラーが発生しました: {str(e)}", ephemeral=True)
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="schedule_delete", description="スケジュール調整イベントを削除します")
-@discord.app_commands.guilds(discord.Object(id=GUILD_ID))  # 特定のギルドにのみコマンドを登録
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
 @discord.app_commands.describe(event_id="イベントID")
 async def slash_delete_event(interaction: discord.Interaction, event_id: str):
-    # 指定されたGuildからのリクエストか確認
-    if interaction.guild_id != GUILD_ID:
-        return
+    try:
+        # イベントと関連する応答・タイマーの削除
+        event = await service.delete_event(interaction.guild_id, event_id, interaction.user.id)
         
+        await send_interaction_message(interaction, f"イベント '{event['title']}' を削除しました。")
+        
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="schedule_rebuild_tally", description="スケジュール調整の集計を回答から再計算します")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.describe(event_id="イベントID")
+async def slash_rebuild_tally(interaction: discord.Interaction, event_id: str):
     try:
-        # ObjectIdの検証
-        from bson.objectid import ObjectId
-        obj_id = ObjectId(event_id)
+        # 回答コレクションから集計し直す
+        event = await service.rebuild_tally(interaction.guild_id, event_id)
         
-        # イベントの検索
-        event = events_collection.find_one({'_id': obj_id})
-        if not event:
-            await interaction.response.send_message("指定されたイベントが見つかりません。", ephemeral=True)
-            return
-            
-        # 作成者の確認
-        if event['creator_id'] != interaction.user.id:
-            await interaction.response.send_message("イベントの削除は作成者のみが実行できます。", ephemeral=True)
-            return
-            
-        # イベントと関連する応答の削除
-        events_collection.delete_one({'_id': obj_id})
-        responses_collection.delete_many({'event_id': obj_id})
+        await send_interaction_message(interaction, f"イベント '{event['title']}' の集計を再計算しました。", ephemeral=True)
         
-        await interaction.response.send_message(f"イベント '{event['title']}' を削除しました。")
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="schedule_export", description="イベントの回答をファイルで書き出します")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.describe(event_id="イベントID", format="ファイルの形式（csv または ics）")
+async def slash_export_event(interaction: discord.Interaction, event_id: str, format: Literal['csv', 'ics'] = 'csv'):
+    # 回答が多いと3秒を超えることがあるため、先に応答を保留する
+    await interaction.response.defer(thinking=True)
+    try:
+        file = await export_file(
+            interaction.guild, format, lambda fp: service.export_event(interaction.guild_id, event_id, format, fp)
+        )
+        with phase('send'):
+            await interaction.followup.send(file=file)
+
+    except ServiceError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send(f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="schedule_import", description="CSVファイルの回答をイベントに取り込みます（作成者のみ）")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.describe(event_id="イベントID", file="回答のCSVファイル（/schedule_export と同じ形式）")
+async def slash_import_responses(interaction: discord.Interaction, event_id: str, file: discord.Attachment):
+    if file.size > MAX_IMPORT_BYTES:
+        await send_interaction_message(interaction, f"CSVは{MAX_IMPORT_BYTES // 1024}KBまでです。", ephemeral=True)
+        return
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    try:
+        event, imported = await service.import_responses(
+            interaction.guild_id, event_id, interaction.user.id, await file.read()
+        )
+        with phase('send'):
+            await interaction.followup.send(f"イベント '{event['title']}' に{imported}件の回答を取り込みました。")
+
+    except ServiceError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send(f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="schedule_availability", description="毎週の参加可能時間を登録・表示します")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.describe(
+    pattern="曜日と時刻（例: 水土 21:00 日 13:00）。省略すると現在の登録を表示します",
+    clear="登録を削除する"
+)
+async def slash_availability(interaction: discord.Interaction, pattern: str = None, clear: bool = False):
+    try:
+        if clear:
+            await service.clear_availability(interaction.guild_id, interaction.user.id)
+            message = "毎週の参加可能時間を削除しました。"
+        elif pattern:
+            profile = await service.set_availability(
+                interaction.guild_id, interaction.user.id, interaction.user.display_name, pattern.split()
+            )
+            message = f"毎週の参加可能時間を登録しました: {profile}"
+        else:
+            profile = await service.get_availability(interaction.guild_id, interaction.user.id)
+            message = f"毎週の参加可能時間: {profile}" if profile else "毎週の参加可能時間は登録されていません。"
+        await send_interaction_message(interaction, message, ephemeral=True)
+
+    except ServiceError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
+    except Exception as e:
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
+
+# スラッシュコマンドの引数の範囲（guild_config の検証と同じ値）
+CLOSE_HOURS_MIN, CLOSE_HOURS_MAX = CONFIG_RANGES['close_hours_before']
+REMIND_MINUTES_MIN, REMIND_MINUTES_MAX = CONFIG_RANGES['remind_minutes_before']
+ARCHIVE_DAYS_MIN, ARCHIVE_DAYS_MAX = CONFIG_RANGES['archive_days_after']
+
+@bot.tree.command(name="schedule_config", description="このサーバーでのBotの設定を変更します")
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
+@discord.app_commands.default_permissions(manage_guild=True)
+@discord.app_commands.describe(
+    prefix="従来のコマンドのプレフィックス（例: ?）",
+    close_hours_before="投票を最初の時間オプションの何時間前に締め切るか",
+    remind_minutes_before="決まった時間の何分前にリマインダーを送るか",
+    archive_days_after="最後の時間オプションの何日後にアーカイブするか"
+)
+async def slash_schedule_config(
+    interaction: discord.Interaction,
+    prefix: discord.app_commands.Range[str, 1, MAX_PREFIX_LENGTH] = None,
+    close_hours_before: discord.app_commands.Range[int, CLOSE_HOURS_MIN, CLOSE_HOURS_MAX] = None,
+    remind_minutes_before: discord.app_commands.Range[int, REMIND_MINUTES_MIN, REMIND_MINUTES_MAX] = None,
+    archive_days_after: discord.app_commands.Range[int, ARCHIVE_DAYS_MIN, ARCHIVE_DAYS_MAX] = None
+):
+    if not interaction.user.guild_permissions.manage_guild:
+        await send_interaction_message(interaction, "設定の変更にはサーバー管理権限が必要です。", ephemeral=True)
+        return
+    settings = {
+        key: value for key, value in (
+            ('prefix', prefix),
+            ('close_hours_before', close_hours_before),
+            ('remind_minutes_before', remind_minutes_before),
+            ('archive_days_after', archive_days_after),
+        ) if value is not None
+    }
+    try:
+        config = await guild_configs.update(interaction.guild_id, **settings) if settings else await guild_configs.get(interaction.guild_id)
+        # 何も指定されなければ現在の設定を表示する
+        lines = [f"{key}: {config[key]}" for key in config]
+        message = "設定を変更しました。\n" if settings else "現在の設定:\n"
+        await send_interaction_message(interaction, message + "\n".join(lines), ephemeral=True)
         
+    except ValueError as e:
+        await send_interaction_message(interaction, str(e), ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"エラーが発生しました: {str(e)}", ephemeral=True)
+        await send_interaction_message(interaction, f"エラーが発生しました: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="schedule_help", description="スケジュール調整botのヘルプを表示します")
-@discord.app_commands.guilds(discord.Object(id=GUILD_ID))  # 特定のギルドにのみコマンドを登録
+@discord.app_commands.guild_only()  # サーバー内でのみ使用可能
 async def slash_help(interaction: discord.Interaction):
-    # 指定されたGuildからのリクエストか確認
-    if interaction.guild_id != GUILD_ID:
-        return
-        
     embed = discord.Embed(
         title="📅 スケジュール調整Bot ヘルプ",
         description="スケジュール調整のためのコマンド一覧",
@@ -517,34 +1309,48 @@ async def slash_help(interaction: discord.Interaction):
     
     commands_info = [
         ("/schedule_create", "新しいイベントを作成します\n例: /schedule_create title:\"会議\" date:2025-05-20 time_options:\"13:00 15:00 17:00\""),
+        ("/schedule_bulk_create", "期間内の日付ごとにイベントをまとめて作成します\n例: /schedule_bulk_create title:\"レイド\" start_date:2025-06-01 end_date:2025-08-31 time_options:\"21:00-23:00\" weekdays:水土"),
         ("/schedule_respond", "イベントに応答します\n例: /schedule_respond event_id:507f1f77bcf86cd799439011 time_indices:\"1 3\""),
         ("/schedule_results", "イベントの応答結果を表示します"),
+        ("/schedule_recommend", "参加者の多い時間をおすすめします\n例: /schedule_recommend event_ids:\"ID1 ID2\" quorum:4 required:\"@メンバー\""),
+        ("/schedule_list", "このサーバーの最近のイベントを表示します"),
         ("/schedule_delete", "イベントを削除します（作成者のみ）"),
+        ("/schedule_rebuild_tally", "集計結果がずれた場合に回答から再計算します"),
+        ("/schedule_export", "回答をCSVまたはiCalendarファイルで書き出します"),
+        ("/schedule_import", "CSVファイルの回答を取り込みます（作成者のみ）"),
+        ("/schedule_availability", "毎週の参加可能時間を登録します（新しいイベントに自動で回答されます）\n例: /schedule_availability pattern:\"水土 21:00 日 13:00\""),
+        ("/schedule_config", "このサーバーでのBotの設定を変更します（サーバー管理権限が必要）"),
         ("/schedule_help", "このヘルプメッセージを表示します"),
-        ("従来のコマンド", "!create_event, !respond, !show_results, !delete_event, !help_schedule も引き続き使用可能です")
+        ("従来のコマンド", "!create_event, !bulk_create_event, !respond, !show_results, !recommend, !list_events, !delete_event, !rebuild_tally, !export_event, !import_responses, !availability, !schedule_config, !help_schedule も引き続き使用可能です")
     ]
     
     for cmd, desc in commands_info:
         embed.add_field(name=cmd, value=desc, inline=False)
     
-    await interaction.response.send_message(embed=embed)
-
+    await send_interaction_message(interaction, embed=embed)
 
 
-# HTTPサーバーでRenderのポートスキャンを回避（ダミー）
-app = Flask(__name__)
 
-@app.route("/")
-def index():
-    return "OK"  # Renderのポートスキャン対策用
+async def main():
+    # Renderなどがコンテナを止めるとき（SIGTERM）も close() を通し、
+    # バッファに残った回答と送信キューのメッセージを書き出してから終了する
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.create_task(bot.close()))
+        except NotImplementedError:
+            # Windowsではシグナルハンドラーを登録できない（Ctrl+CはKeyboardInterruptで止まる）
+            pass
+    try:
+        async with bot:
+            await bot.start(DISCORD_TOKEN)
+    finally:
+        # async with の終了はDiscordとの接続が閉じるまでしか待たないため、Bot側の終了処理の完了も待つ
+        await bot.close()
 
-def run_http_server():
-    port = int(os.environ.get("PORT", 10000))  # Renderが使用するPORT
-    app.run(host="0.0.0.0", port=port)
 
 if __name__ == "__main__":
-    # HTTPサーバーを別スレッドで起動
-    Thread(target=run_http_server).start()
-    
+    # ログの設定（トレースはJSON形式で出力）
+    configure_logging()
     # Discord Botを起動
-    bot.run(DISCORD_TOKEN)
\ No newline at end of file
+    asyncio.run(main())
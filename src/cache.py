@@ -0,0 +1,108 @@
+# イベント情報のインメモリキャッシュ
+# イベントのタイトル・日付・時間オプションは作成後に変わらないため、
+# 読み込んだドキュメントをLRU+TTLで保持してMongoDBへの往復を減らす
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class EventCache:
+    """
+    LRU+TTLで追い出すイベントドキュメントのキャッシュ
+    asyncioの単一スレッドで使う前提のため、ロックの代わりに
+    同じキーへの同時読み込みを1つのFutureにまとめる
+    """
+
+    def __init__(self, max_size=1024, ttl=600.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def snapshot(self):
+        """期限内のエントリーを (key, value) のリストで返す（LRUの順序や統計は変えない）"""
+        now = self._clock()
+        return [(key, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def clear(self):
+        self._entries.clear()
+        self._pending.clear()
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        # 読み込み中の結果も古くなるのでキャッシュに入れないようにする
+        self._pending.pop(key, None)
+
+    async def get_or_load(self, key, loader):
+        """
+        キャッシュにあればそれを返し、なければloaderで読み込んでキャッシュする
+        見つからなかった（None）結果はキャッシュしない
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # 待っている呼び出しがなくても警告が出ないように例外を取り出しておく
+                future.exception()
+            else:
+                future.cancel()
+            raise
+
+        # 読み込み中に無効化された場合はキャッシュに入れない
+        if self._pending.get(key) is future:
+            del self._pending[key]
+            if value is not None:
+                self.put(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,448 @@
+# MongoDBアクセス層
+# すべてのコマンドはこのモジュールのリポジトリ経由でMongoDBにアクセスする
+
+import os
+from datetime import datetime
+
+import pytz
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
+
+from cache import EventCache
+from tracing import traced_phase
+
+# タイムゾーンの設定 (日本時間)
+JST = pytz.timezone('Asia/Tokyo')
+
+
+def client_options_from_env():
+    """
+    環境変数からMongoDBクライアントの接続プール・タイムアウト設定を読み込む
+    未設定の項目はpymongoの既定値を使う
+    """
+    env_options = {
+        'MONGODB_MAX_POOL_SIZE': 'maxPoolSize',
+        'MONGODB_MIN_POOL_SIZE': 'minPoolSize',
+        'MONGODB_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+        'MONGODB_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+        'MONGODB_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+        'MONGODB_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+        'MONGODB_TIMEOUT_MS': 'timeoutMS',
+    }
+    options = {}
+    for env_name, option_name in env_options.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option_name] = int(value)
+    return options
+
+
+def event_cache_from_env():
+    """環境変数からイベントキャッシュの件数上限とTTL（秒）を読み込む"""
+    return EventCache(
+        max_size=int(os.getenv('EVENT_CACHE_SIZE', '1024')),
+        ttl=float(os.getenv('EVENT_CACHE_TTL', '600'))
+    )
+
+
+def count_increments(old_mask, new_mask):
+    """選択が変わった時間オプション（ビット）だけ、集計カウンターの増減を返す"""
+    increments = {}
+    changed = old_mask ^ new_mask
+    while changed:
+        low = changed & -changed
+        increments[f'counts.{low.bit_length() - 1}'] = 1 if new_mask & low else -1
+        changed ^= low
+    return increments
+
+
+def add_mask_counts(counts, mask, count=1):
+    """ビットマスクの立っている時間オプションのカウンターにcountを足す"""
+    i = 0
+    while mask and i < len(counts):
+        if mask & 1:
+            counts[i] += count
+        mask >>= 1
+        i += 1
+
+
+class ScheduleRepository:
+    """
+    イベントと回答の非同期リポジトリ
+    pymongoの非同期クライアントを使うため、DBの往復中もイベントループをブロックしない
+    作成後に変わらないイベント情報はevent_cacheに保持する
+    """
+
+    def __init__(self, uri, db_name='schedule_bot', event_cache=None, **client_options):
+        self.event_cache = event_cache or EventCache()
+        # 日時はタイムゾーン付き（日本時間）で読み込む
+        self.client = AsyncMongoClient(uri, tz_aware=True, tzinfo=JST, **client_options)
+        self.db = self.client[db_name]
+        self.events = self.db['events']
+        self.responses = self.db['responses']
+        self.events_archive = self.db['events_archive']
+        self._supports_transactions = None
+
+    @staticmethod
+    def event_document(guild_id, channel_id, creator_id, title, event_date, time_options, slots=None):
+        return {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'creator_id': creator_id,
+            'title': title,
+            'date': event_date,
+            'time_options': list(time_options),
+            # 時間オプションごとの開始・終了日時（timeslots.parse_time_options で作成）
+            'slots': list(slots or []),
+            # 時間オプションごとの回答数（回答のたびに差分で更新する）
+            'counts': [0] * len(time_options),
+            'created_at': datetime.now(JST)
+        }
+
+    @traced_phase('db_write')
+    async def create_event(self, guild_id, channel_id, creator_id, title, event_date, time_options, slots=None):
+        result = await self.events.insert_one(
+            self.event_document(guild_id, channel_id, creator_id, title, event_date, time_options, slots)
+        )
+        return result.inserted_id
+
+    @traced_phase('db_write')
+    async def create_events(self, documents):
+        """event_documentで作ったイベントをinsert_manyでまとめて作成し、_idを付けたdocumentsを返す"""
+        await self.events.insert_many(documents)
+        return documents
+
+    @traced_phase('db_read')
+    async def get_event(self, event_id, guild_id=None):
+        """
+        キャッシュ経由でイベントを取得する
+        guild_idを指定した場合、ほかのサーバーのイベントは見つからなかったものとして扱う
+        集計カウンターは回答のたびに変わるため含まない（get_event_with_countsを使う）
+        """
+        event = await self.event_cache.get_or_load(
+            event_id,
+            lambda: self.events.find_one({'_id': event_id}, projection={'counts': 0})
+        )
+        if event and guild_id is not None and event.get('guild_id') != guild_id:
+            return None
+        return event
+
+    @traced_phase('db_read')
+    async def get_event_with_counts(self, event_id, guild_id=None):
+        """集計カウンターを含む最新のイベントを取得し、キャッシュも更新する"""
+        event = await self.events.find_one({'_id': event_id})
+        if event:
+            self.event_cache.put(event_id, {key: value for key, value in event.items() if key != 'counts'})
+        if event and guild_id is not None and event.get('guild_id') != guild_id:
+            return None
+        return event
+
+    @traced_phase('db_write')
+    async def set_event_message(self, event_id, message_id):
+        """イベントの調整メッセージ（ボタン付きで結果をライブ更新するメッセージ）のIDを保存する"""
+        self.event_cache.invalidate(event_id)
+        await self.events.update_one({'_id': event_id}, {'$set': {'message_id': message_id}})
+
+    @traced_phase('db_read')
+    async def list_events(self, guild_id, limit=10):
+        """サーバーの最近のイベントを新しい順に返す"""
+        return await self.events.find(
+            {'guild_id': guild_id},
+            projection={'title': 1, 'date': 1, 'time_options': 1, 'created_at': 1}
+        ).sort('created_at', -1).limit(limit).to_list()
+
+    async def supports_transactions(self):
+        """レプリカセット/シャードクラスタに接続している場合のみトランザクションを使う"""
+        if self._supports_transactions is None:
+            hello = await self.client.admin.command('hello')
+            self._supports_transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        return self._supports_transactions
+
+    async def _run_in_transaction(self, operation):
+        """レプリカセットではoperationを1つのトランザクションで実行する"""
+        if await self.supports_transactions():
+            async with self.client.start_session() as session:
+                async def callback(session):
+                    await operation(session)
+                await session.with_transaction(callback)
+        else:
+            await operation(None)
+
+    @traced_phase('db_write')
+    async def save_response(self, event, user_id, username, selected_mask):
+        """
+        回答（選んだ時間オプションのビットマスク）を保存し、イベントの集計カウンターに差分を反映する
+        レプリカセットでは回答のupsertとカウンター更新を1つのトランザクションで行う
+        """
+        await self._run_in_transaction(
+            lambda session: self._save_response(event, user_id, username, selected_mask, session)
+        )
+
+    async def _save_response(self, event, user_id, username, selected_mask, session=None):
+        # 既存の応答を更新または新規作成し、更新前の選択を受け取る
+        previous = await self.responses.find_one_and_update(
+            {
+                'event_id': event['_id'],
+                'user_id': user_id
+            },
+            {
+                '$set': {
+                    'username': username,
+                    'selected_mask': selected_mask,
+                    'updated_at': datetime.now(JST)
+                }
+            },
+            projection={'_id': 0, 'selected_mask': 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+
+        # 選択が変わったオプションだけカウンターを増減する
+        increments = count_increments(previous.get('selected_mask', 0) if previous else 0, selected_mask)
+        if increments:
+            # カウンターを持たない旧形式のイベントは rebuild_counts で初期化する
+            await self.events.update_one(
+                {'_id': event['_id'], 'counts': {'$exists': True}},
+                {'$inc': increments},
+                session=session
+            )
+
+    @traced_phase('db_write')
+    async def toggle_response(self, event, user_id, username, index):
+        """
+        時間オプション（0始まり）の選択を $bit で反転し、カウンターにも差分を反映して、反転後のビットマスクを返す
+        読み込みと書き込みを1回の更新で行うため、同じユーザーが続けてボタンを押しても取りこぼさない
+        """
+        bit = 1 << index
+        toggled = {}
+
+        async def operation(session):
+            previous = await self.responses.find_one_and_update(
+                {'event_id': event['_id'], 'user_id': user_id},
+                {
+                    '$bit': {'selected_mask': {'xor': bit}},
+                    '$set': {'username': username, 'updated_at': datetime.now(JST)}
+                },
+                projection={'_id': 0, 'selected_mask': 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+            old_mask = previous.get('selected_mask', 0) if previous else 0
+            toggled['mask'] = old_mask ^ bit
+            await self.events.update_one(
+                {'_id': event['_id'], 'counts': {'$exists': True}},
+                {'$inc': count_increments(old_mask, toggled['mask'])},
+                session=session
+            )
+
+        await self._run_in_transaction(operation)
+        return toggled['mask']
+
+    @traced_phase('db_write')
+    async def save_responses(self, responses):
+        """
+        複数の回答をbulk_writeでまとめて保存し、集計カウンターにも差分をまとめて反映する
+        responsesは event, user_id, username, selected_mask, updated_at を持つdictのリスト
+        （同じイベント・ユーザーの回答は呼び出し側で1件にまとめておくこと）
+        読み込んだ更新前の選択は各dictの previous_mask に記録する。トランザクションを使えない場合に
+        回答だけ書き込まれて失敗しても、同じdictで再試行すればカウンターの差分を正しく反映できる
+        """
+        if responses:
+            await self._run_in_transaction(lambda session: self._save_responses(responses, session))
+
+    async def _save_responses(self, responses, session=None):
+        # 更新前の選択を1回のクエリでまとめて取得する
+        # トランザクションを使えない場合は、再試行で記録済みのもの（回答だけ書き込まれた可能性がある）は読み直さない
+        keys = [{'event_id': r['event']['_id'], 'user_id': r['user_id']} for r in responses]
+        unknown = [
+            (key, r) for key, r in zip(keys, responses) if session is not None or 'previous_mask' not in r
+        ]
+        if unknown:
+            previous = {}
+            cursor = self.responses.find(
+                {'$or': [key for key, _ in unknown]},
+                projection={'_id': 0, 'event_id': 1, 'user_id': 1, 'selected_mask': 1},
+                session=session
+            )
+            async for doc in cursor:
+                previous[(doc['event_id'], doc['user_id'])] = doc.get('selected_mask', 0)
+            for key, r in unknown:
+                r['previous_mask'] = previous.get((key['event_id'], key['user_id']), 0)
+
+        await self.responses.bulk_write([
+            UpdateOne(
+                key,
+                {'$set': {
+                    'username': r['username'],
+                    'selected_mask': r['selected_mask'],
+                    'updated_at': r['updated_at']
+                }},
+                upsert=True
+            )
+            for key, r in zip(keys, responses)
+        ], ordered=False, session=session)
+
+        # イベントごとにカウンターの増減を合算して反映
+        event_increments = {}
+        for r in responses:
+            increments = event_increments.setdefault(r['event']['_id'], {})
+            for field, delta in count_increments(r['previous_mask'], r['selected_mask']).items():
+                increments[field] = increments.get(field, 0) + delta
+        event_updates = []
+        for event_id, increments in event_increments.items():
+            increments = {field: delta for field, delta in increments.items() if delta}
+            if increments:
+                event_updates.append(
+                    UpdateOne({'_id': event_id, 'counts': {'$exists': True}}, {'$inc': increments})
+                )
+        if event_updates:
+            await self.events.bulk_write(event_updates, ordered=False, session=session)
+
+    @traced_phase('db_write')
+    async def import_responses(self, event_id, rows, batch_size=500):
+        """
+        (ユーザーID, 名前, ビットマスク) の行をbulk_writeでbatch_size件ずつupsertし、件数を返す
+        集計カウンターは更新しないため、取り込み後に rebuild_counts を呼ぶこと
+        """
+        imported = 0
+        updates = []
+        for user_id, username, selected_mask in rows:
+            updates.append(UpdateOne(
+                {'event_id': event_id, 'user_id': user_id},
+                {'$set': {'username': username, 'selected_mask': selected_mask, 'updated_at': datetime.now(JST)}},
+                upsert=True
+            ))
+            if len(updates) >= batch_size:
+                await self.responses.bulk_write(updates, ordered=False)
+                imported += len(updates)
+                updates = []
+        if updates:
+            await self.responses.bulk_write(updates, ordered=False)
+            imported += len(updates)
+        return imported
+
+    @traced_phase('db_write')
+    async def add_prefilled_counts(self, event_id, counts, prefilled):
+        """自動入力した回答の分だけ集計カウンターを増やし、自動入力した人数を記録する"""
+        increments = {f'counts.{i}': count for i, count in enumerate(counts) if count}
+        await self.events.update_one(
+            {'_id': event_id}, {'$inc': increments, '$set': {'prefilled': prefilled}}
+        )
+
+    @traced_phase('db_read')
+    async def tally_responses(self, event_id, option_count):
+        """
+        時間オプションごとの回答数を集計する
+        サーバー側で同じビットマスクの回答をまとめて数え、ビットの展開だけをここで行う
+        """
+        cursor = await self.responses.aggregate([
+            {'$match': {'event_id': event_id}},
+            {'$group': {'_id': '$selected_mask', 'count': {'$sum': 1}}},
+        ])
+        counts = [0] * option_count
+        async for doc in cursor:
+            add_mask_counts(counts, doc['_id'] or 0, doc['count'])
+        return counts
+
+    @traced_phase('db_write')
+    async def rebuild_counts(self, event):
+        """回答コレクションから集計カウンターを作り直す"""
+        counts = await self.tally_responses(event['_id'], len(event['time_options']))
+        await self.events.update_one({'_id': event['_id']}, {'$set': {'counts': counts}})
+        return counts
+
+    @traced_phase('db_read')
+    async def get_selected_mask(self, event_id, user_id):
+        """ユーザーの現在の選択（ビットマスク）を返す（未回答なら0）"""
+        response = await self.responses.find_one(
+            {'event_id': event_id, 'user_id': user_id},
+            projection={'_id': 0, 'selected_mask': 1}
+        )
+        return response.get('selected_mask', 0) if response else 0
+
+    @traced_phase('db_read')
+    async def participants_page(self, event_id, after=None, before=None, limit=20):
+        """
+        参加者一覧の1ページ分を _id の順に返す（キーセットページネーション）
+        afterを指定するとその回答より後、beforeを指定するとその回答より前のページを読む
+        (回答のリスト, 同じ方向にまだ続きがあるか) を返す
+        """
+        query = {'event_id': event_id}
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        elif before is not None:
+            query['_id'] = {'$lt': before}
+        # 続きがあるかを知るために1件多く読む
+        cursor = self.responses.find(
+            query, projection={'username': 1, 'selected_mask': 1}
+        ).sort('_id', -1 if before is not None else 1).limit(limit + 1)
+        page = await cursor.to_list()
+        has_more = len(page) > limit
+        page = page[:limit]
+        if before is not None:
+            page.reverse()
+        return page, has_more
+
+    def iter_responses(self, event_id):
+        """エクスポート用に、回答を登録順に返すカーソル"""
+        return self.responses.find(
+            {'event_id': event_id},
+            projection={'_id': 0, 'user_id': 1, 'username': 1, 'selected_mask': 1, 'updated_at': 1},
+            sort=[('_id', 1)]
+        )
+
+    def iter_option_participants(self, event_id, index):
+        """指定した時間オプション（0始まり）を選んだ参加者を返すカーソル"""
+        return self.responses.find(
+            {'event_id': event_id, 'selected_mask': {'$bitsAllSet': [index]}},
+            projection={'_id': 0, 'user_id': 1, 'username': 1}
+        )
+
+    def iter_availability(self, event_id):
+        """おすすめ算出用に、ユーザーIDと選択（ビットマスク）だけを返すカーソル"""
+        return self.responses.find(
+            {'event_id': event_id},
+            projection={'_id': 0, 'user_id': 1, 'selected_mask': 1}
+        )
+
+    @traced_phase('db_read')
+    async def find_participant_ids(self, event_id, index, limit=50):
+        """指定した時間オプション（0始まり）を選んだユーザーのIDを返す（リマインダーのメンション用）"""
+        cursor = self.responses.find(
+            {'event_id': event_id, 'selected_mask': {'$bitsAllSet': [index]}},
+            projection={'_id': 0, 'user_id': 1}
+        ).limit(limit)
+        return [response['user_id'] async for response in cursor]
+
+    @traced_phase('db_write')
+    async def close_event(self, event_id):
+        """投票を締め切り、集計カウンターを含む最新のイベントを返す（締切済みならNone）"""
+        self.event_cache.invalidate(event_id)
+        return await self.events.find_one_and_update(
+            {'_id': event_id, 'closed': {'$ne': True}},
+            {'$set': {'closed': True, 'closed_at': datetime.now(JST)}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @traced_phase('db_write')
+    async def archive_event(self, event_id):
+        """イベントをアーカイブコレクションに移し、回答を削除する"""
+        event = await self.events.find_one({'_id': event_id})
+        if event is None:
+            return None
+        event['archived_at'] = datetime.now(JST)
+        event['response_count'] = await self.responses.count_documents({'event_id': event_id})
+        await self.events_archive.replace_one({'_id': event_id}, event, upsert=True)
+        await self.delete_event(event_id)
+        return event
+
+    @traced_phase('db_write')
+    async def delete_event(self, event_id):
+        # イベントと関連する応答の削除
+        self.event_cache.invalidate(event_id)
+        await self.events.delete_one({'_id': event_id})
+        await self.responses.delete_many({'event_id': event_id})
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,177 @@
+# 回答のエクスポート（CSV・iCalendar）とCSVからのインポート
+# 回答はカーソルから1件ずつ読み、1行ずつファイルに書き出すため、回答数が多くてもメモリ使用量は増えない。
+# CSVの列は user_id, username, 時間オプション（選んでいれば1）..., updated_at で、
+# 同じ形式のCSV（時間オプションの列だけでもよい）をインポートできる。
+# 時間オプションの列の見出しは '1. 13:00' のように番号を付け、同じ時刻のオプションが複数あっても区別できるようにする。
+
+import csv
+import io
+import re
+from datetime import datetime, timedelta, timezone
+
+from timeslots import MAX_TIME_OPTIONS, option_start
+
+# インポートで「参加できる」とみなすセルの値
+AVAILABLE_VALUES = {'1', 'o', '○', '◯', 'y', 'yes', 'true'}
+
+ICS_DATETIME_FORMAT = '%Y%m%dT%H%M%SZ'
+# 終了時刻のない時間オプションの長さ
+DEFAULT_SLOT_LENGTH = timedelta(hours=1)
+
+
+# 番号付きの時間オプションの列の見出し（'1. 13:00'）
+OPTION_COLUMN_PATTERN = re.compile(r'(\d+)\.\s*(.*)')
+
+
+class CsvImportError(ValueError):
+    """インポートするCSVの形式が正しくない"""
+
+
+def _csv_line(row):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue()
+
+
+async def iter_csv_lines(event, responses):
+    """回答のカーソルからCSVの行を1行ずつ返す"""
+    options = [f'{i + 1}. {label}' for i, label in enumerate(event['time_options'])]
+    yield _csv_line(['user_id', 'username', *options, 'updated_at'])
+    option_count = len(event['time_options'])
+    async for response in responses:
+        mask = response.get('selected_mask', 0)
+        updated_at = response.get('updated_at')
+        yield _csv_line([
+            response['user_id'],
+            response['username'],
+            *(1 if mask >> i & 1 else 0 for i in range(option_count)),
+            updated_at.isoformat() if updated_at else '',
+        ])
+
+
+def _ics_escape(text):
+    return (
+        str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def _ics_fold(line):
+    """75オクテットを超える行を折り返す（RFC 5545）"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    current = ''
+    limit = 75
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = ''
+            # 続きの行は先頭の空白の分だけ短くする
+            limit = 74
+        current += char
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _ics_datetime(value):
+    return value.astimezone(timezone.utc).strftime(ICS_DATETIME_FORMAT)
+
+
+async def iter_ics_lines(event, repository):
+    """
+    時間オプションごとのVEVENTを1行ずつ返す
+    その時間を選んだ参加者はATTENDEEとして、オプションごとのカーソルから読みながら書き出す
+    """
+    yield _ics_fold('BEGIN:VCALENDAR')
+    yield _ics_fold('VERSION:2.0')
+    yield _ics_fold('PRODID:-//DiscordBot-AutoSchedule//JA')
+    yield _ics_fold('CALSCALE:GREGORIAN')
+    stamp = _ics_datetime(datetime.now(timezone.utc))
+    counts = event.get('counts') or [0] * len(event['time_options'])
+    slots = event.get('slots') or []
+    for i, label in enumerate(event['time_options']):
+        yield _ics_fold('BEGIN:VEVENT')
+        yield _ics_fold(f"UID:{event['_id']}-{i}@discord-schedule-bot")
+        yield _ics_fold(f'DTSTAMP:{stamp}')
+        start = option_start(event, i)
+        if start is not None:
+            end = slots[i]['end'] if i < len(slots) and slots[i]['end'] else start + DEFAULT_SLOT_LENGTH
+            yield _ics_fold(f'DTSTART:{_ics_datetime(start)}')
+            yield _ics_fold(f'DTEND:{_ics_datetime(end)}')
+        else:
+            # 日時として解釈できない時間オプションはイベント日の終日予定にする
+            day = event['date']
+            yield _ics_fold(f"DTSTART;VALUE=DATE:{day.strftime('%Y%m%d')}")
+            yield _ics_fold(f"DTEND;VALUE=DATE:{(day + timedelta(days=1)).strftime('%Y%m%d')}")
+        yield _ics_fold(f"SUMMARY:{_ics_escape(event['title'])} ({_ics_escape(label)})")
+        yield _ics_fold(f'DESCRIPTION:{_ics_escape(f"参加可能: {counts[i]}人")}')
+        async for response in repository.iter_option_participants(event['_id'], i):
+            yield _ics_fold(
+                f'ATTENDEE;CN="{response["username"].replace(chr(34), "")}";PARTSTAT=ACCEPTED:'
+                f"urn:x-discord:user:{response['user_id']}"
+            )
+        yield _ics_fold('END:VEVENT')
+    yield _ics_fold('END:VCALENDAR')
+
+
+async def write_lines(lines, fp, encoding='utf-8'):
+    """行のジェネレーターをバイナリファイルに書き出し、書いたバイト数を返す"""
+    written = 0
+    async for line in lines:
+        written += fp.write(line.encode(encoding))
+    return written
+
+
+def _option_columns(header, options):
+    """見出しから (列番号, 時間オプションの番号) のリストを作る"""
+    unassigned = {}
+    for i, label in enumerate(options):
+        unassigned.setdefault(label, []).append(i)
+    columns = []
+    for column, title in enumerate(header):
+        match = OPTION_COLUMN_PATTERN.fullmatch(title)
+        if match and 0 < int(match[1]) <= len(options) and options[int(match[1]) - 1] == match[2].strip():
+            index = int(match[1]) - 1
+            if index in unassigned[options[index]]:
+                unassigned[options[index]].remove(index)
+        elif unassigned.get(title):
+            index = unassigned[title].pop(0)
+        else:
+            continue
+        columns.append((column, index))
+    return columns
+
+
+def iter_import_rows(event, lines):
+    """
+    CSVの行から (ユーザーID, 名前, ビットマスク) を1件ずつ返す
+    時間オプションの列は番号付きの見出し（'1. 13:00'）なら番号で、番号のない見出しは同じ文字列の
+    時間オプションに前から順に対応付ける。イベントにない列は無視する
+    """
+    reader = csv.reader(lines)
+    try:
+        header = [column.strip() for column in next(reader)]
+    except StopIteration:
+        raise CsvImportError("CSVが空です。") from None
+    if 'user_id' not in header:
+        raise CsvImportError("CSVに user_id の列がありません。")
+    user_column = header.index('user_id')
+    name_column = header.index('username') if 'username' in header else None
+    option_columns = _option_columns(header, event['time_options'][:MAX_TIME_OPTIONS])
+    if not option_columns:
+        raise CsvImportError("CSVにイベントの時間オプションの列がありません。")
+
+    for line_number, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            user_id = int(row[user_column])
+        except (IndexError, ValueError):
+            raise CsvImportError(f"{line_number}行目: user_id が正しくありません。") from None
+        username = row[name_column] if name_column is not None and name_column < len(row) else str(user_id)
+        mask = 0
+        for column, index in option_columns:
+            if column < len(row) and row[column].strip().lower() in AVAILABLE_VALUES:
+                mask |= 1 << index
+        yield user_id, username, mask
@@ -0,0 +1,104 @@
+# サーバー（ギルド）ごとの設定
+# 設定はMongoDBのguild_configsコレクションに保存し、読み込んだものはメモリに保持する
+
+DEFAULT_PREFIX = '!'
+# プレフィックスの最大文字数
+MAX_PREFIX_LENGTH = 5
+
+# 設定できる項目と既定値
+DEFAULT_CONFIG = {
+    'prefix': DEFAULT_PREFIX,
+    # 投票を最初の時間オプションの開始の何時間前に締め切るか（0なら開始時刻）
+    'close_hours_before': 0,
+    # 決まった時間の何分前にリマインダーを送るか
+    'remind_minutes_before': 60,
+    # 最後の時間オプションの終了（日時を持たなければイベント日）の何日後にアーカイブするか
+    'archive_days_after': 7,
+}
+
+# 数値の設定の範囲（最小値, 最大値）。スラッシュコマンドの引数の範囲もこれに合わせる
+CONFIG_RANGES = {
+    'close_hours_before': (0, 720),
+    'remind_minutes_before': (0, 10080),
+    'archive_days_after': (0, 365),
+}
+
+
+def validate_setting(key, value):
+    """
+    コマンドから渡された設定値を既定値と同じ型に変換して検証し、保存する値を返す
+    形式や範囲が正しくなければValueError（メッセージはそのまま返信に使う）
+    """
+    if key == 'prefix':
+        prefix = str(value).strip()
+        if not prefix or any(char.isspace() for char in prefix) or len(prefix) > MAX_PREFIX_LENGTH:
+            raise ValueError(f"プレフィックスは空白を含まない{MAX_PREFIX_LENGTH}文字以内で指定してください。")
+        return prefix
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{key} には整数を指定してください。") from None
+    low, high = CONFIG_RANGES[key]
+    if not low <= value <= high:
+        raise ValueError(f"{key} は{low}から{high}の範囲で指定してください。")
+    return value
+
+
+class GuildConfigStore:
+    """
+    サーバーごとの設定の読み書き
+    プレフィックスはメッセージのたびに参照するため、一度読んだ設定はキャッシュする
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._configs = {}
+
+    async def get(self, guild_id):
+        config = self._configs.get(guild_id)
+        if config is None:
+            config = self._from_document(await self.collection.find_one({'_id': guild_id}))
+            self._configs[guild_id] = config
+        return config
+
+    @staticmethod
+    def _from_document(document):
+        document = document or {}
+        return {key: document.get(key, default) for key, default in DEFAULT_CONFIG.items()}
+
+    async def update(self, guild_id, **settings):
+        unknown = set(settings) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"不明な設定項目です: {', '.join(sorted(unknown))}")
+        # 従来のコマンドとスラッシュコマンドのどちらから渡された値もここで検証する
+        settings = {key: validate_setting(key, value) for key, value in settings.items()}
+        await self.collection.update_one({'_id': guild_id}, {'$set': settings}, upsert=True)
+        self._configs.pop(guild_id, None)
+        return await self.get(guild_id)
+
+    def forget(self, guild_id):
+        """Botがサーバーから抜けたときにキャッシュを破棄する"""
+        self._configs.pop(guild_id, None)
+
+    def clear(self):
+        self._configs.clear()
+
+    async def refresh(self):
+        """
+        キャッシュした設定をDBと比べ、ほかのプロセスが変更したものを破棄する（change streamを使えない場合用）
+        破棄した件数を返す
+        """
+        if not self._configs:
+            return 0
+        cursor = self.collection.find({'_id': {'$in': list(self._configs)}})
+        documents = {document['_id']: document async for document in cursor}
+        stale = [
+            guild_id for guild_id, config in self._configs.items()
+            if config != self._from_document(documents.get(guild_id))
+        ]
+        for guild_id in stale:
+            self._configs.pop(guild_id, None)
+        return len(stale)
+
+    async def get_prefix(self, guild_id):
+        return (await self.get(guild_id))['prefix']
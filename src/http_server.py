@@ -0,0 +1,67 @@
+# ヘルスチェック・メトリクス用のHTTPサーバー
+# Botと同じイベントループ上でaiohttpを動かし、Renderのポートスキャンにも応答する
+#   /        : "OK"（ポートスキャン用）
+#   /healthz : ゲートウェイ接続とMongoDB疎通の確認（正常なら200、異常なら503）
+#   /metrics : Prometheus形式のメトリクス
+
+import asyncio
+import math
+
+from aiohttp import web
+
+from metrics import EVENT_CACHE, GATEWAY_LATENCY, REGISTRY
+
+# /healthz でMongoDBのpingを待つ最大秒数
+MONGO_PING_TIMEOUT = 2.0
+
+
+class HealthServer:
+    def __init__(self, bot, repository, host='0.0.0.0', port=10000):
+        self.bot = bot
+        self.repository = repository
+        self.host = host
+        self.port = port
+        self._runner = None
+        REGISTRY.add_collector(self._collect)
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([
+            web.get('/', self.index),
+            web.get('/healthz', self.healthz),
+            web.get('/metrics', self.metrics),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _collect(self):
+        for stat, value in self.repository.event_cache.stats().items():
+            EVENT_CACHE.set(stat, value=value)
+        for shard_id, latency in self.bot.latencies:
+            # 最初のハートビート前はinfになるため出力しない
+            if math.isfinite(latency):
+                GATEWAY_LATENCY.set(str(shard_id), value=latency)
+
+    async def index(self, request):
+        return web.Response(text='OK')
+
+    async def healthz(self, request):
+        gateway = self.bot.is_ready() and not self.bot.is_closed()
+        try:
+            await asyncio.wait_for(self.repository.client.admin.command('ping'), MONGO_PING_TIMEOUT)
+            mongo = True
+        except Exception:
+            mongo = False
+        return web.json_response(
+            {'gateway': gateway, 'mongo': mongo, 'latency': self.bot.latency if math.isfinite(self.bot.latency) else None},
+            status=200 if gateway and mongo else 503
+        )
+
+    async def metrics(self, request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
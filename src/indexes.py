@@ -0,0 +1,211 @@
+# インデックス管理
+# 起動時に必要なインデックスを作成・検証し、クエリがインデックスを使っているかを診断する
+# 単体実行: MONGODB_URI=... python src/indexes.py --explain
+
+import logging
+import os
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+INDEX_OPTIONS_CONFLICT = 85
+
+# アーカイブしたイベントを保持する日数（TTLインデックスで自動削除）
+ARCHIVE_TTL_DAYS = int(os.getenv('ARCHIVE_TTL_DAYS', '180'))
+
+# コレクションごとに必要なインデックス
+REQUIRED_INDEXES = {
+    'events': [
+        # サーバーごとのイベント一覧用
+        IndexModel([('guild_id', ASCENDING), ('created_at', DESCENDING)], name='guild_created'),
+    ],
+    'responses': [
+        # 回答のupsert・検索・削除用。同じユーザーの重複回答も防ぐ
+        IndexModel([('event_id', ASCENDING), ('user_id', ASCENDING)], name='event_user_unique', unique=True),
+        # 参加者一覧のページ送り（_idによるキーセットページネーション）用
+        IndexModel([('event_id', ASCENDING), ('_id', ASCENDING)], name='event_page'),
+    ],
+    'timers': [
+        # 期限が近いタイマーの読み込み用
+        IndexModel([('status', ASCENDING), ('due_at', ASCENDING)], name='status_due'),
+        # イベント削除時のタイマー取り消し用
+        IndexModel([('event_id', ASCENDING)], name='event'),
+    ],
+    'availability_profiles': [
+        # メンバーごとの毎週の参加可能時間
+        IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING)], name='guild_user_unique', unique=True),
+    ],
+    'availability_index': [
+        # (曜日と時刻) → ユーザーIDの一覧。イベント作成時の自動入力用
+        IndexModel([('guild_id', ASCENDING), ('slot', ASCENDING)], name='guild_slot_unique', unique=True),
+    ],
+    'events_archive': [
+        IndexModel(
+            [('archived_at', ASCENDING)], name='archived_ttl', expireAfterSeconds=ARCHIVE_TTL_DAYS * 24 * 60 * 60
+        ),
+    ],
+}
+
+
+def query_shapes():
+    """
+    Botが発行するクエリの一覧（explain診断用）
+    (説明, コレクション名, explainコマンド本体) のタプルを返す
+    """
+    event_id = ObjectId()
+    return [
+        ('events.find_one by _id', 'events', {'find': 'events', 'filter': {'_id': event_id}, 'limit': 1}),
+        ('events.find by guild_id', 'events', {
+            'find': 'events', 'filter': {'guild_id': 0}, 'sort': {'created_at': -1}, 'limit': 10,
+        }),
+        # 複数プロセスの同期（ポーリング時）で受付中のイベントの集計を比べる
+        ('events.find open by guild_id', 'events', {
+            'find': 'events', 'filter': {'guild_id': {'$in': [0, 1]}, 'closed': {'$ne': True}, 'message_id': {'$exists': True}},
+            'projection': {'guild_id': 1, 'channel_id': 1, 'message_id': 1, 'counts': 1},
+        }),
+        ('responses.update_one upsert', 'responses', {
+            'update': 'responses',
+            'updates': [{'q': {'event_id': event_id, 'user_id': 0}, 'u': {'$set': {'username': ''}}, 'upsert': True}],
+        }),
+        ('responses.find by event_id', 'responses', {'find': 'responses', 'filter': {'event_id': event_id}}),
+        ('responses.find page after _id', 'responses', {
+            'find': 'responses', 'filter': {'event_id': event_id, '_id': {'$gt': ObjectId()}},
+            'sort': {'_id': 1}, 'limit': 21,
+        }),
+        # リマインダーのメンション（event_idで絞り込んでからビットを調べる）
+        ('responses.find by selected_mask bit', 'responses', {
+            'find': 'responses', 'filter': {'event_id': event_id, 'selected_mask': {'$bitsAllSet': [0]}},
+            'projection': {'_id': 0, 'user_id': 1}, 'limit': 50,
+        }),
+        ('responses.delete_many by event_id', 'responses', {
+            'delete': 'responses',
+            'deletes': [{'q': {'event_id': event_id}, 'limit': 0}],
+        }),
+        ('availability_index.find by slots', 'availability_index', {
+            'find': 'availability_index', 'filter': {'guild_id': 0, 'slot': {'$in': ['2-21:00', '5-21:00']}},
+        }),
+        ('timers.find due', 'timers', {
+            'find': 'timers', 'filter': {'status': 'pending', 'due_at': {'$lt': datetime.now(timezone.utc)}},
+            'sort': {'due_at': 1},
+        }),
+        ('timers.delete_many by event_id', 'timers', {
+            'delete': 'timers',
+            'deletes': [{'q': {'event_id': event_id, 'status': 'pending'}, 'limit': 0}],
+        }),
+        ('events.delete_one by _id', 'events', {
+            'delete': 'events',
+            'deletes': [{'q': {'_id': event_id}, 'limit': 1}],
+        }),
+    ]
+
+
+async def _remove_duplicate_responses(collection):
+    """一意インデックス作成の妨げになる重複回答を、最新の1件だけ残して削除する"""
+    duplicates = await collection.aggregate([
+        {'$sort': {'updated_at': -1}},
+        {'$group': {
+            '_id': {'event_id': '$event_id', 'user_id': '$user_id'},
+            'ids': {'$push': '$_id'},
+            'count': {'$sum': 1}
+        }},
+        {'$match': {'count': {'$gt': 1}}},
+    ])
+    removed = 0
+    async for group in duplicates:
+        result = await collection.delete_many({'_id': {'$in': group['ids'][1:]}})
+        removed += result.deleted_count
+    return removed
+
+
+async def ensure_indexes(db):
+    """
+    必要なインデックスを作成し、作成済みであることを検証する
+    作成したインデックス名の一覧を返す
+    """
+    created = []
+    for collection_name, models in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        try:
+            created += await collection.create_indexes(models)
+        except OperationFailure as e:
+            if e.code == INDEX_OPTIONS_CONFLICT and collection_name == 'events_archive':
+                # 保持期間が変更された場合はTTLだけを更新する
+                await db.command({
+                    'collMod': collection_name,
+                    'index': {'name': 'archived_ttl', 'expireAfterSeconds': ARCHIVE_TTL_DAYS * 24 * 60 * 60},
+                })
+            elif e.code == DUPLICATE_KEY_ERROR and collection_name == 'responses':
+                removed = await _remove_duplicate_responses(collection)
+                logger.warning('Removed %d duplicate responses before creating unique index', removed)
+                created += await collection.create_indexes(models)
+            else:
+                raise
+
+        existing = await collection.index_information()
+        missing = [model.document['name'] for model in models if model.document['name'] not in existing]
+        if missing:
+            raise RuntimeError(f'Missing indexes on {collection_name}: {", ".join(missing)}')
+    return created
+
+
+def _find_stages(plan, stage_name):
+    """実行計画のツリーから指定したステージを探す"""
+    if isinstance(plan, dict):
+        if plan.get('stage') == stage_name:
+            yield plan
+        for value in plan.values():
+            yield from _find_stages(value, stage_name)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _find_stages(value, stage_name)
+
+
+async def explain_queries(db):
+    """
+    Botのクエリをexplainし、インデックスを使っていない（COLLSCAN）ものを返す
+    戻り値は (説明, 実行計画の要約) のリスト
+    """
+    problems = []
+    for description, collection_name, command in query_shapes():
+        result = await db.command({'explain': command, 'verbosity': 'queryPlanner'})
+        winning_plan = result.get('queryPlanner', {}).get('winningPlan', {})
+        if any(_find_stages(winning_plan, 'COLLSCAN')):
+            problems.append((description, f'COLLSCAN on {collection_name}'))
+    return problems
+
+
+def log_explain_report(problems):
+    if not problems:
+        logger.info('Explain: all queries use an index.')
+        return
+    for description, summary in problems:
+        logger.warning('Explain: %s -> %s', description, summary)
+
+
+if __name__ == '__main__':
+    import argparse
+    import asyncio
+    import os
+
+    from database import ScheduleRepository, client_options_from_env
+
+    parser = argparse.ArgumentParser(description='インデックスの作成とexplain診断を実行します')
+    parser.add_argument('--explain', action='store_true', help='インデックスを使っていないクエリを報告する')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    async def main():
+        repository = ScheduleRepository(os.environ['MONGODB_URI'], **client_options_from_env())
+        try:
+            logger.info('Indexes ensured: %s', await ensure_indexes(repository.db))
+            if args.explain:
+                log_explain_report(await explain_queries(repository.db))
+        finally:
+            await repository.close()
+
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+# 調整メッセージのライブ更新
+# ボタンで回答されるたびにメッセージを編集するとチャンネルごとのレート制限にすぐ達するため、
+# 更新が必要なイベントをチャンネルごとにまとめ、interval秒に1回だけ編集する
+
+import asyncio
+import contextvars
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LiveResultsUpdater:
+    """
+    イベントのメッセージ更新をチャンネル単位でデバウンスする
+    request()は更新が必要な印を付けるだけで、実際の編集はチャンネルごとのタスクがupdate(event_id)で行う
+    """
+
+    def __init__(self, update, interval=2.0):
+        self.update = update
+        self.interval = interval
+        self._dirty = {}
+        self._tasks = {}
+        self.requested = 0
+        self.edited = 0
+
+    def request(self, channel_id, event_id):
+        self.requested += 1
+        self._dirty.setdefault(channel_id, set()).add(event_id)
+        if channel_id not in self._tasks:
+            # 呼び出し元のコマンドのトレースを引き継がないよう、空のコンテキストで実行する
+            # （create_taskのcontext引数はPython 3.11以降のため、空のコンテキストの中でタスクを作る）
+            self._tasks[channel_id] = contextvars.Context().run(asyncio.create_task, self._run(channel_id))
+
+    async def close(self):
+        """待機中の更新を取り消す（メッセージは次の回答で更新される）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dirty.clear()
+
+    async def _run(self, channel_id):
+        # 最初の更新までも少し待ち、その間に届いた回答をまとめて反映する
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                event_ids = self._dirty.pop(channel_id, None)
+                if not event_ids:
+                    return
+                for event_id in event_ids:
+                    try:
+                        await self.update(event_id)
+                        self.edited += 1
+                    except Exception:
+                        logger.exception('Error updating live results for event %s', event_id)
+        finally:
+            # 終了と同時に外し、直後のrequest()が新しいタスクを作れるようにする
+            self._tasks.pop(channel_id, None)
@@ -0,0 +1,170 @@
+# メトリクスの集計とPrometheus形式での出力
+# 外部ライブラリを使わず、/metrics で必要なカウンター・ゲージ・ヒストグラムだけを実装する
+
+import bisect
+import math
+
+from pymongo import monitoring
+
+# 秒単位のヒストグラムの既定バケット
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines += self._render_samples()
+        return lines
+
+    def _render_samples(self):
+        return [
+            f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, *labels, value):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+        state['sum'] += value
+        state['count'] += 1
+
+    def _render_samples(self):
+        lines = []
+        for labels, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(state["sum"])}')
+            lines.append(f'{self.name}_count{label_text} {state["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    メトリクスの登録と出力
+    キャッシュのヒット率やゲートウェイのレイテンシなど、スクレイプ時に読む値はcollectorで更新する
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+COMMAND_LATENCY = REGISTRY.register(Histogram(
+    'schedule_command_duration_seconds', 'Time from command invocation to completion.', ['command', 'status']
+))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    'schedule_mongo_command_duration_seconds', 'MongoDB round-trip time per command.', ['command']
+))
+MONGO_FAILURES = REGISTRY.register(Counter(
+    'schedule_mongo_command_failures_total', 'Failed MongoDB commands.', ['command']
+))
+EVENT_CACHE = REGISTRY.register(Gauge(
+    'schedule_event_cache', 'Event cache statistics (size, hits, misses, evictions, expirations, hit_rate).', ['stat']
+))
+GATEWAY_LATENCY = REGISTRY.register(Gauge(
+    'schedule_gateway_latency_seconds', 'Discord gateway heartbeat latency per shard.', ['shard']
+))
+OUTBOUND_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'schedule_outbound_queue_depth', 'Messages waiting in the per-channel outbound queues.'
+))
+OUTBOUND_CHANNELS = REGISTRY.register(Gauge(
+    'schedule_outbound_channels', 'Channels with queued outbound messages.'
+))
+OUTBOUND_MESSAGES = REGISTRY.register(Counter(
+    'schedule_outbound_messages_total', 'Outbound messages sent, and acknowledgements merged into a queued message.', ['kind']
+))
+OUTBOUND_WAIT = REGISTRY.register(Histogram(
+    'schedule_outbound_wait_seconds', 'Time a message spent in the outbound queue before being sent.'
+))
+SYNC_CHANGES = REGISTRY.register(Counter(
+    'schedule_sync_changes_total',
+    'Changes from other instances applied to local caches and live results, by sync mode.', ['mode', 'kind']
+))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'schedule_startup_seconds',
+    'Seconds from process start to each startup milestone, or duration of background startup tasks.', ['phase']
+))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongoのコマンド監視イベントからMongoDBの往復時間を記録する"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.command_name, value=event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        MONGO_LATENCY.observe(event.command_name, value=event.duration_micros / 1_000_000)
+        MONGO_FAILURES.inc(event.command_name)
@@ -0,0 +1,130 @@
+# 時間オプションと回答の保存形式の移行（1回だけ実行する）
+# 単体実行: MONGODB_URI=... python src/migrate_timeslots.py [--dry-run]
+#
+# 旧形式のイベントに開始・終了日時（slots）を追加し、回答の選択時間の文字列のリスト（selected_times）を
+# ビットマスク（selected_mask）に置き換えて、集計カウンターを作り直す。
+# 移行済みのイベント・回答は対象にならないため、途中で止まっても再実行すれば続きから移行できる。
+#
+# タイマーのなかったバージョンで作成したイベントには、締切とアーカイブのタイマーを登録する。
+# 締切を過ぎたイベントはいまさら結果を投稿しないよう締め切らず、アーカイブの期限を過ぎたものはすぐにアーカイブする。
+
+import logging
+
+from pymongo import UpdateOne
+
+from service import event_timers
+from timeslots import MAX_TIME_OPTIONS, mask_from_times, parse_slot
+
+logger = logging.getLogger(__name__)
+
+
+async def migrate_event(repository, event, batch_size=500, dry_run=False):
+    """イベント1件を移行し、変換した回答の件数を返す"""
+    if 'slots' not in event:
+        slots = [parse_slot(option, event['date']) for option in event['time_options']]
+        if not dry_run:
+            await repository.events.update_one({'_id': event['_id']}, {'$set': {'slots': slots}})
+
+    cursor = repository.responses.find(
+        {'event_id': event['_id'], 'selected_mask': {'$exists': False}},
+        projection={'_id': 1, 'selected_times': 1}
+    )
+    converted = 0
+    updates = []
+    async for response in cursor:
+        mask = mask_from_times(event, response.get('selected_times') or [])
+        updates.append(UpdateOne(
+            {'_id': response['_id']},
+            {'$set': {'selected_mask': mask}, '$unset': {'selected_times': ''}}
+        ))
+        if len(updates) >= batch_size:
+            if not dry_run:
+                await repository.responses.bulk_write(updates, ordered=False)
+            converted += len(updates)
+            updates = []
+    if updates:
+        if not dry_run:
+            await repository.responses.bulk_write(updates, ordered=False)
+        converted += len(updates)
+
+    if converted and not dry_run:
+        await repository.rebuild_counts(event)
+    return converted
+
+
+async def migrate(repository, batch_size=500, dry_run=False):
+    """
+    すべてのイベントを移行する
+    時間オプションがMAX_TIME_OPTIONS個を超えるイベントはビットマスクにできないため、警告を出してスキップする
+    戻り値は (移行したイベント数, 変換した回答数, スキップしたイベント数)
+    """
+    events = responses = skipped = 0
+    async for event in repository.events.find({}):
+        if len(event['time_options']) > MAX_TIME_OPTIONS:
+            logger.warning(
+                'Skipping event %s: %d time options (max %d)',
+                event['_id'], len(event['time_options']), MAX_TIME_OPTIONS
+            )
+            skipped += 1
+            continue
+        converted = await migrate_event(repository, event, batch_size, dry_run)
+        if converted or 'slots' not in event:
+            events += 1
+        responses += converted
+    return events, responses, skipped
+
+
+async def backfill_timers(repository, guild_configs, scheduler, batch_size=500, dry_run=False):
+    """
+    タイマーが1件もないイベントに締切とアーカイブのタイマーを登録する
+    戻り値は (タイマーを登録したイベント数, 登録したタイマー数)
+    """
+    scheduled = set(await scheduler.collection.distinct('event_id'))
+    events = count = 0
+    timers = []
+    async for event in repository.events.find({}, projection={'counts': 0}):
+        if event['_id'] in scheduled:
+            continue
+        config = await guild_configs.get(event['guild_id'])
+        data = {'guild_id': event['guild_id'], 'channel_id': event['channel_id']}
+        due = event_timers(event, config, overdue_archive=True)
+        timers.extend((kind, event['_id'], due_at, data) for kind, due_at in due)
+        events += 1
+        count += len(due)
+        if len(timers) >= batch_size:
+            if not dry_run:
+                await scheduler.schedule_many(timers)
+            timers = []
+    if timers and not dry_run:
+        await scheduler.schedule_many(timers)
+    return events, count
+
+
+if __name__ == '__main__':
+    import argparse
+    import asyncio
+    import os
+
+    from database import ScheduleRepository, client_options_from_env
+    from guild_config import GuildConfigStore
+    from scheduler import TimerScheduler
+
+    parser = argparse.ArgumentParser(description='時間オプションと回答を新しい保存形式に移行し、既存のイベントにタイマーを登録します')
+    parser.add_argument('--batch-size', type=int, default=500, help='1回のbulk_writeで更新する回答数')
+    parser.add_argument('--dry-run', action='store_true', help='書き込まずに対象の件数だけを報告する')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    async def main():
+        repository = ScheduleRepository(os.environ['MONGODB_URI'], **client_options_from_env())
+        try:
+            events, responses, skipped = await migrate(repository, args.batch_size, args.dry_run)
+            logger.info('Migrated %d events, %d responses (skipped %d events)', events, responses, skipped)
+            guild_configs = GuildConfigStore(repository.db['guild_configs'])
+            scheduler = TimerScheduler(repository.db['timers'])
+            events, timers = await backfill_timers(repository, guild_configs, scheduler, args.batch_size, args.dry_run)
+            logger.info('Scheduled %d timers for %d events without timers', timers, events)
+        finally:
+            await repository.close()
+
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+# 送信メッセージのキュー
+# Discordはチャンネルごとに送信回数を制限しており（5回/5秒）、超えるとdiscord.pyはコマンドの
+# コルーチンの中で待機する。回答の受付メッセージはチャンネルごとのキューに積んで
+# トークンバケットで事前に間隔を空けて送り、近い時間に届いたものは1件のメッセージにまとめる。
+
+import asyncio
+import collections
+import contextvars
+import logging
+import time
+
+from metrics import OUTBOUND_CHANNELS, OUTBOUND_MESSAGES, OUTBOUND_QUEUE_DEPTH, OUTBOUND_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Discordのメッセージの上限文字数
+MESSAGE_LIMIT = 2000
+
+
+class TokenBucket:
+    """
+    per秒あたりrate回までの送信を許可するトークンバケット
+    reserve()はトークンを1つ予約し、送信してよくなるまでの秒数を返す
+    """
+
+    def __init__(self, rate, per, clock=time.monotonic):
+        self.rate = rate
+        self.per = per
+        self.clock = clock
+        self.tokens = float(rate)
+        self.updated = clock()
+
+    def reserve(self):
+        now = self.clock()
+        self.tokens = min(float(self.rate), self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens * self.per / self.rate
+
+    def is_full(self):
+        return self.tokens + (self.clock() - self.updated) * self.rate / self.per >= self.rate
+
+
+class OutgoingMessage:
+    def __init__(self, channel, kwargs=None, mentions=None):
+        self.channel = channel
+        self.kwargs = kwargs
+        # 受付メッセージの場合はまとめる対象のメンション
+        self.mentions = mentions
+        self.created = time.monotonic()
+        self.future = None if mentions is not None else asyncio.get_running_loop().create_future()
+
+    def render(self):
+        if self.mentions is not None:
+            return {'content': f"{' '.join(self.mentions)} さんの回答を登録しました。"}
+        return self.kwargs
+
+    def can_merge(self, mention):
+        return len(' '.join(self.mentions + [mention])) + 16 <= MESSAGE_LIMIT
+
+
+class OutboundDispatcher:
+    """
+    チャンネルごとの送信キュー
+    キューがあるチャンネルだけワーカーを動かし、空になったら終了する
+    """
+
+    def __init__(self, rate=5, per=5.0, global_rate=50, coalesce_window=0.5):
+        self.rate = rate
+        self.per = per
+        self.coalesce_window = coalesce_window
+        self._global_bucket = TokenBucket(global_rate, 1.0)
+        self._buckets = {}
+        self._queues = {}
+        self._tasks = {}
+
+    def acknowledge(self, channel, mention):
+        """
+        回答の受付メッセージを送る（すぐ戻る）
+        同じチャンネルでまだ送っていない受付メッセージがあれば、そこにメンションを追加する
+        """
+        queue = self._queues.get(channel.id)
+        if queue:
+            for message in queue:
+                if message.mentions is not None and message.can_merge(mention):
+                    if mention not in message.mentions:
+                        message.mentions.append(mention)
+                    OUTBOUND_MESSAGES.inc('coalesced')
+                    return
+        self._enqueue(OutgoingMessage(channel, mentions=[mention]))
+
+    async def send(self, channel, **kwargs):
+        """メッセージをキュー経由で送り、送信したメッセージを返す"""
+        message = OutgoingMessage(channel, kwargs)
+        self._enqueue(message)
+        return await message.future
+
+    def depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, message):
+        channel_id = message.channel.id
+        self._queues.setdefault(channel_id, collections.deque()).append(message)
+        if channel_id not in self._tasks:
+            # 呼び出し元のコマンドのトレースを引き継がないよう、空のコンテキストで実行する
+            # （create_taskのcontext引数はPython 3.11以降のため、空のコンテキストの中でタスクを作る）
+            self._tasks[channel_id] = contextvars.Context().run(asyncio.create_task, self._run(channel_id))
+        self._update_gauges()
+
+    def _update_gauges(self):
+        OUTBOUND_QUEUE_DEPTH.set(value=self.depth())
+        OUTBOUND_CHANNELS.set(value=len(self._queues))
+
+    async def close(self, timeout=5.0):
+        """キューに残っているメッセージをtimeout秒まで送り、残りは破棄する"""
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.warning('Dropped %d queued messages on shutdown', self.depth())
+        for queue in self._queues.values():
+            for message in queue:
+                if message.future is not None:
+                    message.future.cancel()
+        self._queues.clear()
+        self._update_gauges()
+
+    async def _run(self, channel_id):
+        queue = self._queues[channel_id]
+        bucket = self._buckets.setdefault(channel_id, TokenBucket(self.rate, self.per))
+        try:
+            while queue:
+                message = queue[0]
+                if message.mentions is not None:
+                    # 直後に届く受付メッセージもまとめられるよう、少しだけ待つ
+                    await asyncio.sleep(max(0.0, message.created + self.coalesce_window - time.monotonic()))
+                # 送信枠を予約し、制限に達する前に待つ（待っている間に届いた受付メッセージもまとめる）
+                await asyncio.sleep(max(bucket.reserve(), self._global_bucket.reserve()))
+                queue.popleft()
+                self._update_gauges()
+                OUTBOUND_WAIT.observe(value=time.monotonic() - message.created)
+                try:
+                    sent = await message.channel.send(**message.render())
+                except Exception as e:
+                    if message.future is None:
+                        logger.exception('Error sending acknowledgement to channel %s', channel_id)
+                    elif not message.future.done():
+                        message.future.set_exception(e)
+                    continue
+                OUTBOUND_MESSAGES.inc('sent')
+                if message.future is not None and not message.future.done():
+                    message.future.set_result(sent)
+        finally:
+            # 終了と同時に外し、直後の送信が新しいワーカーを作れるようにする
+            self._tasks.pop(channel_id, None)
+            if not queue:
+                self._queues.pop(channel_id, None)
+            # 満タンに戻ったバケットは新しく作るのと同じなので捨てる
+            for idle_id in [key for key, idle in self._buckets.items() if idle.is_full()]:
+                if idle_id not in self._tasks:
+                    del self._buckets[idle_id]
+            self._update_gauges()
@@ -0,0 +1,89 @@
+# おすすめ時間の算出
+# 回答をユーザーごとのビット位置に割り当て、時間オプションごとの参加可能者をビットセット（int）で持つ。
+# 参加者数はビット数、複数イベントで全員そろう人数はビットセットのANDで求められるため、
+# メンバー数千人・候補数百件でも集合演算だけでランキングできる。
+
+
+class UserIndex:
+    """ユーザーIDとビット位置の対応（複数イベントで共有する）"""
+
+    def __init__(self):
+        self.positions = {}
+
+    def position(self, user_id):
+        return self.positions.setdefault(user_id, len(self.positions))
+
+    def mask(self, user_ids):
+        """ユーザーIDの集合をビットセットにする（未回答のユーザーはNoneを返す）"""
+        mask = 0
+        for user_id in user_ids:
+            if user_id not in self.positions:
+                return None
+            mask |= 1 << self.positions[user_id]
+        return mask
+
+
+class AvailabilityMatrix:
+    """イベント1件分の参加可否（時間オプション × ユーザー）"""
+
+    def __init__(self, event, bits):
+        self.event = event
+        self.bits = bits
+
+    @classmethod
+    async def load(cls, repository, event, user_index):
+        """回答コレクションからビットセットを作る（回答はカーソルで1件ずつ読む）"""
+        bits = [0] * len(event['time_options'])
+        async for response in repository.iter_availability(event['_id']):
+            user_bit = 1 << user_index.position(response['user_id'])
+            mask = response.get('selected_mask', 0)
+            i = 0
+            while mask and i < len(bits):
+                if mask & 1:
+                    bits[i] |= user_bit
+                mask >>= 1
+                i += 1
+        return cls(event, bits)
+
+
+def rank_options(matrix, required_mask=0, quorum=0, limit=5):
+    """
+    時間オプションを参加可能者数の多い順に並べる
+    required_maskの全員が参加でき、quorum人以上集まるオプションだけを返す
+    戻り値は (オプション番号, 人数) のリスト
+    """
+    ranked = []
+    for i, bits in enumerate(matrix.bits):
+        if bits & required_mask != required_mask:
+            continue
+        count = bits.bit_count()
+        if count >= quorum:
+            ranked.append((i, count))
+    ranked.sort(key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+
+def rank_combinations(matrices, required_mask=0, quorum=0, limit=5, beam_width=256):
+    """
+    イベントごとに1つずつオプションを選ぶ組み合わせを、全イベントに参加できる人数の多い順に並べる
+    組み合わせ数はイベント数に対して指数的に増えるため、人数の多い上位beam_width件だけを残して探索する
+    （参加可能者はANDを取るたびに減るだけなので、必須参加者・最低人数を満たさない候補はその場で捨てられる）
+    戻り値は (各イベントのオプション番号のタプル, 人数) のリスト
+    """
+    beam = [((), -1, 0)]  # -1 は全ビットが立ったビットセット
+    for matrix in matrices:
+        candidates = []
+        for choice, mask, _ in beam:
+            for i, bits in enumerate(matrix.bits):
+                combined = mask & bits
+                if combined & required_mask != required_mask:
+                    continue
+                count = combined.bit_count()
+                if count < quorum:
+                    continue
+                candidates.append((choice + (i,), combined, count))
+        candidates.sort(key=lambda item: -item[2])
+        beam = candidates[:beam_width]
+        if not beam:
+            return []
+    return [(choice, count) for choice, _, count in beam[:limit]]
@@ -0,0 +1,177 @@
+# 永続タイマーのスケジューラー
+# タイマーはMongoDBのtimersコレクションに保存し、近いうちに期限が来るもの（horizon以内）だけを
+# メモリ上のヒープに読み込む。コレクション全体を定期的に走査することはない。
+# 再起動時は期限切れのものも含めて (status, due_at) インデックスで1回読み込むだけで復旧する。
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# 失敗したタイマーを再実行するまでの時間と最大試行回数
+RETRY_DELAY = timedelta(minutes=1)
+MAX_ATTEMPTS = 5
+
+
+class TimerScheduler:
+    """
+    期限が来たタイマーの種類（kind）に対応するハンドラーを実行する
+    複数のプロセスで動かしても、実行前にタイマーを取得（claim）するため二重に実行されない
+    """
+
+    def __init__(self, collection, handlers=None, horizon=timedelta(hours=1), owns=None, stale_after=timedelta(minutes=10)):
+        self.collection = collection
+        self.handlers = dict(handlers or {})
+        self.horizon = horizon
+        self.owns = owns or (lambda timer: True)
+        self.stale_after = stale_after
+        self._heap = []
+        self._loaded = set()
+        self._loaded_until = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
+
+    def handler(self, kind):
+        """タイマーの種類に対応するハンドラーを登録するデコレーター"""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 実行中のハンドラーは完了を待つ
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def schedule(self, kind, event_id, due_at, **data):
+        """タイマーを登録する（読み込み済みの範囲内ならすぐヒープにも入れる）"""
+        result = await self.collection.insert_one({
+            'kind': kind,
+            'event_id': event_id,
+            'due_at': due_at,
+            'status': 'pending',
+            'attempts': 0,
+            **data
+        })
+        if self._loaded_until is not None and due_at < self._loaded_until:
+            self._push(due_at, result.inserted_id)
+            self._wakeup.set()
+        return result.inserted_id
+
+    async def schedule_many(self, timers):
+        """(kind, event_id, due_at, data) のタイマーをinsert_manyでまとめて登録する"""
+        documents = [
+            {'kind': kind, 'event_id': event_id, 'due_at': due_at, 'status': 'pending', 'attempts': 0, **data}
+            for kind, event_id, due_at, data in timers
+        ]
+        if not documents:
+            return []
+        result = await self.collection.insert_many(documents)
+        for document, timer_id in zip(documents, result.inserted_ids):
+            if self._loaded_until is not None and document['due_at'] < self._loaded_until:
+                self._push(document['due_at'], timer_id)
+                self._wakeup.set()
+        return result.inserted_ids
+
+    async def cancel_event(self, event_id):
+        """イベントの未実行のタイマーを取り消す（ヒープに残ったものは実行時のclaimで無視される）"""
+        await self.collection.delete_many({'event_id': event_id, 'status': 'pending'})
+
+    def _push(self, due_at, timer_id):
+        if timer_id not in self._loaded:
+            self._loaded.add(timer_id)
+            heapq.heappush(self._heap, (due_at, timer_id))
+
+    async def _refill(self):
+        """horizon以内に期限が来るタイマーを読み込む"""
+        now = self._now()
+        # 実行中のまま止まったタイマー（プロセスの異常終了など）を戻す
+        await self.collection.update_many(
+            {'status': 'running', 'claimed_at': {'$lt': now - self.stale_after}},
+            {'$set': {'status': 'pending'}}
+        )
+        until = now + self.horizon
+        cursor = self.collection.find(
+            {'status': 'pending', 'due_at': {'$lt': until}},
+            projection={'due_at': 1}
+        ).sort('due_at', 1)
+        async for timer in cursor:
+            self._push(timer['due_at'], timer['_id'])
+        self._loaded_until = until
+
+    async def _run(self):
+        while True:
+            try:
+                now = self._now()
+                if self._loaded_until is None or now >= self._loaded_until - self.horizon / 2:
+                    await self._refill()
+
+                while self._heap and self._heap[0][0] <= now:
+                    _, timer_id = heapq.heappop(self._heap)
+                    self._loaded.discard(timer_id)
+                    task = asyncio.create_task(self._fire(timer_id))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+
+                next_refill = self._loaded_until - self.horizon / 2
+                next_due = self._heap[0][0] if self._heap else next_refill
+                timeout = max(0.0, (min(next_due, next_refill) - self._now()).total_seconds())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Timer scheduler loop failed; retrying')
+                await asyncio.sleep(RETRY_DELAY.total_seconds())
+
+    async def _fire(self, timer_id):
+        timer = await self.collection.find_one({'_id': timer_id, 'status': 'pending'})
+        if timer is None or not self.owns(timer):
+            return
+        # ほかのプロセスと競合しないようにタイマーを取得する
+        timer = await self.collection.find_one_and_update(
+            {'_id': timer_id, 'status': 'pending'},
+            {'$set': {'status': 'running', 'claimed_at': self._now()}, '$inc': {'attempts': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if timer is None:
+            return
+
+        try:
+            await self.handlers[timer['kind']](timer)
+        except Exception:
+            logger.exception('Timer %s (%s) failed', timer_id, timer['kind'])
+            if timer['attempts'] >= MAX_ATTEMPTS:
+                await self.collection.update_one({'_id': timer_id}, {'$set': {'status': 'failed'}})
+                return
+            due_at = self._now() + RETRY_DELAY
+            await self.collection.update_one({'_id': timer_id}, {'$set': {'status': 'pending', 'due_at': due_at}})
+            if due_at < self._loaded_until:
+                self._push(due_at, timer_id)
+                self._wakeup.set()
+            return
+
+        await self.collection.delete_one({'_id': timer_id})
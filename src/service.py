@@ -0,0 +1,414 @@
+# スケジュール調整の操作（サービス層）
+# 従来のコマンドとスラッシュコマンドの両方から呼ばれる。引数の検証・DBアクセス・タイマー登録を行い、
+# Discordには依存しない（メッセージの組み立てと送信は呼び出し側で行う）。
+# 利用者の入力の誤りは ServiceError として送出し、そのメッセージをそのまま返信に使う。
+
+import io
+from datetime import datetime, timedelta
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from availability import format_profile, option_slot_key, parse_profile
+from database import JST, add_mask_counts
+from timeslots import MAX_TIME_OPTIONS, WEEKDAYS, option_end, option_start, parse_time_options
+
+# 結果表示の参加者一覧の1ページあたりの人数
+PAGE_SIZE = 15
+# 一括作成で1回に作れるイベント数
+MAX_BULK_EVENTS = 60
+# インポートするCSVの最大サイズ（バイト）
+MAX_IMPORT_BYTES = 1024 * 1024
+
+
+class ServiceError(Exception):
+    """利用者にそのまま表示できるエラー"""
+
+
+class InvalidDateError(ServiceError):
+    """日付の形式が正しくない（呼び出し側でコマンドごとの使用例を添える）"""
+
+
+def parse_event_id(event_id):
+    if isinstance(event_id, ObjectId):
+        return event_id
+    try:
+        return ObjectId(event_id)
+    except (InvalidId, TypeError):
+        raise ServiceError("イベントIDの形式が正しくありません。") from None
+
+
+def parse_event_date(date):
+    """'YYYY-MM-DD' 形式の日付を日本時間の0時として返す"""
+    try:
+        return JST.localize(datetime.strptime(date, '%Y-%m-%d'))
+    except ValueError:
+        raise InvalidDateError("形式エラー: 日付は'YYYY-MM-DD'形式で入力してください。") from None
+
+
+def event_timers(event, config, now=None, overdue_archive=False):
+    """
+    イベントの締切とアーカイブのタイマーを (種類, 期限) のリストで返す
+    締切は最初の時間オプションの開始（日時を持たない場合はイベント日の0時）の close_hours_before 時間前。
+    作成時点で締切を過ぎていれば最初の時間オプションの開始に締め切り、それも過ぎていれば締切は登録しない
+    （当日や過去の日付のイベントが作成直後に締め切られたり削除されたりしないようにする）
+    アーカイブは最後の時間オプションの終了（なければイベント日）の archive_days_after 日後。
+    過ぎていれば登録しないが、overdue_archive なら今すぐ実行するよう登録する（既存のイベントの補完用）
+    """
+    now = now or datetime.now(JST)
+    options = range(len(event['time_options']))
+    starts = [start for start in (option_start(event, i) for i in options) if start is not None]
+    ends = [end for end in (option_end(event, i) for i in options) if end is not None]
+    first_start = min(starts, default=event['date'])
+    timers = []
+    if not event.get('closed'):
+        for close_at in (first_start - timedelta(hours=config['close_hours_before']), first_start):
+            if close_at > now:
+                timers.append(('close', close_at))
+                break
+    archive_at = max([event['date'], *ends]) + timedelta(days=config['archive_days_after'])
+    if archive_at > now:
+        timers.append(('archive', archive_at))
+    elif overdue_archive:
+        timers.append(('archive', now))
+    return timers
+
+
+def parse_weekdays(weekdays):
+    """'月水金' のような曜日の指定を曜日番号の集合に変換する（省略時は毎日）"""
+    if not weekdays:
+        return set(range(7))
+    days = set()
+    for char in weekdays:
+        if char not in WEEKDAYS:
+            raise ServiceError(f"曜日は {WEEKDAYS} の文字で指定してください: {weekdays}")
+        days.add(WEEKDAYS.index(char))
+    return days
+
+
+def parse_time_indices(event, time_indices):
+    """時間番号（1始まりの文字列）のリストを選択のビットマスクに変換する"""
+    selected_mask = 0
+    for idx in time_indices:
+        try:
+            index = int(idx) - 1
+        except ValueError:
+            raise ServiceError(f"無効な入力です: {idx}。数字を入力してください。") from None
+        if not 0 <= index < len(event['time_options']):
+            raise ServiceError(f"無効な時間オプション番号です: {idx}")
+        selected_mask |= 1 << index
+    return selected_mask
+
+
+class ResultsPage:
+    """参加者一覧の1ページ（前後のページがあるかと、1始まりのページ番号を持つ）"""
+
+    def __init__(self, responses, has_prev, has_next, number):
+        self.responses = responses
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.number = number
+
+
+class ScheduleService:
+    """
+    イベントの作成・回答・結果表示・削除などの操作
+    on_changeはイベントの集計が変わったときに呼ばれる（調整メッセージのライブ更新用）
+    availabilityを渡すと、作成したイベントに毎週の参加可能時間から回答を自動入力する
+    """
+
+    def __init__(self, repository, guild_configs, scheduler=None, write_buffer=None, on_change=None, availability=None):
+        self.repository = repository
+        self.guild_configs = guild_configs
+        self.scheduler = scheduler
+        self.write_buffer = write_buffer
+        self.availability = availability
+        self.on_change = on_change or (lambda event: None)
+
+    async def flush(self):
+        """未書き込みの回答を先に書き込む（結果表示・削除の前に呼ぶ）"""
+        if self.write_buffer:
+            # 書き込み中のバッチがあればその完了も待つ
+            await self.write_buffer.flush()
+
+    async def find_event(self, guild_id, event_id):
+        """サーバーのイベントを取得する（見つからなければServiceError）"""
+        event = await self.repository.get_event(parse_event_id(event_id), guild_id)
+        if not event:
+            raise ServiceError("指定されたイベントが見つかりません。")
+        return event
+
+    async def create_event(self, guild_id, channel_id, creator_id, title, date, time_options):
+        """イベントを作成し、締切とアーカイブのタイマーを登録して、集計カウンター付きのイベントを返す"""
+        event_date = parse_event_date(date)
+        time_options, slots = parse_time_options(time_options, event_date)
+        if len(time_options) > MAX_TIME_OPTIONS:
+            raise ServiceError(f"時間オプションは{MAX_TIME_OPTIONS}個までです。")
+        event_id = await self.repository.create_event(
+            guild_id, channel_id, creator_id, title, event_date, time_options, slots
+        )
+        event = await self.repository.get_event_with_counts(event_id)
+        if self.scheduler:
+            config = await self.guild_configs.get(guild_id)
+            for kind, due_at in event_timers(event, config):
+                await self.scheduler.schedule(kind, event_id, due_at, guild_id=guild_id, channel_id=channel_id)
+        await self._prefill([event])
+        return event
+
+    async def create_events(self, guild_id, channel_id, creator_id, title, start_date, end_date, time_options, weekdays=None):
+        """
+        開始日から終了日までの指定した曜日ごとに、同じ時間オプションのイベントをまとめて作成する
+        イベントとタイマーはそれぞれinsert_manyで1回ずつ書き込み、集計カウンター付きのイベントのリストを返す
+        """
+        first = parse_event_date(start_date)
+        last = parse_event_date(end_date)
+        days = parse_weekdays(weekdays)
+        dates = []
+        day = first
+        while day <= last:
+            if day.weekday() in days:
+                dates.append(day)
+            # 夏時間のないJSTなので、日付の加算後にlocalizeし直す必要はない
+            day += timedelta(days=1)
+        if not dates:
+            raise ServiceError("指定した期間に作成する日付がありません。")
+        if len(dates) > MAX_BULK_EVENTS:
+            raise ServiceError(f"一度に作成できるイベントは{MAX_BULK_EVENTS}件までです（{len(dates)}件）。")
+
+        documents = []
+        for event_date in dates:
+            options, slots = parse_time_options(time_options, event_date)
+            if len(options) > MAX_TIME_OPTIONS:
+                raise ServiceError(f"時間オプションは{MAX_TIME_OPTIONS}個までです。")
+            documents.append(self.repository.event_document(
+                guild_id, channel_id, creator_id, title, event_date, options, slots
+            ))
+        events = await self.repository.create_events(documents)
+
+        if self.scheduler:
+            config = await self.guild_configs.get(guild_id)
+            timers = []
+            data = {'guild_id': guild_id, 'channel_id': channel_id}
+            for event in events:
+                for kind, due_at in event_timers(event, config):
+                    timers.append((kind, event['_id'], due_at, data))
+            await self.scheduler.schedule_many(timers)
+        await self._prefill(events)
+        return events
+
+    async def _prefill(self, events):
+        """
+        毎週の参加可能時間のインデックスから、作成したイベントに回答を自動入力し、集計（予測）を反映する
+        インデックスは全イベント分を1回で読む。eventsのcountsとprefilledも更新する
+        """
+        if not self.availability or not events:
+            return
+        event_keys = [
+            [option_slot_key(event, i) for i in range(len(event['time_options']))] for event in events
+        ]
+        keys = {key for option_keys in event_keys for key in option_keys if key}
+        if not keys:
+            return
+        guild_id = events[0]['guild_id']
+        users = await self.availability.users_for_slots(guild_id, keys)
+        if not users:
+            return
+        usernames = await self.availability.usernames(
+            guild_id, {user_id for user_ids in users.values() for user_id in user_ids}
+        )
+
+        for event, option_keys in zip(events, event_keys):
+            masks = {}
+            for i, key in enumerate(option_keys):
+                for user_id in users.get(key, ()):
+                    masks[user_id] = masks.get(user_id, 0) | 1 << i
+            if not masks:
+                continue
+            await self.repository.import_responses(
+                event['_id'], ((user_id, usernames.get(user_id, str(user_id)), mask) for user_id, mask in masks.items())
+            )
+            counts = [0] * len(event['time_options'])
+            for mask in masks.values():
+                add_mask_counts(counts, mask)
+            await self.repository.add_prefilled_counts(event['_id'], counts, len(masks))
+            event['counts'] = [a + b for a, b in zip(event.get('counts') or [0] * len(counts), counts)]
+            event['prefilled'] = len(masks)
+
+    async def get_availability(self, guild_id, user_id):
+        """毎週の参加可能時間を表示用の文字列で返す（未登録なら空文字列）"""
+        self._require_availability()
+        return format_profile(await self.availability.get(guild_id, user_id))
+
+    async def set_availability(self, guild_id, user_id, username, tokens):
+        """毎週の参加可能時間を登録し、表示用の文字列を返す"""
+        self._require_availability()
+        try:
+            slots = parse_profile(tokens)
+        except ValueError as e:
+            raise ServiceError(str(e)) from None
+        if not slots:
+            raise ServiceError("曜日と時刻を指定してください。例: 水土 21:00 日 13:00")
+        await self.availability.set(guild_id, user_id, username, slots)
+        return format_profile(slots)
+
+    async def clear_availability(self, guild_id, user_id):
+        self._require_availability()
+        return await self.availability.clear(guild_id, user_id)
+
+    def _require_availability(self):
+        if not self.availability:
+            raise ServiceError("毎週の参加可能時間は利用できません。")
+
+    async def attach_message(self, event_id, message_id):
+        """イベントの調整メッセージのIDを保存する"""
+        await self.repository.set_event_message(event_id, message_id)
+
+    async def _save_response(self, event, user_id, username, selected_mask):
+        # write-behindモードではバッファに積むだけですぐ戻る
+        if self.write_buffer:
+            self.write_buffer.add(event, user_id, username, selected_mask)
+        else:
+            await self.repository.save_response(event, user_id, username, selected_mask)
+        self.on_change(event)
+
+    async def _open_event(self, guild_id, event_id):
+        event = await self.find_event(guild_id, event_id)
+        if event.get('closed'):
+            raise ServiceError("このイベントの投票は締め切られています。")
+        return event
+
+    async def respond(self, guild_id, event_id, user_id, username, time_indices):
+        """時間番号で回答し、(イベント, 選択のビットマスク) を返す"""
+        event = await self._open_event(guild_id, event_id)
+        selected_mask = parse_time_indices(event, time_indices)
+        # 既存の応答を更新または新規作成
+        await self._save_response(event, user_id, username, selected_mask)
+        return event, selected_mask
+
+    async def toggle(self, guild_id, event_id, user_id, username, index):
+        """時間オプション（0始まり）を選択済みなら取り消し、未選択なら追加して、(イベント, 選択のビットマスク) を返す"""
+        event = await self._open_event(guild_id, event_id)
+        if not 0 <= index < len(event['time_options']):
+            raise ServiceError(f"無効な時間オプション番号です: {index + 1}")
+
+        if self.write_buffer:
+            # 未書き込みの回答がなければDBの選択を読む。読み込み中に同じユーザーのクリックが積まれていれば、
+            # 読んだ値ではなくその回答を反転する
+            current = None
+            if self.write_buffer.pending_selection(event['_id'], user_id) is None:
+                current = await self.repository.get_selected_mask(event['_id'], user_id)
+            selected_mask = self.write_buffer.toggle(event, user_id, username, 1 << index, current)
+        else:
+            selected_mask = await self.repository.toggle_response(event, user_id, username, index)
+        self.on_change(event)
+        return event, selected_mask
+
+    async def results(self, guild_id, event_id):
+        """集計カウンターを含む最新のイベントを返す"""
+        event_id = parse_event_id(event_id)
+        await self.flush()
+        event = await self.repository.get_event_with_counts(event_id, guild_id)
+        if not event:
+            raise ServiceError("指定されたイベントが見つかりません。")
+        return event
+
+    async def participant_page(self, event, direction=None, anchor=None, number=1):
+        """
+        参加者一覧の1ページを読む
+        directionが'next'ならanchorの回答より後、'prev'なら前のページ（なければ最初のページ）を返す
+        """
+        if direction == 'next':
+            responses, has_next = await self.repository.participants_page(event['_id'], after=anchor, limit=PAGE_SIZE)
+            if responses:
+                return ResultsPage(responses, True, has_next, number)
+        elif direction == 'prev':
+            responses, has_prev = await self.repository.participants_page(event['_id'], before=anchor, limit=PAGE_SIZE)
+            if responses:
+                return ResultsPage(responses, has_prev, True, number)
+        # 回答が削除されるなどしてページが空になった場合も最初のページに戻る
+        responses, has_next = await self.repository.participants_page(event['_id'], limit=PAGE_SIZE)
+        return ResultsPage(responses, False, has_next, 1)
+
+    async def results_page(self, guild_id, event_id, direction=None, anchor=None, number=1):
+        """集計カウンターを含む最新のイベントと、参加者一覧の1ページを返す"""
+        event = await self.results(guild_id, event_id)
+        return event, await self.participant_page(event, direction, anchor, number)
+
+    async def export_event(self, guild_id, event_id, fmt, fp):
+        """
+        イベントの回答をfmt（'csv' か 'ics'）の形式でバイナリファイルfpに書き出し、イベントを返す
+        回答はカーソルから読みながら書き出すため、回答数が多くてもメモリに載せない
+        """
+        from export import iter_csv_lines, iter_ics_lines, write_lines
+
+        if fmt not in ('csv', 'ics'):
+            raise ServiceError("形式は csv か ics を指定してください。")
+        event = await self.results(guild_id, event_id)
+        if fmt == 'csv':
+            await write_lines(iter_csv_lines(event, self.repository.iter_responses(event['_id'])), fp)
+        else:
+            await write_lines(iter_ics_lines(event, self.repository), fp)
+        return event
+
+    async def import_responses(self, guild_id, event_id, user_id, data):
+        """
+        CSVの回答をbulk_writeで取り込み、集計カウンターを作り直して、(イベント, 件数) を返す（作成者のみ）
+        同じユーザーの回答は上書きする
+        """
+        from export import CsvImportError, iter_import_rows
+
+        event = await self.find_event(guild_id, event_id)
+        if event['creator_id'] != user_id:
+            raise ServiceError("回答のインポートはイベントの作成者のみが実行できます。")
+        if len(data) > MAX_IMPORT_BYTES:
+            raise ServiceError(f"CSVは{MAX_IMPORT_BYTES // 1024}KBまでです。")
+        # バッファの回答があとから取り込んだ回答を上書きしないよう先に書き込む
+        await self.flush()
+        lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+        try:
+            imported = await self.repository.import_responses(event['_id'], iter_import_rows(event, lines))
+        except (CsvImportError, UnicodeDecodeError) as e:
+            raise ServiceError(f"CSVを読み込めませんでした: {e}") from None
+        finally:
+            # 途中で失敗しても、書き込めた分は集計に反映する
+            await self.repository.rebuild_counts(event)
+            self.on_change(event)
+        return event, imported
+
+    async def recommend_events(self, guild_id, event_ids, limit):
+        """おすすめを算出するイベントを取得する"""
+        event_ids = [parse_event_id(event_id) for event_id in event_ids]
+        if not event_ids or len(event_ids) > limit:
+            raise ServiceError(f"イベントIDを1〜{limit}件指定してください。")
+        await self.flush()
+        events = []
+        for event_id in event_ids:
+            event = await self.repository.get_event(event_id, guild_id)
+            if not event:
+                raise ServiceError(f"指定されたイベントが見つかりません: {event_id}")
+            events.append(event)
+        return events
+
+    async def list_events(self, guild_id):
+        return await self.repository.list_events(guild_id)
+
+    async def delete_event(self, guild_id, event_id, user_id):
+        """イベントと回答・タイマーを削除する（作成者のみ）"""
+        event = await self.find_event(guild_id, event_id)
+        # 作成者の確認
+        if event['creator_id'] != user_id:
+            raise ServiceError("イベントの削除は作成者のみが実行できます。")
+        # イベントと関連する応答の削除
+        await self.flush()
+        await self.repository.delete_event(event['_id'])
+        if self.scheduler:
+            await self.scheduler.cancel_event(event['_id'])
+        return event
+
+    async def rebuild_tally(self, guild_id, event_id):
+        """回答コレクションから集計し直す"""
+        event = await self.find_event(guild_id, event_id)
+        await self.flush()
+        await self.repository.rebuild_counts(event)
+        self.on_change(event)
+        return event
@@ -0,0 +1,79 @@
+# 起動時間の計測とアプリケーションコマンドの同期
+# 起動の各段階（import・ログイン・ゲートウェイ接続・最初のコマンド処理）までの時間と、
+# 裏で行う準備（MongoDBの接続・インデックス作成・コマンド同期）の所要時間を記録して、ログと /metrics に出力する。
+# コマンドの同期は、コマンド定義のハッシュをMongoDBの bot_meta コレクションに保存し、変わったときだけ行う。
+
+import hashlib
+import json
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    プロセス開始からの経過時間を段階ごとに記録する
+    mark()は開始からの経過時間、measure()は処理そのものの所要時間を記録する
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def mark(self, name):
+        """初回だけ記録し、記録したらTrueを返す（再接続などで何度呼ばれてもよい）"""
+        if name in self.phases:
+            return False
+        self._record(name, self.elapsed())
+        return True
+
+    @contextmanager
+    def measure(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - begin)
+
+    def _record(self, name, seconds):
+        self.phases[name] = seconds
+        STARTUP_SECONDS.set(name, value=seconds)
+
+    def report(self):
+        return ' '.join(f'{name}={seconds:.2f}s' for name, seconds in self.phases.items())
+
+
+def command_tree_hash(tree, guild=None):
+    """Discordに登録するコマンド定義（名前・説明・引数など）のハッシュを返す"""
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command.get('type', 1), command['name'])
+    )
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+async def sync_command_tree(tree, meta, guild=None, force=False):
+    """
+    コマンド定義が前回の同期から変わっていればDiscordに同期し、同期したかを返す
+    ハッシュはアプリケーションと同期先（グローバルかサーバー）ごとにmetaコレクションへ保存する
+    """
+    key = f"command_tree:{tree.client.application_id}:{guild.id if guild else 'global'}"
+    digest = command_tree_hash(tree, guild)
+    if not force:
+        saved = await meta.find_one({'_id': key})
+        if saved and saved.get('hash') == digest:
+            return False
+    await tree.sync(guild=guild)
+    await meta.update_one(
+        {'_id': key}, {'$set': {'hash': digest, 'synced_at': datetime.now(timezone.utc)}}, upsert=True
+    )
+    return True
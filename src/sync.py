@@ -0,0 +1,203 @@
+# 複数プロセス間のキャッシュと調整メッセージの同期
+# Botを複数プロセスで動かすと、ほかのプロセスが書き込んだ回答・削除したイベント・変更したサーバー設定が
+# このプロセスのイベントキャッシュ・サーバー設定のキャッシュ・調整メッセージの集計に反映されない。
+# MongoDBのchange streamで events と guild_configs の変更を受け取り、キャッシュを破棄して集計の更新を依頼する。
+# 回答の書き込みは必ずイベントの集計カウンター（counts）も更新するため、responses は監視しなくてよい。
+# 再開トークンは bot_meta コレクションに保存し、再起動後は続きから受け取る。
+# change streamを使えないスタンドアロンのmongodでは、定期的にDBと比べるポーリングに切り替える。
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from metrics import SYNC_CHANGES
+
+logger = logging.getLogger(__name__)
+
+# スタンドアロンのmongodでchange streamを開こうとしたときのエラー
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+# 保存した再開トークンの位置がoplogから消えている（CappedPositionLost, ChangeStreamHistoryLost）
+RESUME_TOKEN_EXPIRED = (136, 286)
+# 接続エラーなどでchange streamが閉じたときに開き直すまでの秒数
+RETRY_DELAY = 5.0
+
+PIPELINE = [
+    {'$match': {
+        'ns.coll': {'$in': ['events', 'guild_configs']},
+        'operationType': {'$in': ['insert', 'update', 'replace', 'delete']},
+    }},
+]
+
+
+def _changed_fields(change):
+    """更新されたトップレベルのフィールド名（'counts.2' なら 'counts'）"""
+    description = change.get('updateDescription') or {}
+    fields = list(description.get('updatedFields') or {}) + list(description.get('removedFields') or [])
+    return {field.split('.', 1)[0] for field in fields}
+
+
+class ChangeSync:
+    """
+    ほかのプロセスの書き込みをこのプロセスのキャッシュと調整メッセージに反映する
+    on_counts(event) は集計カウンターが変わったイベント（_id, guild_id, channel_id, message_id を含む）ごとに呼ばれる
+    guild_ids() はポーリングで集計を比べるサーバー（このプロセスが担当するもの）を返す
+    """
+
+    def __init__(self, db, meta, event_cache, guild_configs, on_counts, guild_ids, instance_id,
+                 poll_interval=10.0, checkpoint_interval=5.0):
+        self.db = db
+        self.meta = meta
+        self.event_cache = event_cache
+        self.guild_configs = guild_configs
+        self.on_counts = on_counts
+        self.guild_ids = guild_ids
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+        # 再開トークンはプロセス（INSTANCE_ID）ごとに保存する
+        self.key = f'change_stream:{instance_id}'
+        self.mode = None
+        self._token = None
+        self._saved_token = None
+        self._saved_at = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 受け取った位置まで保存して、次の起動時はその続きから受け取る
+        try:
+            await self._checkpoint(force=True)
+        except PyMongoError:
+            logger.exception('Error saving change stream resume token')
+
+    async def _run(self):
+        saved = await self.meta.find_one({'_id': self.key})
+        self._token = self._saved_token = saved and saved.get('token')
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    logger.info('Change streams are not supported (standalone mongod); polling every %.0fs',
+                                self.poll_interval)
+                    await self._poll()
+                    return
+                if e.code in RESUME_TOKEN_EXPIRED and self._token is not None:
+                    # 受け取れなかった変更があるため、キャッシュをすべて捨てて最新から受け取る
+                    logger.warning('Change stream resume token expired; clearing caches')
+                    self._token = None
+                    self.event_cache.clear()
+                    self.guild_configs.clear()
+                    continue
+                logger.exception('Change stream failed; reopening')
+                await asyncio.sleep(RETRY_DELAY)
+            except PyMongoError:
+                logger.exception('Change stream failed; reopening')
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _watch(self):
+        async with await self.db.watch(
+            PIPELINE, full_document='updateLookup', resume_after=self._token, max_await_time_ms=1000
+        ) as stream:
+            if self.mode != 'change_stream':
+                self.mode = 'change_stream'
+                logger.info('Watching changes from other instances (resumed: %s)', self._token is not None)
+            while stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    self._apply(change)
+                # 変更がなくても再開トークンは進む
+                self._token = stream.resume_token
+                await self._checkpoint()
+
+    async def _checkpoint(self, force=False):
+        """再開トークンを checkpoint_interval 秒に1回まで保存する"""
+        if self._token is None or self._token == self._saved_token:
+            return
+        if not force and time.monotonic() - self._saved_at < self.checkpoint_interval:
+            return
+        token = self._token
+        await self.meta.update_one(
+            {'_id': self.key}, {'$set': {'token': token, 'saved_at': datetime.now(timezone.utc)}}, upsert=True
+        )
+        self._saved_token = token
+        self._saved_at = time.monotonic()
+
+    def _apply(self, change):
+        collection = change['ns']['coll']
+        key = change['documentKey']['_id']
+        if collection == 'guild_configs':
+            self.guild_configs.forget(key)
+            SYNC_CHANGES.inc(self.mode, 'config')
+            return
+
+        operation = change['operationType']
+        fields = _changed_fields(change) if operation == 'update' else None
+        # キャッシュには集計カウンターを含まないため、カウンターだけの更新では破棄しない
+        if fields is None or fields - {'counts'}:
+            self.event_cache.invalidate(key)
+            SYNC_CHANGES.inc(self.mode, 'invalidate')
+        event = change.get('fullDocument')
+        if event and operation != 'insert' and (fields is None or 'counts' in fields):
+            self.on_counts(event)
+            SYNC_CHANGES.inc(self.mode, 'counts')
+
+    async def _poll(self):
+        self.mode = 'polling'
+        counts = None
+        while True:
+            try:
+                await self._poll_event_cache()
+                invalidated = await self.guild_configs.refresh()
+                if invalidated:
+                    SYNC_CHANGES.inc(self.mode, 'config', amount=invalidated)
+                counts = await self._poll_counts(counts)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Polling for changes failed')
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll_event_cache(self):
+        """キャッシュしたイベントをDBと比べ、変更・削除されたものを破棄する"""
+        entries = self.event_cache.snapshot()
+        if not entries:
+            return
+        cursor = self.db['events'].find({'_id': {'$in': [key for key, _ in entries]}}, projection={'counts': 0})
+        current = {event['_id']: event async for event in cursor}
+        for key, cached in entries:
+            if current.get(key) != cached:
+                self.event_cache.invalidate(key)
+                SYNC_CHANGES.inc(self.mode, 'invalidate')
+
+    async def _poll_counts(self, previous):
+        """
+        担当するサーバーの受付中のイベントの集計カウンターを前回と比べ、変わったものの更新を依頼する
+        今回読み込んだカウンターを返す（次回の比較に使う）
+        """
+        cursor = self.db['events'].find(
+            {'guild_id': {'$in': list(self.guild_ids())}, 'closed': {'$ne': True}, 'message_id': {'$exists': True}},
+            projection={'guild_id': 1, 'channel_id': 1, 'message_id': 1, 'counts': 1}
+        )
+        latest = {}
+        async for event in cursor:
+            latest[event['_id']] = event.get('counts')
+            # 初めて見たイベントは比べる相手がないため、次回から比べる
+            if previous and event['_id'] in previous and previous[event['_id']] != latest[event['_id']]:
+                self.on_counts(event)
+                SYNC_CHANGES.inc(self.mode, 'counts')
+        return latest
@@ -0,0 +1,119 @@
+# 時間オプションの解析と回答のビットマスク
+# 時間オプションは作成時に日本時間の開始・終了日時（slots）に変換して保存する。
+#   "13:00"                   イベント日の13時
+#   "13:00-15:00"             イベント日の13時から15時（終了が開始より前なら翌日の終了とみなす）
+#   "2025-05-21 13:00-15:00"  日付付き（複数日にまたがるイベント用。コマンドでは日付と時間を別々に書いてもよい）
+# 上記の形式でない自由な文字列（"午前" など）も使えるが、その場合は日時を持たない。
+#
+# 回答は選んだ時間オプションの番号をビットにした整数（selected_mask）で保存する。
+# MongoDBの整数は64ビット（符号付き）なので、時間オプションは63個までとする。
+
+import re
+from datetime import datetime, timedelta
+
+from database import JST
+
+MAX_TIME_OPTIONS = 63
+# 曜日を指定するときの文字（datetime.weekday() と同じく月曜日が0）
+WEEKDAYS = '月火水木金土日'
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+TIME_OPTION_PATTERN = re.compile(
+    r'^(?:(?P<date>\d{4}-\d{2}-\d{2})[ T_])?(?P<start>\d{1,2}:\d{2})(?:[-~〜](?P<end>\d{1,2}:\d{2}))?$'
+)
+
+
+def _at(day, hhmm):
+    hour, minute = (int(part) for part in hhmm.split(':'))
+    if hour > 23 or minute > 59:
+        raise ValueError(hhmm)
+    return JST.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+
+def parse_slot(option, event_date):
+    """
+    時間オプション1件を {'start': 開始日時, 'end': 終了日時} に変換する
+    解釈できない文字列は開始・終了ともNoneにする
+    """
+    match = TIME_OPTION_PATTERN.match(option)
+    if not match:
+        return {'start': None, 'end': None}
+    try:
+        day = datetime.strptime(match['date'], '%Y-%m-%d') if match['date'] else event_date.astimezone(JST)
+        start = _at(day, match['start'])
+        end = _at(day, match['end']) if match['end'] else None
+    except ValueError:
+        return {'start': None, 'end': None}
+    if end is not None and end <= start:
+        # "22:00-02:00" のように日付をまたぐ場合
+        end += timedelta(days=1)
+    return {'start': start, 'end': end}
+
+
+def join_time_options(tokens):
+    """
+    スペース区切りで分かれた時間オプションのうち、日付だけのトークンを直後の時間とつなげる
+    例: ["2025-05-21", "13:00-15:00", "17:00"] -> ["2025-05-21 13:00-15:00", "17:00"]
+    """
+    options = []
+    pending_date = None
+    for token in tokens:
+        if DATE_PATTERN.match(token) and pending_date is None:
+            pending_date = token
+            continue
+        if pending_date is not None:
+            token = f"{pending_date} {token}"
+            pending_date = None
+        options.append(token)
+    if pending_date is not None:
+        options.append(pending_date)
+    return options
+
+
+def parse_time_options(tokens, event_date):
+    """時間オプションの表示用の文字列のリストと、日時のリスト（slots）を返す"""
+    options = join_time_options(tokens)
+    return options, [parse_slot(option, event_date) for option in options]
+
+
+def option_start(event, index):
+    """時間オプションの開始日時を返す（日時を持たないオプション・旧形式のイベントは文字列から解釈する）"""
+    slots = event.get('slots')
+    if slots:
+        return slots[index]['start']
+    return parse_slot(event['time_options'][index], event['date'])['start']
+
+
+def option_end(event, index):
+    """時間オプションの終了日時を返す（終了時刻がなければ開始日時、日時を持たなければNone）"""
+    slots = event.get('slots')
+    slot = slots[index] if slots else parse_slot(event['time_options'][index], event['date'])
+    return slot['end'] or slot['start']
+
+
+def mask_from_indices(indices):
+    mask = 0
+    for index in indices:
+        mask |= 1 << index
+    return mask
+
+
+def indices_from_mask(mask):
+    """ビットマスクの立っているビットの番号を小さい順に返す"""
+    indices = []
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length() - 1)
+        mask ^= low
+    return indices
+
+
+def selected_labels(event, mask):
+    """ビットマスクを時間オプションの表示用の文字列のリストにする"""
+    return [event['time_options'][i] for i in indices_from_mask(mask) if i < len(event['time_options'])]
+
+
+def mask_from_times(event, selected_times):
+    """旧形式の回答（時間の文字列のリスト）をビットマスクにする（移行用）"""
+    selected = set(selected_times)
+    return mask_from_indices(i for i, time in enumerate(event['time_options']) if time in selected)
@@ -0,0 +1,191 @@
+# コマンドのトレース（フェーズごとの所要時間の計測）とプロファイリング
+# コマンドごとに parse / db_read / db_write / render / send の時間を計測し、JSON形式でログに出力する
+#
+# COMMAND_PROFILE にコマンド名（カンマ区切り、* で全コマンド）を指定すると、
+# COMMAND_PROFILE_RATE の割合でcProfileを有効にし、COMMAND_PROFILE_DIR に .prof ファイルを書き出す
+# （python -m pstats や snakeviz で確認できる）
+
+import cProfile
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import discord
+
+logger = logging.getLogger('schedule_bot.trace')
+
+_current_trace = contextvars.ContextVar('command_trace', default=None)
+
+# プロファイラは同時に1つしか有効にできないため、実行中のものを覚えておく
+_active_profiler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """ログレコードを1行のJSONとして出力する"""
+
+    def format(self, record):
+        payload = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        payload.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None):
+    """
+    Bot全体のロギングを設定する
+    通常のログはdiscord.pyと同じ形式、トレースはJSON形式で標準出力に出す
+    """
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    discord.utils.setup_logging(level=logging.getLevelName(level), root=True)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.propagate = False
+
+
+class ProfileSettings:
+    def __init__(self, commands, rate, directory):
+        self.commands = commands
+        self.rate = rate
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls):
+        commands = {name.strip() for name in os.getenv('COMMAND_PROFILE', '').split(',') if name.strip()}
+        return cls(
+            commands,
+            float(os.getenv('COMMAND_PROFILE_RATE', '1.0')),
+            os.getenv('COMMAND_PROFILE_DIR', 'profiles')
+        )
+
+    def should_profile(self, command):
+        if not self.commands or ('*' not in self.commands and command not in self.commands):
+            return False
+        return random.random() < self.rate
+
+
+profile_settings = ProfileSettings.from_env()
+
+
+class CommandTrace:
+    """
+    1回のコマンド実行のトレース
+    フェーズは入れ子にでき、内側のフェーズの時間は外側のフェーズから除かれる
+    """
+
+    def __init__(self, command, source, **fields):
+        self.command = command
+        self.source = source
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._stack = []
+        self.profiler = None
+        self.finished = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            # 外側のフェーズを一時停止する
+            outer_name, resumed = self._stack[-1]
+            self.add(outer_name, now - resumed)
+        self._stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, resumed = self._stack.pop()
+            self.add(name, now - resumed)
+            if self._stack:
+                self._stack[-1] = (self._stack[-1][0], now)
+
+    def start_profiler(self):
+        global _active_profiler
+        if _active_profiler is not None:
+            return
+        self.profiler = _active_profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def finish(self, status):
+        global _active_profiler
+        if self.finished:
+            return None
+        self.finished = True
+        duration = time.perf_counter() - self.started
+        fields = {
+            'command': self.command,
+            'source': self.source,
+            'status': status,
+            'duration_ms': round(duration * 1000, 3),
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            'other_ms': round((duration - sum(self.phases.values())) * 1000, 3),
+            **self.fields,
+        }
+        if self.profiler is not None:
+            # cProfileはスレッド全体を計測するため、同時に動いていたコルーチンの時間も含まれる
+            self.profiler.disable()
+            _active_profiler = None
+            os.makedirs(profile_settings.directory, exist_ok=True)
+            path = os.path.join(
+                profile_settings.directory,
+                f"{self.command}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.prof"
+            )
+            self.profiler.dump_stats(path)
+            fields['profile'] = path
+        logger.info('command finished', extra={'fields': fields})
+        return duration
+
+
+def start_trace(command, source, **fields):
+    """トレースを開始し、現在のコンテキスト（コマンドを実行するタスク）に設定する"""
+    trace = CommandTrace(command, source, **fields)
+    if profile_settings.should_profile(command):
+        trace.start_profiler()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """現在のトレースにフェーズを記録する（トレース外では何もしない）"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.phase(name):
+        yield
+
+
+def traced_phase(name):
+    """非同期関数の実行時間をフェーズとして記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with phase(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,114 @@
+# 回答の書き込みバッファ（write-behind）
+# 回答をメモリに溜めておき、件数または時間のしきい値でbulk_writeにまとめて書き込む
+# 同じユーザーが同じイベントに何度回答しても、書き込みは最新の1件だけになる
+
+import asyncio
+import logging
+from datetime import datetime
+
+from database import JST
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseWriteBuffer:
+    """
+    回答のupsertをまとめて書き込むバッファ
+    add()はメモリに積むだけですぐ戻るため、ユーザーへの返信を待たせない
+    """
+
+    def __init__(self, repository, max_batch=100, flush_interval=1.0):
+        self.repository = repository
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._flushing = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.flushed = 0
+        self.coalesced = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """バックグラウンドのフラッシュを止め、残っている回答をすべて書き込む"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def add(self, event, user_id, username, selected_mask):
+        key = (event['_id'], user_id)
+        queued = self._pending.get(key)
+        if queued:
+            self.coalesced += 1
+        self._pending[key] = {
+            'event': event,
+            'user_id': user_id,
+            'username': username,
+            'selected_mask': selected_mask,
+            'updated_at': datetime.now(JST)
+        }
+        if queued and 'previous_mask' in queued:
+            # 失敗した書き込みの分のカウンターはまだ反映されていないため、元の選択からの差分にする
+            self._pending[key]['previous_mask'] = queued['previous_mask']
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def toggle(self, event, user_id, username, bit, current):
+        """
+        未書き込みの回答があればその選択を、なければcurrent（DBの選択）をbitで反転して積み、反転後の選択を返す
+        awaitを挟まずに読み書きするため、同じユーザーの続けてのクリックも順に反映される
+        """
+        pending = self.pending_selection(event['_id'], user_id)
+        selected_mask = (current if pending is None else pending) ^ bit
+        self.add(event, user_id, username, selected_mask)
+        return selected_mask
+
+    def pending_selection(self, event_id, user_id):
+        """まだ書き込まれていない回答の選択（ビットマスク）を返す（なければNone）"""
+        key = (event_id, user_id)
+        response = self._pending.get(key) or self._flushing.get(key)
+        return response['selected_mask'] if response else None
+
+    async def flush(self):
+        """溜まっている回答を書き込む（同時に呼ばれても1つずつ実行する）"""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                await self.repository.save_responses(list(batch.values()))
+            except Exception:
+                # 書き込み中に届いた新しい回答を優先して、失敗した分を戻す
+                # 回答だけ書き込まれていても、記録した更新前の選択（previous_mask）からの差分で再試行する
+                for key, response in batch.items():
+                    newer = self._pending.get(key)
+                    if newer is None:
+                        self._pending[key] = response
+                    elif 'previous_mask' in response:
+                        newer['previous_mask'] = response['previous_mask']
+                raise
+            finally:
+                self._flushing = {}
+            self.flushed += len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Error flushing %d buffered responses', len(self._pending))
@@ -0,0 +1,60 @@
+# テストの共通設定
+# Botと同じく src/ のモジュールを直接importする（pyproject.toml の pythonpath で src/ を追加している）。
+# DBを使うテストは mongomock_motor のインメモリのMongoDBで ScheduleRepository をそのまま動かす。
+# mongomock_motor はpymongoの非同期クライアントと次の点が違うため、テストの間だけ合わせる。
+#   - aggregate() の戻り値をawaitできない（pymongoの AsyncCollection.aggregate はコルーチン）
+#   - pymongo 4.13 の UpdateOne が bulk_write で渡す sort 引数を受け付けない
+#   - 更新演算子 $bit に対応していない
+#   - hello コマンドがないため、トランザクションは使えないものとして扱う
+
+import asyncio
+
+import pytest
+
+from database import ScheduleRepository
+
+
+def run(coroutine):
+    """コルーチンを新しいイベントループで実行する"""
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    import mongomock
+    import database
+
+    class Client(mongomock_motor.AsyncMongoMockClient):
+        def __init__(self, uri, tzinfo=None, **options):
+            super().__init__(uri, **options)
+
+    def latent_await(self):
+        return self
+        yield
+
+    find_one_and_update = mongomock.collection.Collection.find_one_and_update
+
+    def find_one_and_update_with_bit(self, filter, update, *args, **kwargs):
+        if '$bit' in update:
+            update = dict(update)
+            current = (self.find_one(filter) or {})
+            update['$set'] = dict(update.get('$set') or {})
+            for field, operation in update.pop('$bit').items():
+                update['$set'][field] = current.get(field, 0) ^ operation['xor']
+        return find_one_and_update(self, filter, update, *args, **kwargs)
+
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+
+    async def no_transactions(self):
+        return False
+
+    monkeypatch.setattr(database, 'AsyncMongoClient', Client)
+    monkeypatch.setattr(mongomock_motor.AsyncLatentCommandCursor, '__await__', latent_await, raising=False)
+    monkeypatch.setattr(mongomock.collection.Collection, 'find_one_and_update', find_one_and_update_with_bit)
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, 'add_update', add_update_without_sort)
+    monkeypatch.setattr(ScheduleRepository, 'supports_transactions', no_transactions)
+    return ScheduleRepository('mongodb://localhost')
@@ -0,0 +1,31 @@
+import pytest
+
+from availability import MAX_PROFILE_SLOTS, format_profile, parse_profile
+
+
+def test_parse_profile_applies_times_to_preceding_weekdays():
+    assert parse_profile(['水土', '21:00', '日', '13:00', '15:30']) == {
+        '2-21:00', '5-21:00', '6-13:00', '6-15:30'
+    }
+
+
+def test_format_profile():
+    assert format_profile({'5-21:00', '2-22:00', '2-21:00'}) == '水 21:00, 22:00 / 土 21:00'
+
+
+@pytest.mark.parametrize('tokens', [
+    ['21:00'],
+    ['水', '21時'],
+    ['水', '24:00'],
+    ['水', '21:00-22:00'],
+    ['水', '2025-05-21 21:00'],
+])
+def test_parse_profile_rejects_invalid(tokens):
+    with pytest.raises(ValueError):
+        parse_profile(tokens)
+
+
+def test_parse_profile_limits_slots():
+    times = [f'{hour:02d}:{minute:02d}' for hour in range(24) for minute in (0, 30)]
+    with pytest.raises(ValueError):
+        parse_profile(['月火水', *times[:MAX_PROFILE_SLOTS // 3 + 1]])
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from cache import EventCache
+from conftest import run
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_expires_entries():
+    clock = Clock()
+    cache = EventCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10.0
+    assert cache.get('a') is None
+    assert cache.expirations == 1
+
+
+def test_lru_evicts_least_recently_used():
+    cache = EventCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_get_or_load_coalesces_concurrent_loads():
+    cache = EventCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return {'title': 'x'}
+
+    async def load_twice():
+        return await asyncio.gather(cache.get_or_load('a', loader), cache.get_or_load('a', loader))
+
+    assert run(load_twice()) == [{'title': 'x'}, {'title': 'x'}]
+    assert len(calls) == 1
+    assert cache.get('a') == {'title': 'x'}
+
+
+def test_invalidate_during_load_does_not_cache_stale_value():
+    cache = EventCache()
+
+    async def load_and_invalidate():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def loader():
+            started.set()
+            await release.wait()
+            return 'stale'
+
+        task = asyncio.create_task(cache.get_or_load('a', loader))
+        await started.wait()
+        cache.invalidate('a')
+        release.set()
+        return await task
+
+    assert run(load_and_invalidate()) == 'stale'
+    assert cache.get('a') is None
+
+
+def test_none_and_errors_are_not_cached():
+    cache = EventCache()
+
+    async def missing():
+        return None
+
+    async def failing():
+        raise RuntimeError('db down')
+
+    assert run(cache.get_or_load('a', missing)) is None
+    with pytest.raises(RuntimeError):
+        run(cache.get_or_load('a', failing))
+    assert cache.stats()['size'] == 0
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from conftest import run
+from database import JST, add_mask_counts, count_increments
+
+
+def test_count_increments_only_changed_bits():
+    assert count_increments(0b0101, 0b0110) == {'counts.0': -1, 'counts.1': 1}
+
+
+def test_count_increments_unchanged():
+    assert count_increments(0b1010, 0b1010) == {}
+
+
+def test_count_increments_high_bit():
+    assert count_increments(0, 1 << 62) == {'counts.62': 1}
+
+
+def test_add_mask_counts_ignores_bits_beyond_options():
+    counts = [0, 0, 0]
+    add_mask_counts(counts, 0b1101, count=2)
+    assert counts == [2, 0, 2]
+
+
+def create_event(repository, time_options=('13:00', '14:00', '15:00')):
+    async def create():
+        event_id = await repository.create_event(
+            1, 2, 3, 'テスト', JST.localize(datetime(2030, 1, 1)), list(time_options)
+        )
+        return await repository.get_event(event_id)
+    return run(create())
+
+
+def test_toggle_response_flips_bit_and_counts(repository):
+    event = create_event(repository)
+
+    async def toggle():
+        masks = [
+            await repository.toggle_response(event, 10, 'alice', 0),
+            await repository.toggle_response(event, 10, 'alice', 1),
+            await repository.toggle_response(event, 10, 'alice', 0),
+        ]
+        return masks, (await repository.get_event_with_counts(event['_id']))['counts']
+
+    masks, counts = run(toggle())
+    assert masks == [0b01, 0b11, 0b10]
+    assert counts == [0, 1, 0]
+
+
+def test_rebuild_counts_matches_incremental_counts(repository):
+    event = create_event(repository)
+
+    async def save_and_rebuild():
+        await repository.save_response(event, 10, 'alice', 0b011)
+        await repository.save_response(event, 11, 'bob', 0b110)
+        await repository.save_response(event, 10, 'alice', 0b001)
+        incremental = (await repository.get_event_with_counts(event['_id']))['counts']
+        return incremental, await repository.rebuild_counts(event)
+
+    incremental, rebuilt = run(save_and_rebuild())
+    assert incremental == rebuilt == [1, 1, 1]
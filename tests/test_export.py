@@ -0,0 +1,46 @@
+import pytest
+
+from conftest import run
+from export import CsvImportError, _option_columns, iter_csv_lines, iter_import_rows
+
+OPTIONS = ['13:00', '午後', '13:00']
+
+
+def test_option_columns_numbered_duplicate_labels():
+    header = ['user_id', 'username', '1. 13:00', '2. 午後', '3. 13:00', 'updated_at']
+    assert _option_columns(header, OPTIONS) == [(2, 0), (3, 1), (4, 2)]
+
+
+def test_option_columns_unnumbered_duplicate_labels_in_order():
+    header = ['user_id', '13:00', '午後', '13:00']
+    assert _option_columns(header, OPTIONS) == [(1, 0), (2, 1), (3, 2)]
+
+
+def test_option_columns_mixed_numbered_and_unnumbered():
+    # 番号付きの列が取った時間オプションは、番号のない同じ見出しに割り当てない
+    header = ['user_id', '3. 13:00', '13:00']
+    assert _option_columns(header, OPTIONS) == [(1, 2), (2, 0)]
+
+
+def test_option_columns_ignores_unknown_columns():
+    header = ['user_id', '9. 13:00', '2. 13:00', '18:00']
+    assert _option_columns(header, OPTIONS) == []
+
+
+def test_csv_export_round_trip():
+    event = {'time_options': OPTIONS}
+
+    async def responses():
+        yield {'user_id': 10, 'username': 'alice', 'selected_mask': 0b100}
+        yield {'user_id': 11, 'username': 'bob', 'selected_mask': 0b011}
+
+    async def export():
+        return [line async for line in iter_csv_lines(event, responses())]
+
+    lines = run(export())
+    assert list(iter_import_rows(event, lines)) == [(10, 'alice', 0b100), (11, 'bob', 0b011)]
+
+
+def test_import_requires_user_id_column():
+    with pytest.raises(CsvImportError):
+        list(iter_import_rows({'time_options': OPTIONS}, ['username,13:00\n']))
@@ -0,0 +1,31 @@
+import pytest
+
+from conftest import run
+from guild_config import DEFAULT_CONFIG, GuildConfigStore
+
+
+@pytest.fixture
+def store(repository):
+    return GuildConfigStore(repository.db['guild_configs'])
+
+
+def test_update_converts_command_strings(store):
+    config = run(store.update(1, prefix=' ? ', close_hours_before='24'))
+    assert config == {**DEFAULT_CONFIG, 'prefix': '?', 'close_hours_before': 24}
+
+
+@pytest.mark.parametrize('settings', [
+    {'close_hours_before': '-5'},
+    {'archive_days_after': -1},
+    {'remind_minutes_before': '10081'},
+    {'close_hours_before': '1.5'},
+    {'prefix': ''},
+    {'prefix': '   '},
+    {'prefix': '! !'},
+    {'prefix': 'toolong'},
+    {'unknown': 1},
+])
+def test_update_rejects_invalid_settings(store, settings):
+    with pytest.raises(ValueError):
+        run(store.update(1, **settings))
+    assert run(store.get(1)) == DEFAULT_CONFIG
@@ -0,0 +1,31 @@
+from outbound import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_spaces_out():
+    clock = Clock()
+    bucket = TokenBucket(5, 5.0, clock=clock)
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    assert bucket.reserve() == 1.0
+    assert bucket.reserve() == 2.0
+
+
+def test_token_bucket_refills_over_time():
+    clock = Clock()
+    bucket = TokenBucket(5, 5.0, clock=clock)
+    for _ in range(5):
+        bucket.reserve()
+    assert not bucket.is_full()
+    clock.now = 2.0
+    assert bucket.reserve() == 0.0
+    clock.now = 100.0
+    assert bucket.is_full()
+    # 溜まるトークンはrate個まで
+    assert [bucket.reserve() for _ in range(6)] == [0.0] * 5 + [1.0]
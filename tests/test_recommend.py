@@ -0,0 +1,45 @@
+from recommend import AvailabilityMatrix, UserIndex, rank_combinations, rank_options
+
+
+def matrix(*bits):
+    return AvailabilityMatrix({'time_options': [str(i) for i in range(len(bits))]}, list(bits))
+
+
+def test_rank_options_orders_by_count_then_index():
+    assert rank_options(matrix(0b011, 0b111, 0b101, 0b001)) == [(1, 3), (0, 2), (2, 2), (3, 1)]
+
+
+def test_rank_options_required_and_quorum():
+    options = matrix(0b011, 0b111, 0b101, 0b001)
+    assert rank_options(options, required_mask=0b100) == [(1, 3), (2, 2)]
+    assert rank_options(options, quorum=3) == [(1, 3)]
+    assert rank_options(options, limit=2) == [(1, 3), (0, 2)]
+
+
+def test_rank_combinations():
+    first = matrix(0b0111, 0b1100)
+    second = matrix(0b0011, 0b1110)
+    assert rank_combinations([first, second]) == [
+        ((0, 0), 2), ((0, 1), 2), ((1, 1), 2), ((1, 0), 0)
+    ]
+
+
+def test_rank_combinations_required_and_quorum():
+    first = matrix(0b0111, 0b1100)
+    second = matrix(0b0011, 0b1110)
+    assert rank_combinations([first, second], required_mask=0b1000) == [((1, 1), 2)]
+    assert rank_combinations([first, second], quorum=3) == []
+
+
+def test_rank_combinations_beam_keeps_best():
+    first = matrix(0b0001, 0b1111)
+    second = matrix(0b1111, 0b0001)
+    assert rank_combinations([first, second], beam_width=1) == [((1, 0), 4)]
+
+
+def test_user_index_mask():
+    users = UserIndex()
+    for user_id in (100, 200, 300):
+        users.position(user_id)
+    assert users.mask([100, 300]) == 0b101
+    assert users.mask([100, 400]) is None
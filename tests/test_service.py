@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import run
+from database import JST
+from service import ScheduleService, ServiceError, event_timers, parse_event_date, parse_time_indices
+from timeslots import parse_time_options
+from write_buffer import ResponseWriteBuffer
+
+CONFIG = {'close_hours_before': 2, 'archive_days_after': 7}
+NOW = JST.localize(datetime(2025, 5, 1, 12, 0))
+
+
+def at(year, month, day, hour=0, minute=0):
+    return JST.localize(datetime(year, month, day, hour, minute))
+
+
+def make_event(date, tokens, **fields):
+    event_date = parse_event_date(date)
+    time_options, slots = parse_time_options(tokens, event_date)
+    return {'date': event_date, 'time_options': time_options, 'slots': slots, **fields}
+
+
+def test_parse_time_indices():
+    event = make_event('2025-05-20', ['13:00', '14:00', '15:00'])
+    assert parse_time_indices(event, ['1', '3']) == 0b101
+    assert parse_time_indices(event, []) == 0
+
+
+@pytest.mark.parametrize('indices', [['0'], ['4'], ['a']])
+def test_parse_time_indices_rejects_invalid(indices):
+    event = make_event('2025-05-20', ['13:00', '14:00', '15:00'])
+    with pytest.raises(ServiceError):
+        parse_time_indices(event, indices)
+
+
+def test_event_timers_close_before_first_option():
+    event = make_event('2025-05-20', ['15:00', '13:00'])
+    assert event_timers(event, CONFIG, NOW) == [
+        ('close', at(2025, 5, 20, 11)),
+        ('archive', at(2025, 5, 27, 15)),
+    ]
+
+
+def test_event_timers_archive_after_last_option():
+    event = make_event('2030-01-01', ['13:00', '2030-02-01', '13:00-15:00'])
+    assert event_timers(event, CONFIG, NOW)[-1] == ('archive', at(2030, 2, 8, 15))
+
+
+def test_event_timers_without_datetimes_uses_event_date():
+    event = make_event('2025-05-20', ['午前', '午後'])
+    assert event_timers(event, CONFIG, NOW) == [
+        ('close', at(2025, 5, 19, 22)),
+        ('archive', at(2025, 5, 27)),
+    ]
+
+
+def test_event_timers_closes_at_start_when_close_has_passed():
+    now = at(2025, 5, 20, 12)
+    event = make_event('2025-05-20', ['13:00'])
+    assert event_timers(event, CONFIG, now)[0] == ('close', at(2025, 5, 20, 13))
+
+
+def test_event_timers_past_event():
+    event = make_event('2025-04-01', ['13:00'])
+    assert event_timers(event, CONFIG, NOW) == []
+    # 既存のイベントの補完では、アーカイブだけすぐに実行する
+    assert event_timers(event, CONFIG, NOW, overdue_archive=True) == [('archive', NOW)]
+
+
+def test_event_timers_closed_event_only_archives():
+    event = make_event('2025-05-20', ['13:00'], closed=True)
+    assert [kind for kind, _ in event_timers(event, CONFIG, NOW)] == ['archive']
+
+
+class GuildConfigs:
+    async def get(self, guild_id):
+        return CONFIG
+
+
+@pytest.mark.parametrize('buffered', [False, True])
+def test_toggle_keeps_concurrent_clicks(repository, buffered):
+    async def click_twice():
+        import asyncio
+
+        write_buffer = ResponseWriteBuffer(repository) if buffered else None
+        service = ScheduleService(repository, GuildConfigs(), write_buffer=write_buffer)
+        event = await service.create_event(1, 2, 3, 'テスト', '2030-01-01', ['13:00', '14:00', '15:00'])
+        await asyncio.gather(
+            service.toggle(1, str(event['_id']), 10, 'alice', 0),
+            service.toggle(1, str(event['_id']), 10, 'alice', 1),
+        )
+        event = await service.results(1, str(event['_id']))
+        return event['counts'], await repository.get_selected_mask(event['_id'], 10)
+
+    counts, mask = run(click_twice())
+    assert mask == 0b11
+    assert counts == [1, 1, 0]
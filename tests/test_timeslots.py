@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from database import JST
+from timeslots import join_time_options, option_end, option_start, parse_time_options
+
+EVENT_DATE = JST.localize(datetime(2025, 5, 20))
+
+
+def at(year, month, day, hour, minute=0):
+    return JST.localize(datetime(year, month, day, hour, minute))
+
+
+def test_join_time_options_attaches_date_to_next_time():
+    tokens = ['2025-05-21', '13:00-15:00', '17:00']
+    assert join_time_options(tokens) == ['2025-05-21 13:00-15:00', '17:00']
+
+
+def test_join_time_options_keeps_trailing_date():
+    assert join_time_options(['13:00', '2025-05-21']) == ['13:00', '2025-05-21']
+
+
+def test_parse_time_options():
+    options, slots = parse_time_options(['13:00', '22:00-02:00', '2025-05-21', '10:00-11:30', '午前'], EVENT_DATE)
+    assert options == ['13:00', '22:00-02:00', '2025-05-21 10:00-11:30', '午前']
+    assert slots == [
+        {'start': at(2025, 5, 20, 13), 'end': None},
+        # 終了が開始より前なら翌日
+        {'start': at(2025, 5, 20, 22), 'end': at(2025, 5, 21, 2)},
+        {'start': at(2025, 5, 21, 10), 'end': at(2025, 5, 21, 11, 30)},
+        {'start': None, 'end': None},
+    ]
+
+
+def test_parse_time_options_rejects_invalid_time():
+    _, slots = parse_time_options(['25:00'], EVENT_DATE)
+    assert slots == [{'start': None, 'end': None}]
+
+
+def test_option_start_and_end_without_slots():
+    # 旧形式のイベントは文字列から解釈する
+    event = {'date': EVENT_DATE, 'time_options': ['13:00', '14:00-16:00', '午後']}
+    assert [option_start(event, i) for i in range(3)] == [at(2025, 5, 20, 13), at(2025, 5, 20, 14), None]
+    assert [option_end(event, i) for i in range(3)] == [at(2025, 5, 20, 13), at(2025, 5, 20, 16), None]
@@ -0,0 +1,93 @@
+import pytest
+
+from conftest import run
+from write_buffer import ResponseWriteBuffer
+
+EVENT = {'_id': 'event'}
+
+
+class FlakyRepository:
+    """save_responsesが指定した回数だけ失敗するリポジトリ"""
+
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.saved = []
+
+    async def save_responses(self, responses):
+        for response in responses:
+            response.setdefault('previous_mask', 0)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('write failed')
+        self.saved.append([(r['user_id'], r['selected_mask'], r['previous_mask']) for r in responses])
+
+
+def test_add_coalesces_same_user():
+    repository = FlakyRepository(failures=0)
+    buffer = ResponseWriteBuffer(repository)
+    buffer.add(EVENT, 10, 'alice', 0b01)
+    buffer.add(EVENT, 10, 'alice', 0b11)
+    run(buffer.flush())
+    assert repository.saved == [[(10, 0b11, 0)]]
+    assert buffer.coalesced == 1
+
+
+def test_failed_flush_requeues_batch():
+    repository = FlakyRepository()
+    buffer = ResponseWriteBuffer(repository)
+    buffer.add(EVENT, 10, 'alice', 0b01)
+    with pytest.raises(RuntimeError):
+        run(buffer.flush())
+    assert buffer.pending_selection('event', 10) == 0b01
+    run(buffer.flush())
+    assert repository.saved == [[(10, 0b01, 0)]]
+    assert buffer.pending_selection('event', 10) is None
+
+
+def test_failed_flush_keeps_newer_response_and_previous_mask():
+    repository = FlakyRepository()
+    buffer = ResponseWriteBuffer(repository)
+    buffer.add(EVENT, 10, 'alice', 0b01)
+    with pytest.raises(RuntimeError):
+        run(buffer.flush())
+    # 失敗後に届いた回答を優先し、カウンターは最初の書き込み前の選択からの差分にする
+    buffer.add(EVENT, 10, 'alice', 0b10)
+    run(buffer.flush())
+    assert repository.saved == [[(10, 0b10, 0)]]
+
+
+def test_toggle_uses_pending_selection():
+    buffer = ResponseWriteBuffer(FlakyRepository(failures=0))
+    assert buffer.toggle(EVENT, 10, 'alice', 0b01, current=0b100) == 0b101
+    # 未書き込みの回答があればDBの値（current）は使わない
+    assert buffer.toggle(EVENT, 10, 'alice', 0b10, current=0) == 0b111
+
+
+def test_retry_after_partial_write_keeps_counts(repository, monkeypatch):
+    """回答だけ書き込まれてカウンターの更新が失敗しても、再試行でカウンターが合う"""
+    from datetime import datetime
+
+    from database import JST
+
+    async def scenario():
+        event_id = await repository.create_event(1, 2, 3, 'テスト', JST.localize(datetime(2030, 1, 1)), ['13:00', '14:00'])
+        event = await repository.get_event(event_id)
+        await repository.save_response(event, 10, 'alice', 0b01)
+
+        buffer = ResponseWriteBuffer(repository)
+        buffer.add(event, 10, 'alice', 0b10)
+        bulk_write = repository.events.bulk_write
+
+        async def fail_once(*args, **kwargs):
+            monkeypatch.setattr(repository.events, 'bulk_write', bulk_write)
+            raise RuntimeError('connection reset')
+
+        monkeypatch.setattr(repository.events, 'bulk_write', fail_once)
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        # 回答はもう書き込まれている
+        assert await repository.get_selected_mask(event_id, 10) == 0b10
+        await buffer.flush()
+        return (await repository.get_event_with_counts(event_id))['counts']
+
+    assert run(scenario()) == [0, 1]